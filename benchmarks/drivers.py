@@ -0,0 +1,216 @@
+"""Throughput and latency of the device drivers against simulated devices.
+
+Runs each scenario against mbe.simulator devices on a local Modbus TCP server and
+records transactions per second, p50/p99 transaction latency and p50/p99/mean time
+per iteration. No hardware is needed. --latency and --baud make the simulated
+devices respond like devices on a serial bus.
+
+    python benchmarks/drivers.py --baud 9600 --latency 0.005 --output drivers.json
+    python benchmarks/drivers.py --baud 9600 --latency 0.005 --baseline drivers.json
+
+With --baseline, exits non-zero if any scenario's median iteration time is more
+than --tolerance slower than in the baseline file.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import platform
+import statistics
+import sys
+import time
+from typing import Callable
+from typing import Optional
+
+from pymodbus.client import AsyncModbusTcpClient
+from pymodbus.client import ModbusTcpClient
+from pymodbus.pdu import ModbusPDU
+
+from report import add_report_arguments
+from report import report
+
+from mbe.client_wrapper import ClientWrapper
+from mbe.engine import Bus
+from mbe.pollers import SchneiderPoller
+from mbe.pollers import TaidecentPoller
+from mbe.pollers import WaveshareRelaysPoller
+from mbe.schneider import Schneider
+from mbe.simulator import Simulator
+from mbe.taidecent import Taidecent
+from mbe.waveshare_relays import WaveShareRelayControl
+from mbe.waveshare_relays import WaveshareRelays
+
+# Iteration times shorter than this are not compared with the baseline.
+MIN_REGRESSION = 0.002
+
+
+class TimingClient(ClientWrapper):
+    """Records the duration of every transaction."""
+
+    def __init__(self, client) -> None:
+        super().__init__(client)
+        self.latencies: list[float] = []
+
+    def execute(self, no_response_expected: bool, request: ModbusPDU) -> ModbusPDU:
+        start = time.perf_counter()
+        try:
+            return self.client.execute(no_response_expected, request)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+class TimingBus(Bus):
+    """Records the duration of every transaction, including waiting for the bus."""
+
+    latencies: list[float]
+
+    def __init__(self, name: str, client) -> None:
+        super().__init__(name, client)
+        self.latencies = []
+
+    async def _execute(
+        self, no_response_expected: bool, request: ModbusPDU
+    ) -> ModbusPDU:
+        start = time.perf_counter()
+        try:
+            return await super()._execute(no_response_expected, request)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def summarize(
+    iterations: list[float], latencies: list[float], total: float
+) -> dict[str, float]:
+    result = dict(
+        iterations=len(iterations),
+        transactions=len(latencies),
+        tps=len(latencies) / total if total else 0.0,
+        mean=statistics.fmean(iterations),
+        median=percentile(iterations, 50),
+        p99=percentile(iterations, 99),
+    )
+    if latencies:
+        result["tx_p50"] = percentile(latencies, 50)
+        result["tx_p99"] = percentile(latencies, 99)
+    return result
+
+
+def run_sync(
+    client: TimingClient, iterations: int, body: Callable[[], object]
+) -> dict[str, float]:
+    client.latencies.clear()
+    times = []
+    start = time.perf_counter()
+    # The drivers print what they read.
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(iterations):
+            t = time.perf_counter()
+            body()
+            times.append(time.perf_counter() - t)
+    return summarize(times, client.latencies, time.perf_counter() - start)
+
+
+def sync_scenarios(client: TimingClient) -> dict[str, Callable[[], object]]:
+    taidecent = Taidecent(client)
+    relays = WaveshareRelays(client)
+    schneider = Schneider(client)
+    mode = [WaveShareRelayControl.Open]
+
+    def toggle_relay() -> None:
+        if mode[0] == WaveShareRelayControl.Open:
+            mode[0] = WaveShareRelayControl.Close
+        else:
+            mode[0] = WaveShareRelayControl.Open
+        relays.write_relay(relay_idx=0, mode=mode[0])
+
+    def run_loop() -> None:
+        # The body of mbe run, without its sleep.
+        taidecent.read_temperature(fahrenheit=True)
+        relays.read_all_relays()
+        toggle_relay()
+
+    return {
+        "taidecent.read_temperature": lambda: taidecent.read_temperature(),
+        "taidecent.read_registers": taidecent.read_registers,
+        "relays.read_all_relays": relays.read_all_relays,
+        "relays.write_relay": toggle_relay,
+        "schneider.read_registers": schneider.read_registers,
+        "run loop": run_loop,
+    }
+
+
+async def poll_cycles(port: int, iterations: int) -> dict[str, float]:
+    """Time cycles of the poll engine: all three devices polled concurrently."""
+    bus = TimingBus("simulator", AsyncModbusTcpClient("127.0.0.1", port=port))
+    await bus.connect()
+    pollers = [TaidecentPoller(2), WaveshareRelaysPoller(3), SchneiderPoller(12)]
+    times = []
+    start = time.perf_counter()
+    try:
+        for _ in range(iterations):
+            t = time.perf_counter()
+            await asyncio.gather(*(poller.poll(bus) for poller in pollers))
+            times.append(time.perf_counter() - t)
+    finally:
+        bus.close()
+    return summarize(times, bus.latencies, time.perf_counter() - start)
+
+
+def run(iterations: int, latency: float, baud: Optional[int]) -> dict:
+    scenarios = {}
+    with Simulator(latency=latency, baud=baud) as sim:
+        raw = ModbusTcpClient("127.0.0.1", port=sim.port)
+        client = TimingClient(raw)
+        client.connect()
+        try:
+            for name, body in sync_scenarios(client).items():
+                scenarios[name] = run_sync(client, iterations, body)
+                _print(name, scenarios[name])
+        finally:
+            client.close()
+        scenarios["poll cycle"] = asyncio.run(poll_cycles(sim.port, iterations))
+        _print("poll cycle", scenarios["poll cycle"])
+    return dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        iterations=iterations,
+        latency=latency,
+        baud=baud,
+        scenarios=scenarios,
+    )
+
+
+def _print(name: str, result: dict[str, float]) -> None:
+    s = f"{name:28} {result['tps']:8.1f} tx/s"
+    if "tx_p50" in result:
+        s += f"  tx p50 {result['tx_p50'] * 1000:6.2f} ms  p99 {result['tx_p99'] * 1000:6.2f} ms"
+    s += f"  iteration p50 {result['median'] * 1000:7.2f} ms  p99 {result['p99'] * 1000:7.2f} ms"
+    print(s, file=sys.stderr)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds each simulated device takes to respond.",
+    )
+    parser.add_argument(
+        "--baud", type=int, help="Also delay responses by serial transmission time."
+    )
+    add_report_arguments(parser)
+    args = parser.parse_args(argv)
+    results = run(args.iterations, args.latency, args.baud)
+    return report(results, args, "median", MIN_REGRESSION)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
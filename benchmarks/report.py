@@ -0,0 +1,77 @@
+"""Result files and baseline comparison shared by the benchmarks.
+
+Each benchmark produces a dict with a "commands" or "scenarios" entry mapping a
+name to its measurements, in seconds. Results are written as JSON and compared
+with a baseline file from an earlier run.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# Differences smaller than this are noise, whatever the tolerance.
+MIN_REGRESSION = 0.02
+
+
+def add_report_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--output", type=Path, help="Write results to this file.")
+    parser.add_argument("--baseline", type=Path, help="Compare with these results.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed slowdown relative to the baseline, as a fraction.",
+    )
+
+
+def _entries(results: dict) -> dict:
+    return results.get("commands") or results.get("scenarios") or {}
+
+
+def regressions(
+    current: dict,
+    baseline: dict,
+    tolerance: float,
+    metric: str,
+    min_regression: float = MIN_REGRESSION,
+) -> list[str]:
+    """Entries whose metric got slower than the baseline by more than tolerance."""
+    found = []
+    before_entries = _entries(baseline)
+    for name, result in _entries(current).items():
+        if name not in before_entries or metric not in result:
+            continue
+        before = before_entries[name][metric]
+        after = result[metric]
+        if after > before * (1 + tolerance) and after - before > min_regression:
+            found.append(
+                f"{name}: {before * 1000:.1f} ms -> {after * 1000:.1f} ms "
+                f"(+{(after / before - 1) * 100:.0f}%)"
+            )
+    return found
+
+
+def report(
+    results: dict,
+    args: argparse.Namespace,
+    metric: str,
+    min_regression: float = MIN_REGRESSION,
+) -> int:
+    """Write results and compare with the baseline. Returns the exit code."""
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+    else:
+        print(json.dumps(results, indent=2))
+    if args.baseline is None:
+        return 0
+    found = regressions(
+        results,
+        json.loads(args.baseline.read_text()),
+        args.tolerance,
+        metric,
+        min_regression,
+    )
+    for line in found:
+        print(f"REGRESSION {line}", file=sys.stderr)
+    return 1 if found else 0
@@ -0,0 +1,97 @@
+"""Cold-start time of mbe commands.
+
+Each command is run in a fresh interpreter several times and the fastest and median
+wall times are recorded. Commands are run with --help where they would otherwise
+talk to a bus, so the numbers measure import and argument parsing only. They run
+with XDG_CONFIG_HOME and XDG_CACHE_HOME in a temporary directory, so mbe config
+loads and writes a default config there rather than the user's.
+
+    python benchmarks/startup.py --output startup.json
+    python benchmarks/startup.py --baseline startup.json
+
+With --baseline, exits non-zero if any command's median is more than --tolerance
+slower than in the baseline file.
+"""
+
+import argparse
+import platform
+import statistics
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from report import add_report_arguments
+from report import report
+
+COMMANDS = [
+    [],
+    ["--help"],
+    ["config"],
+    ["sniff", "--help"],
+    ["replay", "--help"],
+    ["query", "--help"],
+    ["serve", "--help"],
+    ["run", "--help"],
+    ["poll", "--help"],
+    ["record", "--help"],
+    ["fleet", "--help"],
+    ["bridge", "--help"],
+    ["scan", "--help"],
+    ["ports", "--help"],
+    ["tai", "--help"],
+    ["tai", "read", "--help"],
+    ["rly", "--help"],
+    ["rly", "set", "--help"],
+    ["mtr", "--help"],
+    ["mtr", "read-all", "--help"],
+]
+
+
+def time_command(args: list[str], runs: int, env: dict[str, str]) -> dict[str, float]:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "mbe", *args],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=False,
+            env=env,
+        )
+        times.append(time.perf_counter() - start)
+    return dict(min=min(times), median=statistics.median(times))
+
+
+def run(runs: int) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, XDG_CONFIG_HOME=home, XDG_CACHE_HOME=home)
+        for args in COMMANDS:
+            name = " ".join(["mbe", *args])
+            results[name] = time_command(args, runs, env)
+            print(
+                f"{name:28} min {results[name]['min'] * 1000:7.1f} ms  "
+                f"median {results[name]['median'] * 1000:7.1f} ms",
+                file=sys.stderr,
+            )
+    return dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        runs=runs,
+        commands=results,
+    )
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    add_report_arguments(parser)
+    args = parser.parse_args(argv)
+    return report(run(args.runs), args, "median")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,333 @@
+"""Local HTTP bridge to the bus, replacing the Node-RED flow in node-red-flows.json.
+
+Reads:
+
+    GET /<slave>/<table>/<address>[?count=N][&max_age=SECONDS]
+
+where table is coils, discrete_inputs, holding_registers or input_registers,
+answer {"slave": .., "table": .., "address": .., "values": [..], "age": ..}. age is
+the seconds since the values were read from the bus.
+
+Coil writes:
+
+    POST /<slave>/coils/<address>    body: true, or [true, false, ...]
+
+answer {"slave": .., "address": .., "written": N}.
+
+Many clients asking for the same values must not multiply the load on a slow bus.
+Identical reads (same slave, table, address and count) that arrive while one of
+them is on the bus wait for and share its result instead of queueing their own
+transactions, and a result is reused for further identical reads for `fresh`
+seconds. A request may ask for fresher values with max_age. Any write to a slave
+discards the reads of that slave being shared or reused, since the write may change
+what they would return.
+
+Modbus exception responses are answered with 502, no response with 504.
+"""
+
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Callable
+from typing import Optional
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+from pymodbus.exceptions import ModbusException
+from pymodbus.exceptions import ModbusIOException
+from pymodbus.pdu import ModbusPDU
+
+from mbe.client_wrapper import SyncClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BRIDGE_PORT = 8502
+# Seconds a read result is reused for identical reads.
+DEFAULT_FRESH = 1.0
+MAX_COUNT = 125
+
+# table -> read function code
+Tables = dict(
+    coils=0x01,
+    discrete_inputs=0x02,
+    holding_registers=0x03,
+    input_registers=0x04,
+)
+
+# (slave, function code, address, count)
+ReadKey = tuple[int, int, int, int]
+
+
+class BridgeError(Exception):
+    """A request that could not be answered, with the HTTP status to answer with."""
+
+    status: int
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class _Flight:
+    """A read on the bus whose result is shared by identical reads."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.values: Optional[list] = None
+        self.error: Optional[BridgeError] = None
+        # False once a write to the slave makes the result unsafe to reuse.
+        self.valid = True
+
+
+class Coalescer:
+    """Shares reads between concurrent identical requests and reuses recent results.
+
+    read_bus(key) performs the transaction; calls to it are serialized, so the
+    client it uses need not be thread safe.
+    """
+
+    fresh: float
+    clock: Callable[[], float]
+    # key -> (values, time read)
+    results: dict[ReadKey, tuple[list, float]]
+    flights: dict[ReadKey, _Flight]
+    transactions: int
+    shared: int
+    reused: int
+
+    def __init__(
+        self,
+        read_bus: Callable[[ReadKey], list],
+        fresh: float = DEFAULT_FRESH,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.read_bus = read_bus
+        self.fresh = fresh
+        self.clock = clock
+        self.results = {}
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.bus_lock = threading.Lock()
+        self.transactions = 0
+        self.shared = 0
+        self.reused = 0
+
+    def read(self, key: ReadKey, max_age: Optional[float] = None) -> tuple[list, float]:
+        """The values for key and their age in seconds."""
+        max_age = self.fresh if max_age is None else min(max_age, self.fresh)
+        with self.lock:
+            now = self.clock()
+            if (result := self.results.get(key)) is not None:
+                values, read_at = result
+                if now - read_at <= max_age:
+                    self.reused += 1
+                    return values, now - read_at
+            if (flight := self.flights.get(key)) is not None:
+                self.shared += 1
+                leader = False
+            else:
+                flight = self.flights[key] = _Flight()
+                leader = True
+        if leader:
+            self._fly(key, flight)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        assert flight.values is not None
+        return flight.values, 0.0
+
+    def _fly(self, key: ReadKey, flight: _Flight) -> None:
+        try:
+            with self.bus_lock:
+                self.transactions += 1
+                flight.values = self.read_bus(key)
+        except BridgeError as e:
+            flight.error = e
+        except Exception as e:
+            flight.error = BridgeError(500, str(e))
+        finally:
+            with self.lock:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+                if flight.valid and flight.values is not None:
+                    self._prune()
+                    self.results[key] = (flight.values, self.clock())
+            flight.done.set()
+
+    def _prune(self) -> None:
+        now = self.clock()
+        for key in [k for k, (_, t) in self.results.items() if now - t > self.fresh]:
+            del self.results[key]
+
+    def write(self, slave: int, write_bus: Callable[[], object]) -> object:
+        """Run write_bus on the bus, discarding shared and recent reads of slave."""
+        self.invalidate(slave)
+        try:
+            with self.bus_lock:
+                self.transactions += 1
+                return write_bus()
+        finally:
+            # Reads that started while the write waited for the bus.
+            self.invalidate(slave)
+
+    def invalidate(self, slave: int) -> None:
+        with self.lock:
+            for key in [k for k in self.results if k[0] == slave]:
+                del self.results[key]
+            for key in [k for k in self.flights if k[0] == slave]:
+                self.flights.pop(key).valid = False
+
+
+def _check(response: ModbusPDU) -> ModbusPDU:
+    if response is None or isinstance(response, ModbusIOException):
+        raise BridgeError(504, f"No response: {response}")
+    if isinstance(response, Exception):
+        raise BridgeError(502, str(response))
+    if response.isError():
+        raise BridgeError(502, f"Exception response: {response}")
+    return response
+
+
+class Bridge:
+    """Reads and writes on one bus client for the HTTP handler."""
+
+    client: SyncClient
+    coalescer: Coalescer
+
+    def __init__(self, client: SyncClient, fresh: float = DEFAULT_FRESH) -> None:
+        self.client = client
+        self.coalescer = Coalescer(self._read_bus, fresh)
+
+    def _read_bus(self, key: ReadKey) -> list:
+        slave, fc, address, count = key
+        read = {
+            0x01: self.client.read_coils,
+            0x02: self.client.read_discrete_inputs,
+            0x03: self.client.read_holding_registers,
+            0x04: self.client.read_input_registers,
+        }[fc]
+        try:
+            response = _check(read(address, count=count, slave=slave))
+        except ModbusException as e:
+            raise BridgeError(504, str(e))
+        if fc in (0x01, 0x02):
+            return [bool(b) for b in response.bits[:count]]  # type: ignore[attr-defined]
+        return list(response.registers)  # type: ignore[attr-defined]
+
+    def read(
+        self,
+        slave: int,
+        table: str,
+        address: int,
+        count: int = 1,
+        max_age: Optional[float] = None,
+    ) -> dict:
+        if table not in Tables:
+            raise BridgeError(404, f"Unknown table {table}")
+        if not 1 <= count <= MAX_COUNT:
+            raise BridgeError(400, f"count must be between 1 and {MAX_COUNT}")
+        values, age = self.coalescer.read(
+            (slave, Tables[table], address, count), max_age
+        )
+        return dict(slave=slave, table=table, address=address, values=values, age=age)
+
+    def write_coils(self, slave: int, address: int, value: bool | list[bool]) -> dict:
+        def write() -> ModbusPDU:
+            try:
+                if isinstance(value, list):
+                    return _check(self.client.write_coils(address, value, slave=slave))
+                return _check(self.client.write_coil(address, value, slave=slave))
+            except ModbusException as e:
+                raise BridgeError(504, str(e))
+
+        self.coalescer.write(slave, write)
+        written = len(value) if isinstance(value, list) else 1
+        return dict(slave=slave, address=address, written=written)
+
+    def stats(self) -> dict:
+        c = self.coalescer
+        return dict(
+            transactions=c.transactions,
+            shared=c.shared,
+            reused=c.reused,
+            fresh=c.fresh,
+        )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "BridgeServer"
+
+    def _reply(self, status: int, body: dict) -> None:
+        data = (json.dumps(body) + "\n").encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self) -> tuple[int, str, int, dict[str, list[str]]]:
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        if len(parts) != 3:
+            raise BridgeError(404, "Expected /<slave>/<table>/<address>")
+        try:
+            return int(parts[0]), parts[1], int(parts[2], 0), parse_qs(url.query)
+        except ValueError:
+            raise BridgeError(400, "slave and address must be integers")
+
+    def do_GET(self) -> None:
+        try:
+            if self.path == "/stats":
+                self._reply(200, self.server.bridge.stats())
+                return
+            slave, table, address, query = self._route()
+            count = int(query.get("count", ["1"])[0])
+            max_age = query.get("max_age")
+            self._reply(
+                200,
+                self.server.bridge.read(
+                    slave,
+                    table,
+                    address,
+                    count,
+                    None if max_age is None else float(max_age[0]),
+                ),
+            )
+        except BridgeError as e:
+            self._reply(e.status, dict(error=str(e)))
+        except ValueError as e:
+            self._reply(400, dict(error=str(e)))
+
+    def do_POST(self) -> None:
+        try:
+            slave, table, address, _ = self._route()
+            if table != "coils":
+                raise BridgeError(405, "Only coils can be written")
+            length = int(self.headers.get("Content-Length", 0))
+            value = json.loads(self.rfile.read(length) or b"null")
+            if isinstance(value, list):
+                valid = bool(value) and all(isinstance(v, bool) for v in value)
+            else:
+                valid = isinstance(value, bool)
+            if not valid:
+                raise BridgeError(400, "Body must be true, false or a list of them")
+            self._reply(200, self.server.bridge.write_coils(slave, address, value))
+        except BridgeError as e:
+            self._reply(e.status, dict(error=str(e)))
+        except ValueError as e:
+            self._reply(400, dict(error=str(e)))
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format, *args)
+
+
+class BridgeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, bridge: Bridge, host: str, port: int) -> None:
+        self.bridge = bridge
+        super().__init__((host, port), _Handler)
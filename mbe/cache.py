@@ -0,0 +1,206 @@
+"""Cache of slow-changing registers.
+
+Device modules assign registers that rarely change to a register class, e.g. in
+TaidecentRegisterClasses. MbeConfig.cache.ttl gives the seconds a register of each
+class stays cached; registers without a class or with a class that has no TTL are
+always read from the bus.
+
+CachingClient answers a read from the cache only if every register it covers is
+cached, so a block read spanning a live register always goes to the bus, and
+refreshes the cache from what the bus returns. Only the classified registers of a
+response are cached: the gaps a planned block read spans may hold live values, so
+a block read with gaps always goes to the bus.
+
+Any register write through the client invalidates the registers it covers. A write
+to a register of class "address" moves the device to a new slave id, so it
+invalidates everything cached for both the old and the new id.
+
+The cache lives in the memory of the process and make_client.make() starts a new
+one for every client it makes, so one-shot commands such as mbe tai read start
+empty and never hit it. It pays off in long-running processes: mbe bridge, and the
+daemon of mbe serve, whose cache also serves the commands that forward their
+transactions to it.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Callable
+from typing import Mapping
+from typing import Optional
+
+from pymodbus.pdu import ModbusPDU
+from pymodbus.pdu.register_read_message import ReadHoldingRegistersResponse
+from pymodbus.pdu.register_read_message import ReadInputRegistersResponse
+
+from mbe.client_wrapper import ClientWrapper
+from mbe.client_wrapper import SyncClient
+from mbe.planner import RegisterMap
+from mbe.planner import register_specs
+
+ADDRESS_CLASS = "address"
+
+DEFAULT_MAX_ENTRIES = 1024
+
+READ_RESPONSES = {
+    0x03: ReadHoldingRegistersResponse,
+    0x04: ReadInputRegistersResponse,
+}
+
+WRITE_SINGLE_REGISTER = 0x06
+WRITE_MULTIPLE_REGISTERS = 0x10
+MASK_WRITE_REGISTER = 0x16
+READ_WRITE_REGISTERS = 0x17
+
+
+class RegisterCache:
+    """LRU cache of single register values, each with the TTL of its class."""
+
+    max_entries: int
+    clock: Callable[[], float]
+    # (slave, function code, address) -> (value, expiry time)
+    entries: OrderedDict[tuple[int, int, int], tuple[int, float]]
+    # (slave, address) -> seconds
+    ttls: dict[tuple[int, int], float]
+    # (slave, address) of registers holding the slave's own id
+    address_registers: set[tuple[int, int]]
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.ttls = {}
+        self.address_registers = set()
+
+    def classify(
+        self,
+        slave: int,
+        registers: RegisterMap,
+        classes: Mapping[str, str],
+        ttls: Mapping[str, float],
+    ) -> None:
+        """Cache the registers of a device's register map whose class has a TTL."""
+        for spec in register_specs(registers):
+            register_class = classes.get(spec.name)
+            if register_class is None:
+                continue
+            for address in range(spec.address, spec.end):
+                if register_class == ADDRESS_CLASS:
+                    self.address_registers.add((slave, address))
+                if ttls.get(register_class, 0) > 0:
+                    self.ttls[(slave, address)] = ttls[register_class]
+
+    def get(
+        self, slave: int, function_code: int, address: int, count: int
+    ) -> Optional[list[int]]:
+        """The values of all count registers, if all are cached and fresh."""
+        now = self.clock()
+        values = []
+        for a in range(address, address + count):
+            key = (slave, function_code, a)
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if now >= expires:
+                del self.entries[key]
+                return None
+            values.append(value)
+        for a in range(address, address + count):
+            self.entries.move_to_end((slave, function_code, a))
+        return values
+
+    def put(
+        self, slave: int, function_code: int, address: int, values: list[int]
+    ) -> None:
+        now = self.clock()
+        for a, value in enumerate(values, start=address):
+            ttl = self.ttls.get((slave, a))
+            if ttl is None:
+                continue
+            key = (slave, function_code, a)
+            self.entries[key] = (value, now + ttl)
+            self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(
+        self, slave: int, address: Optional[int] = None, count: int = 1
+    ) -> None:
+        """Drop cached registers of slave in [address, address + count), or all of
+        them if address is None."""
+        for key in list(self.entries):
+            if key[0] == slave and (
+                address is None or address <= key[2] < address + count
+            ):
+                del self.entries[key]
+
+    def invalidate_write(self, slave: int, address: int, values: list[int]) -> None:
+        """Invalidate registers written with values starting at address."""
+        for a, value in enumerate(values, start=address):
+            if (slave, a) in self.address_registers:
+                self.invalidate(slave)
+                self.invalidate(value)
+                return
+        self.invalidate(slave, address, len(values))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def _written(request: ModbusPDU) -> Optional[tuple[int, list[int]]]:
+    """The start address and values of a register write request."""
+    fc = request.function_code
+    if fc == WRITE_SINGLE_REGISTER:
+        return request.address, [request.value]  # type: ignore[attr-defined]
+    if fc == WRITE_MULTIPLE_REGISTERS:
+        return request.address, list(request.values)  # type: ignore[attr-defined]
+    if fc == MASK_WRITE_REGISTER:
+        # The resulting value is unknown, so nothing can match an address write.
+        return request.address, [-1]  # type: ignore[attr-defined]
+    if fc == READ_WRITE_REGISTERS:
+        return request.write_address, list(request.write_registers)  # type: ignore[attr-defined]
+    return None
+
+
+class CachingClient(ClientWrapper):
+    """Serves reads of cached registers without a transaction on the bus."""
+
+    cache: RegisterCache
+    hits: int
+    misses: int
+
+    def __init__(self, client: SyncClient, cache: RegisterCache) -> None:
+        super().__init__(client)
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def execute(self, no_response_expected: bool, request: ModbusPDU) -> ModbusPDU:
+        fc = request.function_code
+        slave = request.slave_id
+        if fc in READ_RESPONSES and not no_response_expected:
+            address, count = request.address, request.count  # type: ignore[attr-defined]
+            values = self.cache.get(slave, fc, address, count)
+            if values is not None:
+                self.hits += 1
+                return READ_RESPONSES[fc](values, slave=slave)
+            self.misses += 1
+            response = self.client.execute(no_response_expected, request)
+            if (
+                response is not None
+                and not isinstance(response, Exception)
+                and not response.isError()
+            ):
+                self.cache.put(slave, fc, address, response.registers)
+            return response
+        written = _written(request)
+        try:
+            return self.client.execute(no_response_expected, request)
+        finally:
+            # Invalidate even if the write failed, since it may still have happened.
+            if written is not None:
+                self.cache.invalidate_write(slave, *written)
@@ -0,0 +1,219 @@
+"""Binary capture files of sniffed RTU frames.
+
+A capture file is the MAGIC header followed by one record per frame:
+
+    timestamp (float64) | length (uint16) | frame bytes
+
+all little-endian. Records are only ever appended. When the file is closed an
+index is appended after the last record, followed by a fixed size trailer pointing
+at it. The index divides the records into segments of SEGMENT_FRAMES frames and
+stores each segment's time range, file offset and the set of slave ids seen in it,
+so a reader can memory-map the file and jump straight to the segments covering a
+time window or device. If a capture was not closed cleanly the reader rebuilds the
+index by scanning the records, and a writer re-opening the file resumes after the
+last complete record.
+"""
+
+import bisect
+import mmap
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+from typing import Optional
+
+MAGIC = b"MBECAP01"
+INDEX_MAGIC = b"MBEIDX01"
+RECORD = struct.Struct("<dH")
+# first timestamp, last timestamp, offset, frame count, bitmap of slave ids
+SEGMENT = struct.Struct("<ddQI32s")
+# index offset, segment count, INDEX_MAGIC
+TRAILER = struct.Struct("<QI8s")
+SEGMENT_FRAMES = 1024
+
+
+@dataclass
+class Segment:
+    first: float
+    last: float
+    offset: int
+    count: int = 0
+    slaves: int = 0
+
+    def has_slave(self, slave: int) -> bool:
+        return bool(self.slaves >> slave & 1)
+
+    def add(self, timestamp: float, slave: int) -> None:
+        if self.count == 0:
+            self.first = timestamp
+        self.last = timestamp
+        self.count += 1
+        self.slaves |= 1 << slave
+
+    def pack(self) -> bytes:
+        return SEGMENT.pack(
+            self.first,
+            self.last,
+            self.offset,
+            self.count,
+            self.slaves.to_bytes(32, "little"),
+        )
+
+    @classmethod
+    def unpack_from(cls, buf: bytes | mmap.mmap, offset: int) -> "Segment":
+        first, last, start, count, slaves = SEGMENT.unpack_from(buf, offset)
+        return Segment(first, last, start, count, int.from_bytes(slaves, "little"))
+
+
+def _read_index(buf: bytes | mmap.mmap) -> tuple[list[Segment], int]:
+    """Return the segments of a capture and the offset where records end."""
+    size = len(buf)
+    if size < len(MAGIC) or buf[: len(MAGIC)] != MAGIC:
+        raise ValueError("Not an mbe capture file")
+    if size >= len(MAGIC) + TRAILER.size:
+        index_offset, n, magic = TRAILER.unpack_from(buf, size - TRAILER.size)
+        if (
+            magic == INDEX_MAGIC
+            and index_offset + n * SEGMENT.size + TRAILER.size == size
+        ):
+            segments = [
+                Segment.unpack_from(buf, index_offset + i * SEGMENT.size)
+                for i in range(n)
+            ]
+            return segments, index_offset
+    return _scan(buf)
+
+
+def _scan(buf: bytes | mmap.mmap) -> tuple[list[Segment], int]:
+    """Rebuild the index of a capture that has no trailer."""
+    segments: list[Segment] = []
+    offset = len(MAGIC)
+    size = len(buf)
+    while offset + RECORD.size <= size:
+        timestamp, length = RECORD.unpack_from(buf, offset)
+        if offset + RECORD.size + length > size or length == 0:
+            break
+        if not segments or segments[-1].count == SEGMENT_FRAMES:
+            segments.append(Segment(timestamp, timestamp, offset))
+        segments[-1].add(timestamp, buf[offset + RECORD.size])
+        offset += RECORD.size + length
+    return segments, offset
+
+
+class CaptureWriter:
+    """Appends frames to a capture file, writing the index on close()."""
+
+    path: Path
+    segments: list[Segment]
+
+    def __init__(self, path: Path | str) -> None:
+        self.path = Path(path)
+        if self.path.exists() and self.path.stat().st_size > 0:
+            self.f = self.path.open("r+b")
+            with mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                self.segments, end = _read_index(mm)
+            self.f.truncate(end)
+            self.f.seek(end)
+        else:
+            self.segments = []
+            self.f = self.path.open("w+b")
+            self.f.write(MAGIC)
+
+    def append(self, timestamp: float, data: bytes) -> None:
+        if not data:
+            return
+        offset = self.f.tell()
+        if not self.segments or self.segments[-1].count == SEGMENT_FRAMES:
+            self.segments.append(Segment(timestamp, timestamp, offset))
+        self.segments[-1].add(timestamp, data[0])
+        self.f.write(RECORD.pack(timestamp, len(data)))
+        self.f.write(data)
+
+    def flush(self) -> None:
+        self.f.flush()
+
+    def close(self) -> None:
+        if self.f.closed:
+            return
+        index_offset = self.f.tell()
+        for segment in self.segments:
+            self.f.write(segment.pack())
+        self.f.write(TRAILER.pack(index_offset, len(self.segments), INDEX_MAGIC))
+        self.f.close()
+
+    def __enter__(self) -> "CaptureWriter":
+        return self
+
+    def __exit__(self, klass, value, traceback) -> None:
+        self.close()
+
+
+class CaptureReader:
+    """Memory-mapped, indexed access to a capture file."""
+
+    path: Path
+    segments: list[Segment]
+
+    def __init__(self, path: Path | str) -> None:
+        self.path = Path(path)
+        self._f = self.path.open("rb")
+        self._mm: Optional[mmap.mmap] = None
+        if self.path.stat().st_size == 0:
+            # A capture interrupted before anything reached the disk; mmap cannot
+            # map an empty file.
+            self.segments, self._end = [], 0
+        else:
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.segments, self._end = _read_index(self._mm)
+        self._lasts = [segment.last for segment in self.segments]
+
+    @property
+    def frame_count(self) -> int:
+        return sum(segment.count for segment in self.segments)
+
+    @property
+    def start(self) -> Optional[float]:
+        return self.segments[0].first if self.segments else None
+
+    @property
+    def end(self) -> Optional[float]:
+        return self.segments[-1].last if self.segments else None
+
+    def frames(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        slave: Optional[int] = None,
+    ) -> Iterator[tuple[float, bytes]]:
+        """Yield (timestamp, frame) for frames in [start, end] from slave, in order."""
+        first = 0 if start is None else bisect.bisect_left(self._lasts, start)
+        mm = self._mm
+        if mm is None:
+            return
+        for segment in self.segments[first:]:
+            if end is not None and segment.first > end:
+                return
+            if slave is not None and not segment.has_slave(slave):
+                continue
+            offset = segment.offset
+            for _ in range(segment.count):
+                timestamp, length = RECORD.unpack_from(mm, offset)
+                offset += RECORD.size
+                if end is not None and timestamp > end:
+                    return
+                if (start is None or timestamp >= start) and (
+                    slave is None or mm[offset] == slave
+                ):
+                    yield timestamp, mm[offset : offset + length]
+                offset += length
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+        self._f.close()
+
+    def __enter__(self) -> "CaptureReader":
+        return self
+
+    def __exit__(self, klass, value, traceback) -> None:
+        self.close()
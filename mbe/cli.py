@@ -1,51 +1,163 @@
+import datetime
+import importlib
 import logging
 import time
+from pathlib import Path
+from typing import TYPE_CHECKING
 from typing import Annotated
 from typing import Optional
 
+import click
 import rich
 import typer
-from serial import rs485
+from typer.core import TyperGroup
 
-from mbe import cli_rly
-from mbe import cli_mtr
-from mbe import cli_tai
-from mbe import make_client
-from mbe.cli_config import MbeConfig
-from mbe.cli_config import Modes
-from mbe.taidecent import Taidecent
-from mbe.waveshare_relays import WaveShareRelayControl
-from mbe.waveshare_relays import WaveshareRelays
+from mbe.modes import Modes
 
-app = typer.Typer(no_args_is_help=True)
-app.add_typer(cli_tai.app, name="tai", help="Interact with taidecent thermometer")
-app.add_typer(cli_rly.app, name="rly", help="Interact with waveshare relays")
-app.add_typer(cli_mtr.app, name="mtr", help="Interact schneider electric meter")
+if TYPE_CHECKING:
+    from mbe.cli_config import MbeConfig
+    from mbe.engine import Reading
+    from mbe.engine import Sink
+
+# Sub-apps, imported only when one of their commands runs. Importing a device
+# module pulls in pymodbus, which would otherwise slow down every mbe command.
+LazySubApps = dict(
+    tai=("mbe.cli_tai", "Interact with taidecent thermometer"),
+    rly=("mbe.cli_rly", "Interact with waveshare relays"),
+    mtr=("mbe.cli_mtr", "Interact schneider electric meter"),
+)
+
+
+class LazySubApp(TyperGroup):
+    """Stands in for a sub-app in the command list, importing it on first use."""
+
+    module: str
+    _group: Optional[click.Group]
+
+    def __init__(self, name: str, module: str, help: str) -> None:
+        super().__init__(name=name, help=help, no_args_is_help=True)
+        self.module = module
+        self._group = None
+
+    def _load(self) -> click.Group:
+        if self._group is None:
+            sub_app = importlib.import_module(self.module).app
+            self._group = typer.main.get_group(sub_app)
+        return self._group
+
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return self._load().list_commands(ctx)
+
+    def get_command(self, ctx: click.Context, name: str) -> Optional[click.Command]:
+        return self._load().get_command(ctx, name)
+
+
+class LazyGroup(TyperGroup):
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted(super().list_commands(ctx) + list(LazySubApps))
+
+    def get_command(self, ctx: click.Context, name: str) -> Optional[click.Command]:
+        if name in LazySubApps:
+            module, help = LazySubApps[name]
+            return LazySubApp(name, module, help)
+        return super().get_command(ctx, name)
+
+
+app = typer.Typer(no_args_is_help=True, cls=LazyGroup)
 
 
 @app.callback()
 def main_app_callback(
+    ctx: typer.Context,
     verbose: bool = False,
+    profile: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Profile the command into this file: collapsed stacks of all threads "
+            "(for flamegraph.pl, speedscope) if it ends in .folded or .collapsed, "
+            "otherwise cProfile stats (for pstats, snakeviz)."
+        ),
+    ] = None,
+    trace: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Write spans of config loads, connects, pacing, bus transactions and "
+            "decoding to this file as Chrome trace events (for Perfetto, "
+            "chrome://tracing)."
+        ),
+    ] = None,
 ):
     if verbose:
         print("Enabling verbose logging")
         logging.basicConfig()
         log = logging.getLogger()
         log.setLevel(logging.DEBUG)
+    if profile is not None or trace is not None:
+        from mbe import tracing
+
+        # Closing the context, when the command has finished or failed, writes the
+        # files.
+        if trace is not None:
+            ctx.call_on_close(tracing.start_trace(trace))
+        if profile is not None:
+            ctx.call_on_close(tracing.start_profile(profile))
 
 
 @app.command()
-def sniff(port: Optional[str] = None) -> None:
+def sniff(
+    port: Optional[str] = None,
+    baud: Optional[int] = None,
+    raw: Annotated[
+        bool, typer.Option(help="Print a raw hex dump instead of decoded frames.")
+    ] = False,
+    record: Annotated[
+        Optional[Path], typer.Option(help="Append decoded frames to a capture file.")
+    ] = None,
+    stats: Annotated[
+        bool,
+        typer.Option(
+            help="Show rolling traffic statistics per slave and function instead of "
+            "the frames."
+        ),
+    ] = False,
+) -> None:
     """Sniff a serial port"""
+    if raw and (record is not None or stats):
+        raise typer.BadParameter(
+            "--raw cannot be combined with --record or --stats", param_hint="--raw"
+        )
+
+    from serial import rs485
+
+    from mbe.capture import CaptureWriter
+    from mbe.cli_config import MbeConfig
+    from mbe.discovery import resolve
+    from mbe.sniffer import sniff_frames
+    from mbe.sniffer import sniff_stats
+
     cfg = MbeConfig.load()
     if not port:
-        port = cfg.serial_sniff.port
+        port = resolve(cfg.serial_sniff)
+        if port is None:
+            rich.print(f"No serial port found for {cfg.serial_sniff.name}")
+            raise typer.Exit(1)
     elif port != cfg.serial_sniff.port:
         cfg.serial_sniff.port = port
         cfg.save()
-    with rs485.RS485(port) as ser:
+    if baud is None:
+        baud = cfg.serial_sniff.baud
+    with rs485.RS485(port, baudrate=baud) as ser:
         rich.print()
         rich.print(f"Sniffing on: {ser}")
+        if not raw:
+            show = sniff_stats if stats else sniff_frames
+            if record is None:
+                show(ser, baud)
+            else:
+                with CaptureWriter(record) as capture:
+                    rich.print(f"Recording to: {record}")
+                    show(ser, baud, capture=capture)
+            return
         i = 1
         while True:
             data = ser.read(1)
@@ -57,6 +169,78 @@ def sniff(port: Optional[str] = None) -> None:
             i += 1
 
 
+def parse_time(s: Optional[str]) -> Optional[float]:
+    """Parse seconds since the epoch or an ISO 8601 date/time."""
+    if s is None:
+        return None
+    try:
+        return float(s)
+    except ValueError:
+        return datetime.datetime.fromisoformat(s).timestamp()
+
+
+TimeOption = Annotated[
+    Optional[str], typer.Option(help="Epoch seconds or ISO 8601 date/time.")
+]
+
+
+@app.command()
+def replay(
+    capture: Path,
+    start: TimeOption = None,
+    end: TimeOption = None,
+    slave: Optional[int] = None,
+) -> None:
+    """Print the decoded frames of a capture file recorded with sniff --record."""
+    from mbe.capture import CaptureReader
+    from mbe.sniffer import replay_frames
+
+    with CaptureReader(capture) as reader:
+        replay_frames(reader.frames(parse_time(start), parse_time(end), slave))
+
+
+@app.command()
+def query(
+    capture: Path,
+    start: TimeOption = None,
+    end: TimeOption = None,
+    slave: Optional[int] = None,
+) -> None:
+    """Summarize the frames of a capture file, by slave id."""
+    from mbe.capture import CaptureReader
+    from mbe.rtu import crc_ok
+
+    with CaptureReader(capture) as reader:
+        rich.print(f"Capture: {capture}")
+        if reader.start is None or reader.end is None:
+            rich.print("No frames")
+            return
+        rich.print(
+            f"{reader.frame_count} frames in {len(reader.segments)} segments, "
+            f"{datetime.datetime.fromtimestamp(reader.start)} to "
+            f"{datetime.datetime.fromtimestamp(reader.end)}"
+        )
+        counts: dict[int, int] = {}
+        bad_crc = 0
+        first = last = None
+        for timestamp, data in reader.frames(parse_time(start), parse_time(end), slave):
+            if not crc_ok(data):
+                bad_crc += 1
+                continue
+            counts[data[0]] = counts.get(data[0], 0) + 1
+            if first is None:
+                first = timestamp
+            last = timestamp
+        if first is not None and last is not None:
+            rich.print(
+                f"Selected frames from {datetime.datetime.fromtimestamp(first)} "
+                f"to {datetime.datetime.fromtimestamp(last)}"
+            )
+        for slave_id in sorted(counts):
+            rich.print(f"  slave {slave_id:3d}: {counts[slave_id]:8d} frames")
+        rich.print(f"  bad crc  : {bad_crc:8d} frames")
+
+
 @app.command()
 def config(
     taidecent_device_id: Optional[int] = None,
@@ -65,6 +249,9 @@ def config(
     serial: Annotated[
         Optional[bool], typer.Option(show_default=False, help="Set serial or tcp mode")
     ] = None,
+    mode: Annotated[
+        Optional[Modes], typer.Option(show_default=False, help="Set mode")
+    ] = None,
     port: Optional[str] = None,
     sniff_port: Optional[str] = None,
     host: Optional[str] = None,
@@ -81,6 +268,8 @@ def config(
 ) -> None:
     """Show config file and contents. Optionally update config file if any parameter specified.
     Always creates default config file if none is present."""
+    from mbe.cli_config import MbeConfig
+
     if reset:
         MbeConfig().save()
     cfg = MbeConfig.load()
@@ -104,10 +293,10 @@ def config(
         cfg.schneider_device_id = schneider_device_id
         update_config = True
     if serial is not None:
-        mode = "serial" if serial else "tcp"
-        if mode != cfg.mode:
-            cfg.mode = Modes(mode)
-            update_config = True
+        mode = Modes.serial if serial else Modes.tcp
+    if mode is not None and mode != cfg.mode:
+        cfg.mode = mode
+        update_config = True
     if port and port != cfg.serial.port:
         cfg.serial.port = port
         update_config = True
@@ -126,28 +315,398 @@ def config(
 
 
 @app.command()
-def run(itr: int = 3) -> None:
-    """Reads taidecent thermometer and sets waveshare relays."""
+def serve() -> None:
+    """Hold the bus connection open and serve other mbe commands over a Unix socket.
+    While this runs, commands such as `mbe rly set` use it instead of connecting to
+    the bus themselves."""
+    from mbe import make_client
+    from mbe.cli_config import MbeConfig
+    from mbe.daemon import DaemonServer
+    from mbe.daemon import bus_key
+
     cfg = MbeConfig.load()
+    metrics = make_client.make_metrics(cfg)
+    client = make_client.make(cfg, use_daemon=False, metrics=metrics)
+    client.connect()
+    key = bus_key(cfg.default_bus())
+    with (
+        make_client.export_metrics(cfg, metrics),
+        DaemonServer(client, key) as server,
+    ):
+        rich.print(f"Serving {key} on {server.path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            client.close()
 
-    client = make_client.make(cfg)
+
+@app.command()
+def bridge(
+    # The defaults are mbe.bridge's, which is only imported once the command runs.
+    port: Annotated[
+        Optional[int],
+        typer.Option(show_default="8502", help="HTTP port on localhost."),
+    ] = None,
+    fresh: Annotated[
+        Optional[float],
+        typer.Option(
+            show_default="1.0",
+            help="Seconds a read result is reused for identical reads.",
+        ),
+    ] = None,
+) -> None:
+    """Serve register reads and coil writes over local HTTP, sharing identical reads
+    between clients. GET /<slave>/<table>/<address>?count=N reads, POST
+    /<slave>/coils/<address> with a JSON true/false or list body writes."""
+    from mbe import make_client
+    from mbe.bridge import DEFAULT_BRIDGE_PORT
+    from mbe.bridge import DEFAULT_FRESH
+    from mbe.bridge import Bridge
+    from mbe.bridge import BridgeServer
+    from mbe.cli_config import MbeConfig
+
+    if port is None:
+        port = DEFAULT_BRIDGE_PORT
+    if fresh is None:
+        fresh = DEFAULT_FRESH
+    cfg = MbeConfig.load()
+    metrics = make_client.make_metrics(cfg)
+    client = make_client.make(cfg, metrics=metrics)
     client.connect()
+    with (
+        make_client.export_metrics(cfg, metrics),
+        BridgeServer(Bridge(client, fresh), "127.0.0.1", port) as server,
+    ):
+        rich.print(f"Bridging {client} on http://127.0.0.1:{port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            client.close()
+
+
+@app.command()
+def run(itr: int = 3) -> None:
+    """Reads taidecent thermometer and waveshare relays while toggling relay 0. The
+    relay writes go out in the next free bus slot, ahead of queued reads."""
+    import asyncio
+
+    from pymodbus.exceptions import ModbusException
+
+    from mbe import make_client
+    from mbe.cli_config import MbeConfig
+    from mbe.engine import Engine
+    from mbe.pollers import DEFAULT_POLL_INTERVAL
+    from mbe.pollers import TaidecentPoller
+    from mbe.pollers import WaveshareRelaysPoller
+
+    cfg = MbeConfig.load()
+    metrics = make_client.make_metrics(cfg)
+
+    async def _run() -> None:
+        # pymodbus asyncio clients must be created inside the running loop.
+        bus = make_client.make_bus(cfg, metrics)
+        engine = Engine(print_reading)
+        engine.add(bus, TaidecentPoller(cfg.taidecent_device_id))
+        engine.add(bus, WaveshareRelaysPoller(cfg.waveshare_relay_device_id))
+
+        async def toggle_relay() -> None:
+            closed = False
+            for _ in range(itr):
+                await asyncio.sleep(DEFAULT_POLL_INTERVAL)
+                closed = not closed
+                resp = await bus.write_coil(
+                    0, closed, slave=cfg.waveshare_relay_device_id
+                )
+                if resp.isError():
+                    raise ModbusException(f"Writing relay 0 failed: {resp}")
+                print(f"Relay 0 {'closed' if closed else 'opened'}")
+
+        await engine.run(itr, [toggle_relay()])
+
+    with make_client.export_metrics(cfg, metrics):
+        asyncio.run(_run())
+
+
+def print_reading(reading: "Reading") -> None:
+    t = time.strftime("%H:%M:%S", time.localtime(reading.timestamp))
+    print(f"{t}  {reading.device:10} {reading.point:20}: {reading.value}")
+
+
+def deadband_filter(cfg: "MbeConfig", sink: "Sink") -> "Sink":
+    from mbe.deadband import DeadbandFilter
+
+    return DeadbandFilter(sink, cfg.report.deadbands, cfg.report.heartbeat)
+
+
+@app.command()
+def poll(
+    itr: Annotated[
+        Optional[int], typer.Option(help="Polls per device. Poll forever if omitted.")
+    ] = None,
+    interval: Annotated[
+        Optional[float],
+        typer.Option(
+            help="Seconds between polls of each device. Uses the pollers' default if omitted."
+        ),
+    ] = None,
+    by_exception: Annotated[
+        bool,
+        typer.Option(
+            help="Only print values that moved by more than their deadband (see config), and heartbeats."
+        ),
+    ] = False,
+) -> None:
+    """Poll the devices of every configured bus concurrently, one thread per bus."""
+    from mbe import make_client
+    from mbe.cli_config import MbeConfig
+    from mbe.workers import run_workers
+
+    cfg = MbeConfig.load()
+    metrics = make_client.make_metrics(cfg)
+    sink: "Sink" = print_reading
+    if by_exception:
+        sink = deadband_filter(cfg, print_reading)
+    try:
+        with make_client.export_metrics(cfg, metrics):
+            run_workers(cfg, sink, itr, interval, metrics)
+    except KeyboardInterrupt:
+        pass
+
+
+@app.command()
+def record(
+    itr: Annotated[
+        Optional[int], typer.Option(help="Polls per device. Poll forever if omitted.")
+    ] = None,
+    interval: Annotated[
+        Optional[float],
+        typer.Option(
+            help="Seconds between polls of each device. Uses the pollers' default if omitted."
+        ),
+    ] = None,
+    capacity: Annotated[
+        Optional[int], typer.Option(help="Samples kept per point.")
+    ] = None,
+    report: Annotated[
+        float, typer.Option(help="Seconds between printed summaries.")
+    ] = 60.0,
+    by_exception: Annotated[
+        bool,
+        typer.Option(
+            help="Only record values that moved by more than their deadband (see config), and heartbeats."
+        ),
+    ] = False,
+) -> None:
+    """Poll all devices into fixed-size in-memory time series, printing the min, max
+    and mean of each point periodically."""
+    import threading
+
+    from rich.table import Table
+
+    from mbe import make_client
+    from mbe.cli_config import MbeConfig
+    from mbe.recorder import DEFAULT_CAPACITY
+    from mbe.recorder import Recorder
+    from mbe.workers import run_workers
+
+    cfg = MbeConfig.load()
+    recorder = Recorder(DEFAULT_CAPACITY if capacity is None else capacity)
+    metrics = make_client.make_metrics(cfg)
+    sink: "Sink" = recorder.record
+    if by_exception:
+        sink = deadband_filter(cfg, recorder.record)
+    # Held by the bus workers while they record.
+    lock = threading.Lock()
+    start = time.time()
+
+    def print_summary() -> None:
+        nonlocal start
+        end = time.time() + 1e-6
+        table = Table("Device", "Point", "Samples", "Min", "Max", "Mean", "Last")
+        with lock:
+            for device, point in recorder.points():
+                buckets = recorder.downsample(device, point, start, end)
+                last = recorder.series[(device, point)].last()
+                if not buckets or last is None:
+                    continue
+                b = buckets[0]
+                table.add_row(
+                    device,
+                    point,
+                    str(b.count),
+                    f"{b.min:g}",
+                    f"{b.max:g}",
+                    f"{b.mean:.4g}",
+                    f"{last[1]:g}",
+                )
+        start = end
+        rich.print(table)
+
+    try:
+        with make_client.export_metrics(cfg, metrics):
+            run_workers(cfg, sink, itr, interval, metrics, lock, print_summary, report)
+    except KeyboardInterrupt:
+        pass
+
+
+@app.command()
+def fleet(
+    manifest: Annotated[
+        Path,
+        typer.Argument(
+            help='JSON file listing the sites, as {"sites": [{"name": ..., "tcp": {"host": ...}}]}.'
+        ),
+    ],
+    processes: Annotated[
+        Optional[int], typer.Option(help="Worker processes. One per CPU if omitted.")
+    ] = None,
+    itr: Annotated[
+        Optional[int], typer.Option(help="Polls per device. Poll forever if omitted.")
+    ] = None,
+    interval: Annotated[
+        Optional[float],
+        typer.Option(
+            help="Seconds between polls of each device. Uses the pollers' default if omitted."
+        ),
+    ] = None,
+    health: Annotated[
+        float, typer.Option(help="Seconds between health records of each site.")
+    ] = 60.0,
+    output: Annotated[
+        Optional[Path], typer.Option(help="Append to this file instead of stdout.")
+    ] = None,
+) -> None:
+    """Poll the sites of a manifest from a pool of processes, writing readings and
+    per-site health as JSON lines."""
+    import contextlib
+    import sys
+
+    from mbe.cli_config import FleetManifest
+    from mbe.cli_config import MbeConfig
+    from mbe.fleet import run_fleet
+
+    cfg = MbeConfig.load()
+    sites = FleetManifest.load(manifest)
+    with contextlib.ExitStack() as stack:
+        out = sys.stdout if output is None else stack.enter_context(output.open("a"))
+        try:
+            run_fleet(cfg, sites, out, processes, itr, interval, health)
+        except KeyboardInterrupt:
+            pass
+
+
+@app.command()
+def ports() -> None:
+    """List the serial ports with the identifiers that select them in the config."""
+    from rich.table import Table
+
+    from mbe.discovery import list_ports
+
+    table = Table("Device", "VID", "PID", "Serial number", "by_id", "Description")
+    for p in list_ports():
+        table.add_row(
+            p.device,
+            "" if p.vid is None else str(p.vid),
+            "" if p.pid is None else str(p.pid),
+            p.serial_number or "",
+            "" if p.by_id is None else Path(p.by_id).name,
+            p.description,
+        )
+    rich.print(table)
+
+
+@app.command()
+def scan(
+    port: Annotated[
+        Optional[list[str]],
+        typer.Option(help="Serial port to scan. May be repeated."),
+    ] = None,
+    host: Annotated[
+        Optional[list[str]],
+        typer.Option(
+            help="TCP gateway to scan, as host or host:port. May be repeated."
+        ),
+    ] = None,
+    rtu_host: Annotated[
+        Optional[list[str]],
+        typer.Option(
+            help="Gateway passing RTU frames through to scan, as host or host:port. "
+            "May be repeated."
+        ),
+    ] = None,
+    baud: Annotated[
+        Optional[list[int]],
+        typer.Option(help="Baud rate to try on each serial port. May be repeated."),
+    ] = None,
+    first: int = 1,
+    last: int = 247,
+    timeout: Annotated[
+        Optional[float],
+        typer.Option(help="Seconds to wait for a response before any device answers."),
+    ] = None,
+) -> None:
+    """Find devices by probing every slave id, on the configured buses or on the given
+    ports and gateways, and identify the device types mbe knows."""
+    from rich.table import Table
+
+    from mbe import scanner
+    from mbe.cli_config import MbeConfig
+    from mbe.discovery import resolve
+
+    if not port and not host and not rtu_host:
+        port, host, rtu_host = [], [], []
+        bauds = []
+        for bus in MbeConfig.load().bus_configs():
+            if bus.mode == Modes.serial:
+                if (device := resolve(bus.serial)) is None:
+                    rich.print(f"No serial port found for {bus.serial.name}")
+                    continue
+                port.append(device)
+                bauds.append(bus.serial.baud)
+            elif bus.mode == Modes.rtu_tcp:
+                rtu_host.append(f"{bus.tcp.host}:{bus.tcp.port}")
+            else:
+                host.append(f"{bus.tcp.host}:{bus.tcp.port}")
+        baud = baud or sorted(set(bauds))
+
+    def parse_hosts(hosts: Optional[list[str]]) -> list[tuple[str, int]]:
+        parsed = []
+        for h in hosts or []:
+            name, _, tcp_port = h.partition(":")
+            parsed.append(
+                (name, int(tcp_port) if tcp_port else scanner.MODBUS_TCP_PORT)
+            )
+        return parsed
+
+    def on_found(responder: scanner.Responder) -> None:
+        rich.print(f"Found slave {responder.slave} on {responder.bus}")
 
-    taidecent = Taidecent(client, device=cfg.taidecent_device_id)
-    relays = WaveshareRelays(client, device=cfg.waveshare_relay_device_id)
-
-    mode = WaveShareRelayControl.Open
-    i = 0
-    while i < itr:
-        time.sleep(2)
-        taidecent.read_temperature(fahrenheit=True)
-        relays.read_all_relays()
-        if mode == WaveShareRelayControl.Open:
-            mode = WaveShareRelayControl.Close
-        else:
-            mode = WaveShareRelayControl.Open
-        relays.write_relay(relay_idx=0, mode=mode)
-        i += 1
+    start = time.monotonic()
+    found = scanner.scan(
+        port or [],
+        baud or [9600],
+        parse_hosts(host),
+        range(first, last + 1),
+        scanner.INITIAL_TIMEOUT if timeout is None else timeout,
+        on_found,
+        parse_hosts(rtu_host),
+    )
+    table = Table("Bus", "Baud", "Slave", "Response ms", "Device", "Fingerprint")
+    for r in sorted(found, key=lambda r: (r.bus, r.baud or 0, r.slave)):
+        table.add_row(
+            r.bus,
+            str(r.baud or ""),
+            str(r.slave),
+            f"{r.response_time * 1000:.1f}",
+            r.device or "unknown",
+            ", ".join(f"{k}: {v}" for k, v in r.fingerprints.items()),
+        )
+    rich.print(table)
+    rich.print(f"Scanned in {time.monotonic() - start:.1f} s")
 
 
 if __name__ == "__main__":
@@ -1,14 +1,14 @@
 from enum import Enum
 from pathlib import Path
-from typing import Annotated
 from typing import Optional
 
 import rich
 import xdg
 from pydantic import BaseModel
-from pydantic import Field
 from pydantic import field_validator
 
+from mbe import tracing
+from mbe.modes import Modes
 from mbe.schneider import SCHNEIDER_DEVICE_ID
 from mbe.taidecent import TAIDECENT_DEVICE_ID
 from mbe.waveshare_relays import WAVESHARE_RELAY_DEVICE_ID
@@ -17,39 +17,172 @@ NO_SERIAL_PORT_FOUND = "NO-SERIAL-PORT-SPECIFIED-OR-FOUND"
 
 
 class SerialConfig(BaseModel):
-    port: Annotated[Optional[str], Field(validate_default=True)] = None
+    # Device path. If omitted, the USB serial adapter given by by_id or by vid, pid
+    # and serial_number is used, or the first one found if those are omitted too.
+    # See mbe.discovery.
+    port: Optional[str] = None
+    # Name of the adapter's link in /dev/serial/by-id (Linux).
+    by_id: Optional[str] = None
+    # USB identifiers of the adapter, as shown by mbe ports.
+    vid: Optional[int] = None
+    pid: Optional[int] = None
+    serial_number: Optional[str] = None
     baud: int = 9600
+    # Minimum seconds between frames for devices that need more than the 3.5
+    # character RTU silent interval, for all devices and per device id.
+    turnaround: float = 0.0
+    device_turnaround: dict[int, float] = {}
 
     # noinspection PyNestedDecorators
     @field_validator("port")
     @classmethod
-    def find_usb_serial_port(cls, v: Optional[str]) -> str:
-        """If port unspecified, look in /dev for first entry containing "tty.usbserial"."""
-        if v is None or v == NO_SERIAL_PORT_FOUND:
-            v = NO_SERIAL_PORT_FOUND
-            try:
-                dev = Path("/dev")
-                if dev.exists():
-                    for entry in dev.iterdir():
-                        str_entry = str(entry)
-                        if "tty.usbserial" in str_entry:
-                            v = str_entry
-                            break
-            except:  # noqa
-                pass
+    def unspecified_port(cls, v: Optional[str]) -> Optional[str]:
+        """Config files saved by earlier versions hold NO_SERIAL_PORT_FOUND."""
+        if v == NO_SERIAL_PORT_FOUND:
+            return None
         return v
 
+    @property
+    def name(self) -> str:
+        """Identifies the port, whether or not it can be found now."""
+        if self.port is not None:
+            return self.port
+        if self.by_id is not None:
+            return self.by_id
+        if self.vid is None and self.pid is None and self.serial_number is None:
+            return "usb"
+        return "usb:" + ":".join(
+            "*" if v is None else f"{v:04x}" if isinstance(v, int) else v
+            for v in (self.vid, self.pid, self.serial_number)
+        )
+
+
+MODBUS_TCP_PORT = 502
+
 
 class TCPConfig(BaseModel):
     host: str = "192.168.1.210"
+    port: int = MODBUS_TCP_PORT
+    # Requests kept in flight on the gateway connection by the asyncio clients, and
+    # per slave. 1 waits for each response before sending the next request. See
+    # mbe.pipeline.
+    window: int = 4
+    slave_window: int = 1
+
+    @property
+    def name(self) -> str:
+        if self.port == MODBUS_TCP_PORT:
+            return self.host
+        return f"{self.host}:{self.port}"
+
+
+class CacheConfig(BaseModel):
+    # Seconds registers of each register class stay cached. Registers of other
+    # classes are always read from the bus. 0 disables caching.
+    ttl: dict[str, float] = dict(identity=3600.0, address=3600.0, config=300.0)
+    max_entries: int = 1024
+
+
+class ResilienceConfig(BaseModel):
+    # Seconds to wait for a response before a device's response times are known,
+    # and the bounds of the timeouts derived from them. See mbe.resilience.
+    timeout: float = 1.0
+    min_timeout: float = 0.1
+    max_timeout: float = 3.0
+    # Retries of a transaction without response, each after a random delay of up
+    # to backoff * 2**attempt seconds.
+    retries: int = 2
+    backoff: float = 0.05
+    max_backoff: float = 1.0
+    # Transactions in a row without response after which a device is skipped for
+    # cooldown seconds, doubling while probes of it fail.
+    failures: int = 3
+    cooldown: float = 30.0
+    max_cooldown: float = 300.0
+
+
+class Deadband(BaseModel):
+    # A float reading is reported when it moves from the last reported value by more
+    # than the larger of these.
+    absolute: float = 0.0
+    percent: float = 0.0
+
+
+class ReportConfig(BaseModel):
+    # Seconds after which an unchanged value is reported anyway.
+    heartbeat: float = 300.0
+    # Deadbands by "device.point". Points without one are reported on any change.
+    deadbands: dict[str, Deadband] = {
+        "taidecent.Temperature": Deadband(absolute=0.1),
+        "taidecent.Humidity": Deadband(absolute=0.5),
+        "schneider.I1_Phase1Current": Deadband(absolute=0.05, percent=2.0),
+        "schneider.Voltage_LN_1": Deadband(percent=0.5),
+        "schneider.Frequency": Deadband(absolute=0.05),
+    }
+
+
+class MetricsFormat(str, Enum):
+    prometheus = "prometheus"
+    json = "json"
+
+
+class MetricsConfig(BaseModel):
+    # Serve transaction metrics on localhost at /metrics (Prometheus text format)
+    # and /metrics.json.
+    port: Optional[int] = None
+    # Write transaction metrics to this file every interval seconds.
+    file: Optional[str] = None
+    format: MetricsFormat = MetricsFormat.prometheus
+    interval: float = 10.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.port is not None or self.file is not None
 
 
 CONFIG_FILE = Path(xdg.xdg_config_home() / "gridworks" / "mbe" / "config.json")
 
 
-class Modes(str, Enum):
-    serial = "serial"
-    tcp = "tcp"
+class DeviceTypes(str, Enum):
+    taidecent = "taidecent"
+    waveshare_relays = "waveshare_relays"
+    schneider = "schneider"
+
+
+class DeviceConfig(BaseModel):
+    type: DeviceTypes
+    id: int
+    # Name in readings and metrics. Defaults to the type.
+    name: Optional[str] = None
+    # Seconds between polls. Uses the poller's default if omitted.
+    interval: Optional[float] = None
+
+    @property
+    def label(self) -> str:
+        return self.type.value if self.name is None else self.name
+
+
+class BusConfig(BaseModel):
+    """A serial port or TCP gateway and the devices on it."""
+
+    mode: Modes = Modes.serial
+    serial: SerialConfig = SerialConfig()
+    tcp: TCPConfig = TCPConfig()
+    devices: list[DeviceConfig] = []
+
+    @property
+    def name(self) -> str:
+        if self.mode == Modes.serial:
+            return self.serial.name
+        return self.tcp.name
+
+
+# The MbeConfig field holding the device id of each device type.
+DeviceIdFields = {
+    DeviceTypes.taidecent: "taidecent_device_id",
+    DeviceTypes.waveshare_relays: "waveshare_relay_device_id",
+    DeviceTypes.schneider: "schneider_device_id",
+}
 
 
 class MbeConfig(BaseModel):
@@ -60,6 +193,62 @@ class MbeConfig(BaseModel):
     serial: SerialConfig = SerialConfig()
     tcp: TCPConfig = TCPConfig()
     serial_sniff: SerialConfig = SerialConfig()
+    # Buses polled by poll and record, each by its own worker thread. If empty,
+    # the single bus given by mode, serial and tcp, with the three device ids above.
+    buses: list[BusConfig] = []
+    cache: CacheConfig = CacheConfig()
+    resilience: ResilienceConfig = ResilienceConfig()
+    metrics: MetricsConfig = MetricsConfig()
+    report: ReportConfig = ReportConfig()
+
+    def bus_configs(self) -> list[BusConfig]:
+        if self.buses:
+            return self.buses
+        return [
+            BusConfig(
+                mode=self.mode,
+                serial=self.serial,
+                tcp=self.tcp,
+                devices=[
+                    DeviceConfig(
+                        type=DeviceTypes.taidecent, id=self.taidecent_device_id
+                    ),
+                    DeviceConfig(
+                        type=DeviceTypes.waveshare_relays,
+                        id=self.waveshare_relay_device_id,
+                    ),
+                    DeviceConfig(
+                        type=DeviceTypes.schneider, id=self.schneider_device_id
+                    ),
+                ],
+            )
+        ]
+
+    def default_bus(self) -> BusConfig:
+        """The first bus, used by commands that talk to the bus as a whole."""
+        return self.bus_configs()[0]
+
+    def device(self, type: DeviceTypes) -> tuple[BusConfig, DeviceConfig]:
+        """The bus and config of the first device of type, for commands that talk
+        to a single device such as mbe tai. If no bus has one, the default bus and
+        the device id of type above."""
+        for bus in self.bus_configs():
+            for device in bus.devices:
+                if device.type == type:
+                    return bus, device
+        return self.default_bus(), DeviceConfig(
+            type=type, id=getattr(self, DeviceIdFields[type])
+        )
+
+    def set_device_id(self, type: DeviceTypes, id: int) -> None:
+        """Make id the device id of type above and, if buses are configured, of the
+        first device of type on them."""
+        setattr(self, DeviceIdFields[type], id)
+        for bus in self.buses:
+            for device in bus.devices:
+                if device.type == type:
+                    device.id = id
+                    return
 
     @property
     def path(self) -> Path:
@@ -76,7 +265,7 @@ class MbeConfig(BaseModel):
         if not CONFIG_FILE.exists():
             rich.print("Creating default config")
             MbeConfig().save()
-        with CONFIG_FILE.open() as f:
+        with tracing.span("config load", "config"), CONFIG_FILE.open() as f:
             return cls.model_validate_json(f.read())
 
     def save(self) -> "MbeConfig":
@@ -84,3 +273,45 @@ class MbeConfig(BaseModel):
         with CONFIG_FILE.open("w") as f:
             f.write(self.model_dump_json(indent=2))
         return self
+
+
+class SiteConfig(BaseModel):
+    """A site polled by mbe fleet: by default one gateway with a Taidecent,
+    Waveshare relays and a Schneider meter at the usual device ids."""
+
+    name: str
+    mode: Modes = Modes.tcp
+    tcp: TCPConfig = TCPConfig()
+    devices: list[DeviceConfig] = [
+        DeviceConfig(type=DeviceTypes.taidecent, id=TAIDECENT_DEVICE_ID),
+        DeviceConfig(type=DeviceTypes.waveshare_relays, id=WAVESHARE_RELAY_DEVICE_ID),
+        DeviceConfig(type=DeviceTypes.schneider, id=SCHNEIDER_DEVICE_ID),
+    ]
+    # Buses of a site with more than one. If given, mode, tcp and devices are
+    # ignored.
+    buses: list[BusConfig] = []
+
+    def bus_configs(self) -> list[BusConfig]:
+        if self.buses:
+            return self.buses
+        return [BusConfig(mode=self.mode, tcp=self.tcp, devices=self.devices)]
+
+
+class FleetManifest(BaseModel):
+    """The sites polled by mbe fleet, read from a JSON file."""
+
+    sites: list[SiteConfig] = []
+
+    # noinspection PyNestedDecorators
+    @field_validator("sites")
+    @classmethod
+    def unique_names(cls, v: list[SiteConfig]) -> list[SiteConfig]:
+        names = [site.name for site in v]
+        if duplicates := sorted({n for n in names if names.count(n) > 1}):
+            raise ValueError(f"Duplicate site names: {', '.join(duplicates)}")
+        return v
+
+    @classmethod
+    def load(cls, path: Path) -> "FleetManifest":
+        with path.open() as f:
+            return cls.model_validate_json(f.read())
@@ -1,8 +1,7 @@
-import time
-
 import typer
 
 from mbe import make_client
+from mbe.cli_config import DeviceTypes
 from mbe.cli_config import MbeConfig
 from mbe.schneider import Schneider
 from mbe.schneider import SCHNEIDER_DEVICE_ID
@@ -15,10 +14,10 @@ app = typer.Typer(no_args_is_help=True)
 def read_all() -> None:
     """Read all registers."""
     cfg = MbeConfig.load()
-    client = make_client.make(cfg)
+    bus, device = cfg.device(DeviceTypes.schneider)
+    client = make_client.make(cfg, bus=bus)
     client.connect()
-    schneider = Schneider(client, device=cfg.schneider_device_id)
-    time.sleep(2)
+    schneider = Schneider(client, device=device.id)
     schneider.read_registers()
 
 
@@ -28,10 +27,11 @@ def set_device_id(
 ) -> None:
     """Change the device id of the Schneider Electric Meter."""
     cfg = MbeConfig.load()
-    client = make_client.make(cfg)
+    bus, device = cfg.device(DeviceTypes.schneider)
+    client = make_client.make(cfg, bus=bus)
     client.connect()
     schneider = Schneider(client, device=from_id)
     schneider.set_device_id(to_id)
-    if to_id != cfg.taidecent_device_id:
-        cfg.taidecent_device_id = to_id
+    if to_id != device.id:
+        cfg.set_device_id(DeviceTypes.schneider, to_id)
         cfg.save()
@@ -1,9 +1,11 @@
 import typer
 
 from mbe import make_client
+from mbe.cli_config import DeviceTypes
 from mbe.cli_config import MbeConfig
 from mbe.waveshare_relays import WAVESHARE_RELAY_DEVICE_ID
 from mbe.waveshare_relays import WAVESHARE_RELAY_DEVICE_ID_FACTORY
+from mbe.waveshare_relays import RelayController
 from mbe.waveshare_relays import WaveshareRelays
 
 app = typer.Typer(no_args_is_help=True)
@@ -12,27 +14,49 @@ app = typer.Typer(no_args_is_help=True)
 @app.command("set")
 def set_relay(idx: int, closed: bool) -> None:
     cfg = MbeConfig.load()
-    client = make_client.make(cfg)
+    bus, device = cfg.device(DeviceTypes.waveshare_relays)
+    client = make_client.make(cfg, bus=bus)
     client.connect()
-    relays = WaveshareRelays(client, device=cfg.waveshare_relay_device_id)
+    relays = WaveshareRelays(client, device=device.id)
     relays.write_relay(relay_idx=idx, mode=closed)
 
 
 @app.command("set-all")
 def set_all_relays(closed: bool) -> None:
     cfg = MbeConfig.load()
-    client = make_client.make(cfg)
+    bus, device = cfg.device(DeviceTypes.waveshare_relays)
+    client = make_client.make(cfg, bus=bus)
     client.connect()
-    relays = WaveshareRelays(client, device=cfg.waveshare_relay_device_id)
+    relays = WaveshareRelays(client, device=device.id)
     relays.write_all_relays(mode=closed)
 
 
+@app.command("set-mask")
+def set_relay_mask(mask: str) -> None:
+    """Set all relays from a bitmask, relay 0 in bit 0, e.g. 0x05 or 0b101. Only
+    relays that are not already in the desired state are written, in one
+    transaction."""
+    cfg = MbeConfig.load()
+    bus, device = cfg.device(DeviceTypes.waveshare_relays)
+    client = make_client.make(cfg, bus=bus)
+    client.connect()
+    relays = WaveshareRelays(client, device=device.id)
+    controller = RelayController(relays)
+    before = controller.sync()
+    changed = controller.set(int(mask, 0))
+    print(
+        f"Relay states: 0x{before:02X} -> 0x{controller.state():02X}  "
+        f"(changed 0x{changed:02X})"
+    )
+
+
 @app.command("read")
 def read_relays() -> None:
     cfg = MbeConfig.load()
-    client = make_client.make(cfg)
+    bus, device = cfg.device(DeviceTypes.waveshare_relays)
+    client = make_client.make(cfg, bus=bus)
     client.connect()
-    relays = WaveshareRelays(client, device=cfg.waveshare_relay_device_id)
+    relays = WaveshareRelays(client, device=device.id)
     relays.read_all_relays()
 
 
@@ -42,10 +66,11 @@ def set_device_id(
     to_id: int = WAVESHARE_RELAY_DEVICE_ID,
 ):
     cfg = MbeConfig.load()
-    client = make_client.make(cfg)
+    bus, device = cfg.device(DeviceTypes.waveshare_relays)
+    client = make_client.make(cfg, bus=bus)
     client.connect()
     relays = WaveshareRelays(client, device=from_id)
     relays.set_device_id(to_id)
-    if to_id != cfg.waveshare_relay_device_id:
-        cfg.waveshare_relay_device_id = to_id
+    if to_id != device.id:
+        cfg.set_device_id(DeviceTypes.waveshare_relays, to_id)
         cfg.save()
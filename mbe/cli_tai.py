@@ -1,8 +1,7 @@
-import time
-
 import typer
 
 from mbe import make_client
+from mbe.cli_config import DeviceTypes
 from mbe.cli_config import MbeConfig
 from mbe.taidecent import Taidecent
 from mbe.taidecent import TAIDECENT_DEVICE_ID
@@ -15,10 +14,10 @@ app = typer.Typer(no_args_is_help=True)
 def read() -> None:
     """Read temperature."""
     cfg = MbeConfig.load()
-    client = make_client.make(cfg)
+    bus, device = cfg.device(DeviceTypes.taidecent)
+    client = make_client.make(cfg, bus=bus)
     client.connect()
-    taidecent = Taidecent(client, device=cfg.taidecent_device_id)
-    time.sleep(2)
+    taidecent = Taidecent(client, device=device.id)
     taidecent.read_temperature(fahrenheit=True)
 
 
@@ -26,10 +25,10 @@ def read() -> None:
 def read_all() -> None:
     """Read all registers."""
     cfg = MbeConfig.load()
-    client = make_client.make(cfg)
+    bus, device = cfg.device(DeviceTypes.taidecent)
+    client = make_client.make(cfg, bus=bus)
     client.connect()
-    taidecent = Taidecent(client, device=cfg.taidecent_device_id)
-    time.sleep(2)
+    taidecent = Taidecent(client, device=device.id)
     taidecent.read_registers()
 
 
@@ -39,12 +38,13 @@ def set_device_id(
 ) -> None:
     """Change the device id of the Taidecent thermometer."""
     cfg = MbeConfig.load()
-    client = make_client.make(cfg)
+    bus, device = cfg.device(DeviceTypes.taidecent)
+    client = make_client.make(cfg, bus=bus)
     client.connect()
     taidecent = Taidecent(client, device=from_id)
     taidecent.set_device_id(to_id)
-    if to_id != cfg.taidecent_device_id:
-        cfg.taidecent_device_id = to_id
+    if to_id != device.id:
+        cfg.set_device_id(DeviceTypes.taidecent, to_id)
         cfg.save()
 
 
@@ -52,8 +52,8 @@ def set_device_id(
 def set_temp_correction(correction: int) -> None:
     """Set the temperature correction factor on Taidecent thermometer."""
     cfg = MbeConfig.load()
-    client = make_client.make(cfg)
+    bus, device = cfg.device(DeviceTypes.taidecent)
+    client = make_client.make(cfg, bus=bus)
     client.connect()
-    taidecent = Taidecent(client, device=cfg.taidecent_device_id)
-    time.sleep(2)
+    taidecent = Taidecent(client, device=device.id)
     taidecent.set_temp_correction(correction)
@@ -0,0 +1,82 @@
+"""Base classes for sync clients implemented in mbe, such as wrappers around a
+pymodbus client.
+
+Every pymodbus request method (read_holding_registers(), write_coil(), ...) is
+implemented by ModbusClientMixin in terms of execute(). A client therefore only
+needs to implement execute(), connect() and close() to be usable by the drivers
+exactly like a pymodbus client, and a wrapper only needs to override execute() to
+act on every transaction.
+"""
+
+from abc import abstractmethod
+from typing import Union
+
+from pymodbus.client.base import ModbusBaseSyncClient
+from pymodbus.client.mixin import ModbusClientMixin
+from pymodbus.pdu import ModbusPDU
+
+from mbe import tracing
+
+
+class SyncClientBase(ModbusClientMixin[ModbusPDU]):
+    def __init__(self) -> None:
+        ModbusClientMixin.__init__(self)  # type: ignore[arg-type]
+
+    @abstractmethod
+    def connect(self) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def close(self) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def execute(self, no_response_expected: bool, request: ModbusPDU) -> ModbusPDU:
+        raise NotImplementedError
+
+    def __enter__(self) -> "SyncClientBase":
+        self.connect()
+        return self
+
+    def __exit__(self, klass, value, traceback) -> None:
+        self.close()
+
+
+SyncClient = Union[ModbusBaseSyncClient, SyncClientBase]
+
+
+class ClientWrapper(SyncClientBase):
+    client: SyncClient
+
+    def __init__(self, client: SyncClient) -> None:
+        super().__init__()
+        self.client = client
+
+    def connect(self) -> bool:
+        return self.client.connect()
+
+    def close(self) -> None:
+        self.client.close()
+
+    def execute(self, no_response_expected: bool, request: ModbusPDU) -> ModbusPDU:
+        return self.client.execute(no_response_expected, request)
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__name__}({self.client})"
+
+
+class TracedClient(ClientWrapper):
+    """Records connects and transactions of client as spans of the trace."""
+
+    def connect(self) -> bool:
+        with tracing.span("connect", "client", client=str(self.client)):
+            return self.client.connect()
+
+    def execute(self, no_response_expected: bool, request: ModbusPDU) -> ModbusPDU:
+        with tracing.span(
+            "transaction",
+            "bus",
+            slave=request.slave_id,
+            function_code=request.function_code,
+        ):
+            return self.client.execute(no_response_expected, request)
@@ -0,0 +1,221 @@
+"""mbe daemon: holds the bus connection open and serves transactions over a Unix
+socket, so CLI commands can skip connecting to the bus.
+
+Messages on the socket are length-prefixed. A connection starts with the client
+sending its bus key (see bus_key()) and the daemon answering whether it serves that
+bus. After that each request is
+
+    slave (uint8) | no_response_expected (uint8) | length (uint16) | PDU
+
+where PDU is the function code followed by the encoded request, and each reply is
+
+    status (uint8) | length (uint16) | payload
+
+where payload is the response PDU, nothing (no response expected) or an error
+message.
+"""
+
+import logging
+import socket
+import socketserver
+import struct
+import threading
+from pathlib import Path
+from typing import Optional
+
+from pymodbus.exceptions import ModbusException
+from pymodbus.exceptions import ModbusIOException
+from pymodbus.pdu import DecodePDU
+from pymodbus.pdu import ModbusPDU
+
+from mbe.cli_config import CONFIG_FILE
+from mbe.cli_config import BusConfig
+from mbe.client_wrapper import SyncClient
+from mbe.client_wrapper import SyncClientBase
+
+logger = logging.getLogger(__name__)
+
+DAEMON_SOCKET = CONFIG_FILE.parent / "mbe.sock"
+
+REQUEST = struct.Struct("<BBH")
+REPLY = struct.Struct("<BH")
+
+STATUS_OK = 0
+STATUS_NO_RESPONSE = 1
+STATUS_ERROR = 2
+
+
+def bus_key(bus: BusConfig) -> str:
+    """Identifies a bus."""
+    if bus.mode == "serial":
+        return f"serial:{bus.serial.name}:{bus.serial.baud}"
+    return f"{bus.mode.value}:{bus.tcp.name}"
+
+
+def _recv_exactly(sock: socket.socket, n: int) -> bytes:
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("mbe daemon connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def _send_reply(sock: socket.socket, status: int, payload: bytes = b"") -> None:
+    sock.sendall(REPLY.pack(status, len(payload)) + payload)
+
+
+def _recv_reply(sock: socket.socket) -> tuple[int, bytes]:
+    status, length = REPLY.unpack(_recv_exactly(sock, REPLY.size))
+    return status, _recv_exactly(sock, length)
+
+
+class DaemonClient(SyncClientBase):
+    """Client that forwards every transaction to a running mbe daemon."""
+
+    path: Path
+    sock: Optional[socket.socket]
+
+    def __init__(self, path: Path = DAEMON_SOCKET) -> None:
+        super().__init__()
+        self.path = path
+        self.sock = None
+        self.decoder = DecodePDU(False)
+
+    def open(self, key: str) -> bool:
+        """Connect to the daemon. True if it is running and serves bus key."""
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(str(self.path))
+            key_bytes = key.encode()
+            sock.sendall(struct.pack("<H", len(key_bytes)) + key_bytes)
+            status, payload = _recv_reply(sock)
+        except OSError:
+            return False
+        if status != STATUS_OK:
+            logger.info("mbe daemon not used: %s", payload.decode())
+            sock.close()
+            return False
+        self.sock = sock
+        return True
+
+    def connect(self) -> bool:
+        return self.sock is not None
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def execute(self, no_response_expected: bool, request: ModbusPDU) -> ModbusPDU:
+        if self.sock is None:
+            raise ModbusIOException("Not connected to mbe daemon")
+        pdu = bytes([request.function_code]) + request.encode()
+        self.sock.sendall(
+            REQUEST.pack(request.slave_id, no_response_expected, len(pdu)) + pdu
+        )
+        status, payload = _recv_reply(self.sock)
+        if status == STATUS_ERROR:
+            return ModbusIOException(payload.decode())  # type: ignore[return-value]
+        if status == STATUS_NO_RESPONSE:
+            return None  # type: ignore[return-value]
+        response = self.decoder.decode(payload)
+        if response is None:
+            return ModbusIOException("Unable to decode daemon response")  # type: ignore[return-value]
+        response.slave_id = request.slave_id
+        return response
+
+    def __str__(self) -> str:
+        return f"DaemonClient({self.path})"
+
+
+def connect_daemon(
+    bus: BusConfig, path: Path = DAEMON_SOCKET
+) -> Optional[DaemonClient]:
+    """Return a DaemonClient if a daemon serving bus is running."""
+    if not path.exists():
+        return None
+    client = DaemonClient(path)
+    if client.open(bus_key(bus)):
+        return client
+    return None
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    server: "DaemonServer"
+
+    def handle(self) -> None:
+        sock: socket.socket = self.request
+        try:
+            (key_len,) = struct.unpack("<H", _recv_exactly(sock, 2))
+            key = _recv_exactly(sock, key_len).decode()
+            if key != self.server.key:
+                _send_reply(
+                    sock, STATUS_ERROR, f"daemon serves {self.server.key}".encode()
+                )
+                return
+            _send_reply(sock, STATUS_OK)
+            while True:
+                slave, no_response_expected, length = REQUEST.unpack(
+                    _recv_exactly(sock, REQUEST.size)
+                )
+                pdu = _recv_exactly(sock, length)
+                self._execute(sock, slave, bool(no_response_expected), pdu)
+        except ConnectionError:
+            pass
+
+    def _execute(
+        self, sock: socket.socket, slave: int, no_response_expected: bool, pdu: bytes
+    ) -> None:
+        request = self.server.decoder.decode(pdu)
+        if request is None:
+            _send_reply(sock, STATUS_ERROR, b"Unable to decode request")
+            return
+        request.slave_id = slave
+        with self.server.lock:
+            try:
+                response = self.server.client.execute(no_response_expected, request)
+            except ModbusException as e:
+                _send_reply(sock, STATUS_ERROR, str(e).encode())
+                return
+        if response is None:
+            _send_reply(sock, STATUS_NO_RESPONSE)
+        elif isinstance(response, Exception):
+            _send_reply(sock, STATUS_ERROR, str(response).encode())
+        else:
+            _send_reply(
+                sock, STATUS_OK, bytes([response.function_code]) + response.encode()
+            )
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    """Serves transactions on one bus client to any number of local connections,
+    one transaction at a time."""
+
+    daemon_threads = True
+
+    def __init__(self, client: SyncClient, key: str, path: Path = DAEMON_SOCKET):
+        self.client = client
+        self.key = key
+        self.lock = threading.Lock()
+        self.decoder = DecodePDU(True)
+        self.path = path
+        if path.exists():
+            if _socket_alive(path):
+                raise RuntimeError(f"mbe daemon already running on {path}")
+            path.unlink()
+        super().__init__(str(path), _Handler)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.path.unlink(missing_ok=True)
+
+
+def _socket_alive(path: Path) -> bool:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(path))
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,86 @@
+"""Report by exception: pass on only the readings that moved.
+
+DeadbandFilter is a Sink that sits between the Engine and its outputs. It passes a
+reading of a point if
+
+    * it is the first reading of the point,
+    * a float value moved from the last value passed by more than the point's
+      deadband: the larger of its absolute deadband and its percent deadband of the
+      last value passed. Points without a deadband pass on any change.
+    * any other value (relay state bitmasks, strings) changed at all, or
+    * no reading of the point has been passed for heartbeat seconds, so outputs can
+      tell a point that is steady from one that is no longer polled.
+
+Deadbands are keyed by "device.point", e.g. "taidecent.Temperature".
+"""
+
+import time
+from typing import Callable
+from typing import Mapping
+from typing import Optional
+
+from mbe.cli_config import Deadband
+from mbe.engine import Reading
+from mbe.engine import Sink
+
+DEFAULT_HEARTBEAT = 300.0
+
+
+def point_key(reading: Reading) -> str:
+    return f"{reading.device}.{reading.point}"
+
+
+class DeadbandFilter:
+    """Sink passing the readings that moved, and heartbeats, to sink."""
+
+    sink: Sink
+    deadbands: dict[str, Deadband]
+    heartbeat: float
+    clock: Callable[[], float]
+    # "device.point" -> (last value passed, clock() when passed)
+    last: dict[str, tuple[float | int | str, float]]
+    passed: int
+    suppressed: int
+
+    def __init__(
+        self,
+        sink: Sink,
+        deadbands: Optional[Mapping[str, Deadband]] = None,
+        heartbeat: float = DEFAULT_HEARTBEAT,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.sink = sink
+        self.deadbands = dict(deadbands or {})
+        self.heartbeat = heartbeat
+        self.clock = clock
+        self.last = {}
+        self.passed = 0
+        self.suppressed = 0
+
+    def moved(
+        self, key: str, value: float | int | str, last: float | int | str
+    ) -> bool:
+        if not isinstance(value, float) or not isinstance(last, float):
+            return value != last
+        deadband = self.deadbands.get(key)
+        if deadband is None:
+            return value != last
+        band = max(deadband.absolute, deadband.percent / 100 * abs(last))
+        if band == 0:
+            return value != last
+        return abs(value - last) > band
+
+    def __call__(self, reading: Reading) -> None:
+        key = point_key(reading)
+        now = self.clock()
+        previous = self.last.get(key)
+        if (
+            previous is None
+            or now - previous[1] >= self.heartbeat
+            or self.moved(key, reading.value, previous[0])
+        ):
+            self.last[key] = (reading.value, now)
+            self.passed += 1
+            self.sink(reading)
+        else:
+            self.suppressed += 1
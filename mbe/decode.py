@@ -0,0 +1,177 @@
+"""Typed decoding of register values into engineering units.
+
+An Encoding describes how one value is held in one or more registers: unsigned or
+signed 16 or 32 bit integers with an optional scale, float32, or a string. Values
+spanning two registers are high word first unless the encoding says otherwise.
+
+decode_batch() decodes many values of one encoding at once with NumPy, e.g. the
+same register read in many polls or from many meters. decode_snapshots() and
+BlockDecoder apply a map of encodings to many read_planned() results or raw block
+reads. decode_value() decodes a single value.
+
+NumPy is imported on first use, so that importing register maps stays cheap.
+"""
+
+from dataclasses import dataclass
+from enum import Enum
+from typing import TYPE_CHECKING
+from typing import Mapping
+from typing import Sequence
+
+from mbe import tracing
+from mbe.planner import ReadBlock
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+class Kind(str, Enum):
+    uint16 = "uint16"
+    int16 = "int16"
+    uint32 = "uint32"
+    int32 = "int32"
+    float32 = "float32"
+    string = "string"
+
+
+class WordOrder(str, Enum):
+    big = "big"  # high word first
+    little = "little"  # low word first
+
+
+NumericWords = {
+    Kind.uint16: 1,
+    Kind.int16: 1,
+    Kind.uint32: 2,
+    Kind.int32: 2,
+    Kind.float32: 2,
+}
+
+
+@dataclass(frozen=True)
+class Encoding:
+    kind: Kind
+    words: int = 1
+    scale: float = 1.0
+    word_order: WordOrder = WordOrder.big
+
+    def __post_init__(self) -> None:
+        expected = NumericWords.get(self.kind)
+        if expected is not None and self.words != expected:
+            raise ValueError(f"{self.kind.value} takes {expected} registers")
+        if self.words < 1:
+            raise ValueError("An encoding takes at least one register")
+
+
+def uint16(scale: float = 1.0) -> Encoding:
+    return Encoding(Kind.uint16, 1, scale)
+
+
+def int16(scale: float = 1.0) -> Encoding:
+    return Encoding(Kind.int16, 1, scale)
+
+
+def uint32(scale: float = 1.0, word_order: WordOrder = WordOrder.big) -> Encoding:
+    return Encoding(Kind.uint32, 2, scale, word_order)
+
+
+def int32(scale: float = 1.0, word_order: WordOrder = WordOrder.big) -> Encoding:
+    return Encoding(Kind.int32, 2, scale, word_order)
+
+
+def float32(word_order: WordOrder = WordOrder.big) -> Encoding:
+    return Encoding(Kind.float32, 2, 1.0, word_order)
+
+
+def string(words: int) -> Encoding:
+    """Two characters per register, first character in the high byte."""
+    return Encoding(Kind.string, words)
+
+
+def decode_batch(encoding: Encoding, words) -> "np.ndarray":
+    """Decode n values from words, an array-like of shape (n, encoding.words).
+
+    Returns a 1-d array of n values: float64 for float32 and scaled encodings,
+    integers for unscaled ones and str for strings.
+    """
+    with tracing.span("decode", "decode", kind=encoding.kind.value):
+        return _decode_batch(encoding, words)
+
+
+def _decode_batch(encoding: Encoding, words) -> "np.ndarray":
+    import numpy as np
+
+    raw = np.asarray(words, dtype=np.uint16).reshape(-1, encoding.words)
+    kind = encoding.kind
+    if kind == Kind.string:
+        chars = np.ascontiguousarray(raw.astype(">u2")).view(f"S{2 * encoding.words}")
+        return np.char.rstrip(np.char.decode(chars[:, 0], "latin-1"))
+    values: np.ndarray
+    if encoding.words == 1:
+        values = raw[:, 0]
+        if kind == Kind.int16:
+            values = values.view(np.int16)
+    else:
+        high, low = raw[:, 0], raw[:, 1]
+        if encoding.word_order == WordOrder.little:
+            high, low = low, high
+        combined = (high.astype(np.uint32) << 16) | low
+        if kind == Kind.int32:
+            values = combined.view(np.int32)
+        elif kind == Kind.float32:
+            values = combined.view(np.float32).astype(np.float64)
+        else:
+            values = combined
+    if encoding.scale != 1.0:
+        # Dividing by 100 rather than multiplying by 0.01 gives the float nearest
+        # the true value, e.g. 0.57 rather than 0.5700000000000001.
+        divisor = round(1 / encoding.scale)
+        if divisor > 1 and divisor * encoding.scale == 1.0:
+            return values / divisor
+        return values * encoding.scale
+    return values
+
+
+def decode_value(encoding: Encoding, words: Sequence[int]) -> float | int | str:
+    """Decode one value held in words."""
+    return decode_batch(encoding, [words])[0].item()
+
+
+def decode_snapshots(
+    encodings: Mapping[str, Encoding],
+    snapshots: Sequence[Mapping[str, Sequence[int]]],
+) -> dict[str, "np.ndarray"]:
+    """Decode many read_planned() results at once, by register name.
+
+    Each snapshot maps register names to their words, and must hold every register
+    in encodings; leave out snapshots with failed reads.
+    """
+    return {
+        name: decode_batch(encoding, [snapshot[name] for snapshot in snapshots])
+        for name, encoding in encodings.items()
+    }
+
+
+class BlockDecoder:
+    """Decodes the registers of many raw reads of one ReadBlock at once."""
+
+    count: int
+    fields: list[tuple[str, int, Encoding]]
+
+    def __init__(self, block: ReadBlock, encodings: Mapping[str, Encoding]) -> None:
+        self.count = block.count
+        self.fields = [
+            (spec.name, spec.address - block.address, encodings[spec.name])
+            for spec in block.registers
+            if spec.name in encodings
+        ]
+
+    def decode(self, blocks) -> dict[str, "np.ndarray"]:
+        """Decode blocks, an array-like of shape (n, block.count), by register name."""
+        import numpy as np
+
+        raw = np.asarray(blocks, dtype=np.uint16).reshape(-1, self.count)
+        return {
+            name: decode_batch(encoding, raw[:, offset : offset + encoding.words])
+            for name, offset, encoding in self.fields
+        }
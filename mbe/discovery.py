@@ -0,0 +1,212 @@
+"""Finding USB serial adapters by stable identifiers.
+
+Device names such as /dev/ttyUSB0 are handed out in plug order, so they change when
+adapters are replugged or the machine reboots. SerialConfig can instead name an
+adapter by
+
+    by_id                        its link in /dev/serial/by-id (Linux), or
+    vid, pid and serial_number   its USB identifiers, any of which may be omitted.
+
+resolve() finds the current device of a SerialConfig. Enumerating the adapters is
+the slow part, so resolutions are kept in CACHE_FILE across invocations and a
+cached device is used as long as it exists. Where an adapter has a by-id link, the
+link is used as its device, so a cached resolution stays right across replugs.
+
+PortWatcher watches for adapters being plugged in and out, so long-running pollers
+can reconnect as soon as their adapter is back (see mbe.workers).
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+from typing import Optional
+
+import xdg
+
+from mbe.cli_config import SerialConfig
+
+logger = logging.getLogger(__name__)
+
+BY_ID_DIR = Path("/dev/serial/by-id")
+CACHE_FILE = Path(xdg.xdg_cache_home() / "gridworks" / "mbe" / "serial-ports.json")
+DEFAULT_WATCH_INTERVAL = 1.0
+
+
+@dataclass(frozen=True)
+class PortInfo:
+    device: str
+    vid: Optional[int] = None
+    pid: Optional[int] = None
+    serial_number: Optional[str] = None
+    description: str = ""
+    # Link to device in /dev/serial/by-id, if any.
+    by_id: Optional[str] = None
+
+    @property
+    def stable(self) -> str:
+        """The name of the port that survives replugging, if there is one."""
+        return self.device if self.by_id is None else self.by_id
+
+    @property
+    def usb(self) -> bool:
+        return self.vid is not None or "usbserial" in self.device
+
+
+def _by_id_links() -> dict[str, str]:
+    """device -> its link in /dev/serial/by-id."""
+    links = {}
+    try:
+        for link in BY_ID_DIR.iterdir():
+            links[os.path.realpath(link)] = str(link)
+    except OSError:
+        pass
+    return links
+
+
+def list_ports() -> list[PortInfo]:
+    """The serial ports of this machine, sorted by device."""
+    from serial.tools import list_ports as serial_list_ports
+
+    links = _by_id_links()
+    return sorted(
+        (
+            PortInfo(
+                device=p.device,
+                vid=p.vid,
+                pid=p.pid,
+                serial_number=p.serial_number,
+                description="" if p.description in (None, "n/a") else p.description,
+                by_id=links.get(os.path.realpath(p.device)),
+            )
+            for p in serial_list_ports.comports()
+        ),
+        key=lambda p: p.device,
+    )
+
+
+def matches(serial: SerialConfig, port: PortInfo) -> bool:
+    """Whether port is the adapter serial asks for. Without any identifiers, that
+    is any USB adapter."""
+    if serial.by_id is not None:
+        return (
+            port.by_id is not None and Path(port.by_id).name == Path(serial.by_id).name
+        )
+    if serial.vid is None and serial.pid is None and serial.serial_number is None:
+        return port.usb
+    return (
+        (serial.vid is None or serial.vid == port.vid)
+        and (serial.pid is None or serial.pid == port.pid)
+        and (serial.serial_number is None or serial.serial_number == port.serial_number)
+    )
+
+
+def find(serial: SerialConfig, ports: Optional[list[PortInfo]] = None) -> Optional[str]:
+    """The stable name of the first port matching serial, or None."""
+    for port in list_ports() if ports is None else ports:
+        if matches(serial, port):
+            return port.stable
+    return None
+
+
+def _load_cache(cache_file: Path) -> dict[str, str]:
+    try:
+        with cache_file.open() as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _save_cache(cache_file: Path, cache: dict[str, str]) -> None:
+    # Each writer renames its own temporary file into place, so concurrent saves,
+    # e.g. by workers of several serial buses, never mix; the last one wins, and
+    # the resolutions it lacks are found again on their next miss.
+    tmp: Optional[Path] = None
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=cache_file.parent, prefix=cache_file.name, delete=False
+        ) as f:
+            tmp = Path(f.name)
+            f.write(json.dumps(cache, indent=2))
+        tmp.replace(cache_file)
+    except OSError as e:
+        if tmp is not None:
+            tmp.unlink(missing_ok=True)
+        logger.debug("Could not write %s: %s", cache_file, e)
+
+
+def resolve(
+    serial: SerialConfig, refresh: bool = False, cache_file: Path = CACHE_FILE
+) -> Optional[str]:
+    """The device to open for serial, or None if no matching adapter is plugged in.
+
+    A configured port is used as is, and a by_id link if it exists. Otherwise the
+    cached resolution is used if its device exists, unless refresh.
+    """
+    if serial.port is not None:
+        return serial.port
+    if serial.by_id is not None:
+        link = BY_ID_DIR / serial.by_id
+        if link.exists():
+            return str(link)
+    cache = _load_cache(cache_file)
+    if not refresh and (cached := cache.get(serial.name)) and os.path.exists(cached):
+        return cached
+    port = find(serial)
+    if port is not None and cache.get(serial.name) != port:
+        cache[serial.name] = port
+        _save_cache(cache_file, cache)
+    return port
+
+
+class PortWatcher(threading.Thread):
+    """Calls on_change(added, removed) with the devices of the serial ports plugged
+    in and out since the last check, every interval seconds."""
+
+    def __init__(
+        self,
+        on_change: Callable[[set[str], set[str]], None],
+        interval: float = DEFAULT_WATCH_INTERVAL,
+    ) -> None:
+        super().__init__(name="serial port watcher", daemon=True)
+        self.on_change = on_change
+        self.interval = interval
+        self._stopping = threading.Event()
+
+    @staticmethod
+    def snapshot() -> set[str]:
+        """The devices and by-id links of the serial ports plugged in."""
+        return {name for p in list_ports() for name in (p.device, p.by_id) if name}
+
+    def run(self) -> None:
+        ports = self.snapshot()
+        while not self._stopping.wait(self.interval):
+            try:
+                current = self.snapshot()
+            except Exception as e:
+                logger.warning("Listing serial ports failed: %s", e)
+                continue
+            if current != ports:
+                added, removed = current - ports, ports - current
+                ports = current
+                try:
+                    self.on_change(added, removed)
+                except Exception:
+                    logger.exception("Handling serial port change failed")
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def __enter__(self) -> "PortWatcher":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+        self.join()
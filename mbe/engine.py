@@ -0,0 +1,288 @@
+"""Asyncio polling engine.
+
+Each device is polled by its own task, so a slow or missing device only delays
+itself. Transactions on one physical bus (a serial port or a TCP gateway) are still
+serialized by that Bus, most urgent first (see mbe.scheduler), while separate buses
+run in parallel.
+"""
+
+import asyncio
+import logging
+import time
+from abc import ABC
+from abc import abstractmethod
+from dataclasses import dataclass
+from typing import Awaitable
+from typing import Callable
+from typing import Iterable
+from typing import TYPE_CHECKING
+from typing import Optional
+from typing import Union
+
+from pymodbus.client import ModbusBaseClient
+from pymodbus.client.mixin import ModbusClientMixin
+from pymodbus.exceptions import ModbusException
+from pymodbus.pdu import ModbusPDU
+
+from mbe import tracing
+from mbe.pacing import Pacer
+from mbe.pipeline import PipelinedTcpClient
+from mbe.resilience import CircuitOpen
+from mbe.resilience import Resilience
+from mbe.resilience import no_response
+from mbe.resilience import set_timeout
+from mbe.rtu_tcp import RtuOverTcpClient
+from mbe.scheduler import BusScheduler
+from mbe.scheduler import DeadlineExceeded
+from mbe.scheduler import Priority
+from mbe.scheduler import scheduled
+from mbe.scheduler import scheduling
+
+if TYPE_CHECKING:
+    from mbe.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Reading:
+    device: str
+    point: str
+    value: float | int | str
+    timestamp: float
+
+
+Sink = Callable[[Reading], None]
+
+# Clients a Bus can drive.
+BusClient = Union[ModbusBaseClient, PipelinedTcpClient, RtuOverTcpClient]
+
+
+class Bus(ModbusClientMixin[Awaitable[ModbusPDU]]):
+    """An asyncio client for one physical bus, serializing its transactions in
+    order of priority.
+
+    Like ClientWrapper, the pymodbus request methods are provided by
+    ModbusClientMixin on top of execute(), and must be awaited.
+    """
+
+    name: str
+    client: BusClient
+    pacer: Optional[Pacer]
+    scheduler: BusScheduler
+    metrics: Optional["Metrics"]
+    # Frame bytes around each PDU, for the metrics.
+    overhead: int
+    resilience: Optional[Resilience]
+
+    def __init__(
+        self,
+        name: str,
+        client: BusClient,
+        pacer: Optional[Pacer] = None,
+        metrics: Optional["Metrics"] = None,
+        overhead: int = 0,
+        resilience: Optional[Resilience] = None,
+        window: int = 1,
+    ) -> None:
+        """window is the number of transactions the client can have in progress at
+        once, e.g. PipelinedTcpClient.window."""
+        ModbusClientMixin.__init__(self)  # type: ignore[arg-type]
+        self.name = name
+        self.client = client
+        self.pacer = pacer
+        self.scheduler = BusScheduler(window)
+        self.metrics = metrics
+        self.overhead = overhead
+        self.resilience = resilience
+        if resilience is not None:
+            client.retries = 0
+
+    async def connect(self) -> bool:
+        with tracing.async_span("connect", "client", client=str(self.client)):
+            connected = await self.client.connect()
+        if self.pacer is not None:
+            self.pacer.mark()
+        return connected
+
+    def close(self) -> None:
+        self.client.close()
+
+    async def reconnect(self, client: Optional[BusClient] = None) -> bool:
+        """Close the connection and connect again, through client instead if given,
+        e.g. when the USB serial adapter of the bus is plugged back in under another
+        device name. Waits for the transaction in progress."""
+        async with self.scheduler.slot(Priority.CONTROL):
+            self.client.close()
+            if client is not None:
+                self.client = client
+                if self.resilience is not None:
+                    client.retries = 0
+            return await self.connect()
+
+    def execute(self, no_response_expected: bool, request: ModbusPDU):
+        return self._execute(no_response_expected, request)
+
+    async def _execute(
+        self, no_response_expected: bool, request: ModbusPDU
+    ) -> ModbusPDU:
+        """Run request, retrying it and skipping slaves that stopped answering as
+        self.resilience says, if given."""
+        if self.resilience is None:
+            return await self._transact(no_response_expected, request)
+        slave = request.slave_id
+        attempt = 0
+        while True:
+            self.resilience.admit(slave)
+            start = time.monotonic()
+            try:
+                response = await self._transact(no_response_expected, request)
+            except DeadlineExceeded:
+                # The transaction never got on the bus, so says nothing of the slave.
+                self.resilience.skipped(slave)
+                raise
+            except (ModbusException, asyncio.TimeoutError) as e:
+                if not no_response(e):
+                    raise
+                response = e  # type: ignore[assignment]
+            if no_response_expected or not no_response(response):
+                # Without a response, the time taken is not a response time.
+                self.resilience.answered(
+                    slave,
+                    time.monotonic() - start,
+                    sample=attempt == 0 and not no_response_expected,
+                )
+                return response
+            self.resilience.failed(slave)
+            if (delay := self.resilience.retry_delay(slave, attempt)) is None:
+                if isinstance(response, Exception):
+                    raise response
+                return response
+            if self.metrics is not None:
+                self.metrics.retry(self.name, slave, request.function_code)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _transact(
+        self, no_response_expected: bool, request: ModbusPDU
+    ) -> ModbusPDU:
+        async with self.scheduler.slot(*scheduling(request.function_code)):
+            if self.pacer is not None:
+                if (delay := self.pacer.delay(request.slave_id)) > 0:
+                    with tracing.async_span("pacing", "bus", slave=request.slave_id):
+                        await asyncio.sleep(delay)
+            if self.resilience is not None:
+                set_timeout(self.client, self.resilience.timeout(request.slave_id))
+            start = time.monotonic()
+            response: object = None
+            try:
+                with tracing.async_span(
+                    "transaction",
+                    "bus",
+                    bus=self.name,
+                    slave=request.slave_id,
+                    function_code=request.function_code,
+                ):
+                    response = await self.client.execute(no_response_expected, request)
+                return response  # type: ignore[return-value]
+            except Exception as e:
+                response = e
+                raise
+            finally:
+                if self.pacer is not None:
+                    self.pacer.mark()
+                if self.metrics is not None:
+                    self.metrics.observe(
+                        self.name,
+                        request,
+                        response,
+                        time.monotonic() - start,
+                        self.overhead,
+                    )
+
+    def __str__(self) -> str:
+        return f"Bus({self.name})"
+
+
+class DevicePoller(ABC):
+    """Reads one device and converts the result into Readings.
+
+    A poll's transactions have the poller's priority and, unless the interval is
+    0, must get on the bus within one interval, after which the next poll is due
+    anyway.
+    """
+
+    name: str
+    device: int
+    interval: float
+    priority: Priority = Priority.TELEMETRY
+
+    def __init__(self, name: str, device: int, interval: float) -> None:
+        self.name = name
+        self.device = device
+        self.interval = interval
+
+    def reading(self, point: str, value: float | int | str) -> Reading:
+        return Reading(self.name, point, value, time.time())
+
+    @abstractmethod
+    async def poll(self, bus: Bus) -> list[Reading]:
+        raise NotImplementedError
+
+
+class Engine:
+    """Polls devices on one or more buses concurrently, sending Readings to sink."""
+
+    sink: Sink
+    buses: list[Bus]
+    pollers: list[tuple[Bus, DevicePoller]]
+
+    def __init__(self, sink: Sink) -> None:
+        self.sink = sink
+        self.buses = []
+        self.pollers = []
+
+    def add(self, bus: Bus, poller: DevicePoller) -> None:
+        if bus not in self.buses:
+            self.buses.append(bus)
+        self.pollers.append((bus, poller))
+
+    async def run(
+        self, itr: Optional[int] = None, tasks: Iterable[Awaitable[None]] = ()
+    ) -> None:
+        """Poll every device itr times, or forever if itr is None. tasks, e.g. ones
+        writing to the devices, run alongside the polling once the buses are
+        connected."""
+        await asyncio.gather(*(bus.connect() for bus in self.buses))
+        try:
+            await asyncio.gather(
+                *(self._poll_loop(bus, poller, itr) for bus, poller in self.pollers),
+                *tasks,
+            )
+        finally:
+            for bus in self.buses:
+                bus.close()
+
+    async def _poll_loop(
+        self, bus: Bus, poller: DevicePoller, itr: Optional[int]
+    ) -> None:
+        i = 0
+        while itr is None or i < itr:
+            start = time.monotonic()
+            try:
+                with scheduled(poller.priority, poller.interval or None):
+                    readings = await poller.poll(bus)
+                for reading in readings:
+                    self.sink(reading)
+            except CircuitOpen as e:
+                logger.debug("%s on %s: %s", poller.name, bus, e)
+            except (ModbusException, asyncio.TimeoutError) as e:
+                logger.warning("%s on %s: %s", poller.name, bus, e)
+            except Exception:
+                # A bug in a poller or sink must not stop the polling of its device.
+                logger.exception("Polling %s on %s failed", poller.name, bus)
+            i += 1
+            if itr is None or i < itr:
+                await asyncio.sleep(
+                    max(0.0, poller.interval - (time.monotonic() - start))
+                )
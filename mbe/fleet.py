@@ -0,0 +1,329 @@
+"""Polling the sites of a fleet from one machine, on every core.
+
+One event loop can keep hundreds of gateways busy, but the polling, decoding and
+bookkeeping of all of them then run in one interpreter, on one core. run_fleet()
+splits the sites of a FleetManifest into one shard per worker process, balancing
+their device counts (shard()), and each worker polls all sites of its shard from
+one event loop, with an Engine per site.
+
+Workers send the readings of their sites, in batches, and every health_interval
+seconds the health of each site to the parent, which writes them all to one
+stream of JSON lines:
+
+    {"type": "reading", "site": ..., "device": ..., "point": ..., "value": ...,
+     "timestamp": ...}
+    {"type": "health", "site": ..., "status": ..., "devices": ..., "failing": ...,
+     "polls": ..., "failures": ..., "readings": ..., "last_reading": ...,
+     "error": ...}
+
+A site's status is "ok" if the last poll of each of its devices succeeded,
+"degraded" if some failed, "down" if all failed and "unknown" until each device
+has been polled. polls, failures and readings count since the last health record.
+
+Workers are spawned rather than forked, and get the sites and the MbeConfig of
+the parent, whose resilience settings apply to every site. Metrics are not
+collected.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Optional
+from typing import TextIO
+
+from mbe import make_client
+from mbe.cli_config import FleetManifest
+from mbe.cli_config import MbeConfig
+from mbe.cli_config import SiteConfig
+from mbe.engine import Bus
+from mbe.engine import DevicePoller
+from mbe.engine import Engine
+from mbe.engine import Reading
+from mbe.engine import Sink
+from mbe.pollers import make_poller
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEALTH_INTERVAL = 60.0
+# Seconds between batches of readings sent by a worker, and the largest batch.
+FLUSH_INTERVAL = 0.25
+MAX_BATCH = 1000
+# Seconds the workers get to finish once the parent stops.
+STOP_TIMEOUT = 5.0
+
+# (site, device, point, value, timestamp)
+ReadingRecord = tuple[str, str, str, float | int | str, float]
+
+
+def shard(sites: list[SiteConfig], shards: int) -> list[list[SiteConfig]]:
+    """Split sites into at most shards non-empty shards of about equal device
+    counts, largest sites first."""
+
+    def weight(site: SiteConfig) -> int:
+        return max(1, sum(len(bus.devices) for bus in site.bus_configs()))
+
+    result: list[list[SiteConfig]] = [[] for _ in range(min(shards, len(sites)))]
+    loads = [0] * len(result)
+    for site in sorted(sites, key=weight, reverse=True):
+        i = loads.index(min(loads))
+        result[i].append(site)
+        loads[i] += weight(site)
+    return result
+
+
+@dataclass
+class SiteHealth:
+    site: str
+    devices: int
+    polls: int = 0
+    failures: int = 0
+    readings: int = 0
+    last_reading: Optional[float] = None
+    error: Optional[str] = None
+    # (bus, device id) -> whether its last poll succeeded
+    last_poll: dict[tuple[str, int], bool] = field(default_factory=dict)
+
+    @property
+    def failing(self) -> int:
+        return sum(not ok for ok in self.last_poll.values())
+
+    @property
+    def status(self) -> str:
+        if len(self.last_poll) < self.devices:
+            return "down" if self.error is not None else "unknown"
+        if self.failing == 0:
+            return "ok"
+        return "down" if self.failing == self.devices else "degraded"
+
+    def polled(self, key: tuple[str, int], readings: int) -> None:
+        self.polls += 1
+        self.readings += readings
+        self.last_poll[key] = True
+        if readings:
+            self.last_reading = time.time()
+
+    def failed(self, key: tuple[str, int], error: BaseException) -> None:
+        self.polls += 1
+        self.failures += 1
+        self.last_poll[key] = False
+        self.error = str(error) or type(error).__name__
+
+    def record(self) -> dict:
+        """The health record of the site, restarting the counts."""
+        record = dict(
+            type="health",
+            site=self.site,
+            status=self.status,
+            devices=self.devices,
+            failing=self.failing,
+            polls=self.polls,
+            failures=self.failures,
+            readings=self.readings,
+            last_reading=self.last_reading,
+            error=self.error,
+        )
+        self.polls = self.failures = self.readings = 0
+        return record
+
+
+class TrackedPoller(DevicePoller):
+    """Records the outcome of each poll of poller in the health of its site."""
+
+    def __init__(self, poller: DevicePoller, health: SiteHealth) -> None:
+        super().__init__(poller.name, poller.device, poller.interval)
+        self.priority = poller.priority
+        self.poller = poller
+        self.health = health
+
+    async def poll(self, bus: Bus) -> list[Reading]:
+        key = (bus.name, self.device)
+        try:
+            readings = await self.poller.poll(bus)
+        except Exception as e:
+            self.health.failed(key, e)
+            raise
+        self.health.polled(key, len(readings))
+        return readings
+
+
+class ShardWorker:
+    """Polls the sites of one shard, in a worker process."""
+
+    def __init__(
+        self,
+        cfg: MbeConfig,
+        sites: list[SiteConfig],
+        results: multiprocessing.Queue,
+        itr: Optional[int] = None,
+        interval: Optional[float] = None,
+        health_interval: float = DEFAULT_HEALTH_INTERVAL,
+    ) -> None:
+        self.cfg = cfg
+        self.sites = sites
+        self.results = results
+        self.itr = itr
+        self.interval = interval
+        self.health_interval = health_interval
+        self.health = {
+            site.name: SiteHealth(
+                site.name, sum(len(bus.devices) for bus in site.bus_configs())
+            )
+            for site in sites
+        }
+        self.batch: list[ReadingRecord] = []
+
+    def sink(self, site: str) -> Sink:
+        def site_sink(reading: Reading) -> None:
+            self.batch.append(
+                (site, reading.device, reading.point, reading.value, reading.timestamp)
+            )
+            if len(self.batch) >= MAX_BATCH:
+                self.flush()
+
+        return site_sink
+
+    def flush(self) -> None:
+        if self.batch:
+            # The queue pickles the batch later, in its feeder thread.
+            self.results.put(("readings", self.batch))
+            self.batch = []
+
+    def report(self) -> None:
+        self.flush()
+        self.results.put(("health", [h.record() for h in self.health.values()]))
+
+    async def _poll_site(self, site: SiteConfig) -> None:
+        health = self.health[site.name]
+        try:
+            engine = Engine(self.sink(site.name))
+            for bus_cfg in site.bus_configs():
+                bus = make_client.make_bus(self.cfg, bus=bus_cfg)
+                for device in bus_cfg.devices:
+                    engine.add(
+                        bus, TrackedPoller(make_poller(device, self.interval), health)
+                    )
+            await engine.run(self.itr)
+        except Exception as e:
+            logger.exception("Polling site %s failed", site.name)
+            health.error = str(e) or type(e).__name__
+
+    async def _background(self) -> None:
+        next_report = time.monotonic() + self.health_interval
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            self.flush()
+            if time.monotonic() >= next_report:
+                self.report()
+                next_report += self.health_interval
+
+    async def run(self) -> None:
+        background = asyncio.create_task(self._background())
+        try:
+            await asyncio.gather(*(self._poll_site(site) for site in self.sites))
+        finally:
+            background.cancel()
+            self.report()
+
+
+def _work(
+    index: int,
+    cfg: MbeConfig,
+    sites: list[SiteConfig],
+    results: multiprocessing.Queue,
+    itr: Optional[int],
+    interval: Optional[float],
+    health_interval: float,
+    log_level: int,
+) -> None:
+    """Entry point of worker process index."""
+    if log_level != logging.WARNING:
+        logging.basicConfig(level=log_level)
+    try:
+        asyncio.run(
+            ShardWorker(cfg, sites, results, itr, interval, health_interval).run()
+        )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        results.put(("done", index))
+
+
+def _write(out: TextIO, kind: str, payload: list) -> None:
+    if kind == "readings":
+        for site, device, point, value, timestamp in payload:
+            out.write(
+                json.dumps(
+                    dict(
+                        type="reading",
+                        site=site,
+                        device=device,
+                        point=point,
+                        value=value,
+                        timestamp=timestamp,
+                    )
+                )
+                + "\n"
+            )
+    elif kind == "health":
+        for record in payload:
+            out.write(json.dumps(record) + "\n")
+    out.flush()
+
+
+def run_fleet(
+    cfg: MbeConfig,
+    manifest: FleetManifest,
+    out: TextIO,
+    processes: Optional[int] = None,
+    itr: Optional[int] = None,
+    interval: Optional[float] = None,
+    health_interval: float = DEFAULT_HEALTH_INTERVAL,
+) -> None:
+    """Poll the sites of manifest from processes worker processes, one per CPU by
+    default, until each device has been polled itr times or, if itr is None, until
+    interrupted, writing readings and site health to out."""
+    shards = shard(manifest.sites, processes or os.cpu_count() or 1)
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    level = logging.getLogger().getEffectiveLevel()
+    workers = [
+        context.Process(
+            target=_work,
+            args=(i, cfg, sites, results, itr, interval, health_interval, level),
+            name=f"mbe fleet {i}",
+            daemon=True,
+        )
+        for i, sites in enumerate(shards)
+    ]
+    logger.info("Polling %s sites from %s processes", len(manifest.sites), len(workers))
+    for worker in workers:
+        worker.start()
+    running = set(range(len(workers)))
+    try:
+        while running:
+            try:
+                kind, payload = results.get(timeout=0.5)
+            except queue.Empty:
+                for i in list(running):
+                    if not workers[i].is_alive():
+                        logger.error(
+                            "Worker %s exited with code %s", i, workers[i].exitcode
+                        )
+                        running.discard(i)
+                continue
+            if kind == "done":
+                running.discard(payload)
+            else:
+                _write(out, kind, payload)
+    finally:
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for worker in workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+            if worker.is_alive():
+                worker.terminate()
@@ -1,12 +1,16 @@
-import time
+from typing import TYPE_CHECKING
 
 import rich
 
-from pymodbus.client.base import ModbusBaseSyncClient
+from mbe.planner import plan_reads
+from mbe.planner import read_planned
+
+if TYPE_CHECKING:
+    from mbe.client_wrapper import SyncClient
 
 
 def set_device_id(
-    client: ModbusBaseSyncClient, address: int, curr_device_id: int, new_device_id: int
+    client: "SyncClient", address: int, curr_device_id: int, new_device_id: int
 ) -> None:
     """Change the device id of a modbus server, if that device does not already report new_device_id.
 
@@ -18,14 +22,12 @@ def set_device_id(
         raise resp
     if new_device_id != resp.registers[0]:
         print(f"Setting {name} to {resp.registers[0]} -> {new_device_id}")
-        time.sleep(0.2)
         resp = client.write_register(
             address=address, value=new_device_id & 0xFFFF, slave=curr_device_id
         )
         if isinstance(resp, Exception):
             raise resp
         rich.print(resp)
-        time.sleep(0.2)
         resp = client.read_holding_registers(
             address=address, slave=new_device_id, count=1
         )
@@ -43,31 +45,30 @@ def set_device_id(
 
 
 def print_registers(
-    client: ModbusBaseSyncClient, device: int, registers: dict[str, int]
+    client: "SyncClient", device: int, registers: dict[str, int]
 ) -> None:
-    """Read and print registers of a device using pymodbus read_holding_registers()"""
+    """Read and print registers of a device using pymodbus read_holding_registers(),
+    merging neighboring registers into block reads."""
+    results = read_planned(client, device, plan_reads(registers))
     for name, address in registers.items():
-        time.sleep(0.2)
-        resp = client.read_holding_registers(address=address, slave=device, count=1)
         s = f"Read 0x{address:02X}   {name:20}: "
-        if isinstance(resp, Exception):
-            s += str(resp)
+        result = results[name]
+        if isinstance(result, Exception):
+            s += str(result)
         else:
-            s += f"{resp.registers[0]:6d}"
+            s += f"{result[0]:6d}"
         print(s)
 
 
 def write_register(
-    client: ModbusBaseSyncClient, device: int, address: int, value: int, name: str = ""
+    client: "SyncClient", device: int, address: int, value: int, name: str = ""
 ):
     """Write a register, read it back, print result. Uses pymodbus write_register() and
     read_holding_registers()."""
-    time.sleep(0.2)
     resp = client.write_register(address=address, value=value & 0xFFFF, slave=device)
     if isinstance(resp, Exception):
         print(resp)
     else:
-        time.sleep(0.2)
         resp = client.read_holding_registers(address=address, slave=device, count=1)
         s = f"Read 0x{address:02X}   {name:20}: "
         if isinstance(resp, Exception):
@@ -1,14 +1,206 @@
+import contextlib
+from contextlib import AbstractContextManager
+from pathlib import Path
+from typing import Optional
+
+from pymodbus.client import AsyncModbusSerialClient
+from pymodbus.client import AsyncModbusTcpClient
 from pymodbus.client import ModbusSerialClient
 from pymodbus.client import ModbusTcpClient
-from pymodbus.client.base import ModbusBaseSyncClient
 
+from mbe import tracing
+from mbe.cache import CachingClient
+from mbe.cache import RegisterCache
+from mbe.cli_config import BusConfig
+from mbe.cli_config import DeviceTypes
 from mbe.cli_config import MbeConfig
+from mbe.cli_config import Modes
+from mbe.client_wrapper import SyncClient
+from mbe.client_wrapper import TracedClient
+from mbe.daemon import connect_daemon
+from mbe.discovery import resolve
+from mbe.engine import Bus
+from mbe.engine import BusClient
+from mbe.metrics import RTU_OVERHEAD
+from mbe.metrics import TCP_OVERHEAD
+from mbe.metrics import InstrumentedClient
+from mbe.metrics import Metrics
+from mbe.metrics import MetricsExporter
+from mbe.pacing import PacedClient
+from mbe.pacing import Pacer
+from mbe.pipeline import PipelinedTcpClient
+from mbe.planner import RegisterMap
+from mbe.resilience import Resilience
+from mbe.resilience import RawClient
+from mbe.resilience import ResilientClient
+from mbe.rtu_tcp import RtuOverTcpClient
+from mbe.rtu_tcp import RtuOverTcpSyncClient
+from mbe.schneider import SchneiderRegisterClasses
+from mbe.schneider import SchneiderRegisters
+from mbe.taidecent import TaidacentRegisters
+from mbe.taidecent import TaidecentRegisterClasses
+from mbe.waveshare_relays import WaveShareRelayReadRegisters
+from mbe.waveshare_relays import WaveShareRelayRegisterClasses
+
+
+# Register maps and register classes of each device type, for the cache.
+DeviceRegisters: dict[DeviceTypes, tuple[RegisterMap, dict[str, str]]] = {
+    DeviceTypes.taidecent: (TaidacentRegisters, TaidecentRegisterClasses),
+    DeviceTypes.waveshare_relays: (
+        WaveShareRelayReadRegisters,
+        WaveShareRelayRegisterClasses,
+    ),
+    DeviceTypes.schneider: (SchneiderRegisters, SchneiderRegisterClasses),
+}
+
+
+def make_pacer(bus: BusConfig) -> Pacer:
+    return Pacer(
+        bus.serial.baud,
+        turnaround=bus.serial.turnaround,
+        device_turnaround=bus.serial.device_turnaround,
+    )
+
+
+def make_cache(cfg: MbeConfig, bus: BusConfig) -> RegisterCache:
+    cache = RegisterCache(cfg.cache.max_entries)
+    for device in bus.devices:
+        registers, classes = DeviceRegisters[device.type]
+        cache.classify(device.id, registers, classes, cfg.cache.ttl)
+    return cache
+
+
+def serial_port(bus: BusConfig) -> str:
+    """The device of the serial port of bus."""
+    port = resolve(bus.serial)
+    if port is None:
+        raise ValueError(f"No serial port found for {bus.serial.name}")
+    return port
+
+
+def traced(client: SyncClient) -> SyncClient:
+    """client, recording its connects and transactions if a trace is recorded."""
+    return TracedClient(client) if tracing.enabled() else client
+
+
+def make_resilience(cfg: MbeConfig, bus: BusConfig) -> Resilience:
+    return Resilience(cfg.resilience, bus.name)
+
+
+def make_metrics(cfg: MbeConfig) -> Optional[Metrics]:
+    """Metrics for the configured devices, or None if metrics export is not
+    configured."""
+    if not cfg.metrics.enabled:
+        return None
+    return Metrics(
+        {
+            (bus.name, device.id): device.label
+            for bus in cfg.bus_configs()
+            for device in bus.devices
+        }
+    )
+
+
+def export_metrics(
+    cfg: MbeConfig, metrics: Optional[Metrics]
+) -> AbstractContextManager:
+    """Context exporting metrics as configured, or doing nothing if metrics is None."""
+    if metrics is None:
+        return contextlib.nullcontext()
+    return MetricsExporter(
+        metrics,
+        file=None if cfg.metrics.file is None else Path(cfg.metrics.file),
+        format=cfg.metrics.format,
+        interval=cfg.metrics.interval,
+        port=cfg.metrics.port,
+    )
+
+
+def make(
+    cfg: MbeConfig,
+    use_daemon: bool = True,
+    metrics: Optional[Metrics] = None,
+    bus: Optional[BusConfig] = None,
+) -> SyncClient:
+    """Make a client for bus, by default the configured default bus. If use_daemon
+    and an mbe daemon is serving that bus, the client forwards transactions to the
+    daemon, which keeps its own register cache and metrics. Otherwise, if metrics
+    is given, every bus transaction is recorded in it. Transactions are retried and
+    timed out as configured in cfg.resilience."""
+    if bus is None:
+        bus = cfg.default_bus()
+    if use_daemon and (daemon := connect_daemon(bus)) is not None:
+        return traced(daemon)
+    raw: RawClient
+    client: SyncClient
+    if bus.mode == Modes.serial:
+        raw = client = ModbusSerialClient(serial_port(bus), baudrate=bus.serial.baud)
+        client = traced(client)
+        if metrics is not None:
+            client = InstrumentedClient(client, metrics, bus.name, RTU_OVERHEAD)
+        client = PacedClient(client, make_pacer(bus))
+    elif bus.mode == Modes.rtu_tcp:
+        raw = client = RtuOverTcpSyncClient(bus.tcp.host, bus.tcp.port)
+        client = traced(client)
+        if metrics is not None:
+            client = InstrumentedClient(client, metrics, bus.name, RTU_OVERHEAD)
+    else:
+        raw = client = ModbusTcpClient(bus.tcp.host, port=bus.tcp.port)
+        client = traced(client)
+        if metrics is not None:
+            client = InstrumentedClient(client, metrics, bus.name, TCP_OVERHEAD)
+    client = ResilientClient(client, raw, make_resilience(cfg, bus), metrics)
+    return CachingClient(client, make_cache(cfg, bus))
+
+
+def make_async(bus: BusConfig, port: Optional[str] = None) -> BusClient:
+    """An asyncio client for bus, on port if given instead of its serial port. TCP
+    clients with a window above 1 keep that many requests in flight on a
+    connection shared with the other clients for the gateway."""
+    if bus.mode == Modes.serial:
+        return AsyncModbusSerialClient(
+            serial_port(bus) if port is None else port, baudrate=bus.serial.baud
+        )
+    elif bus.mode == Modes.rtu_tcp:
+        return RtuOverTcpClient(bus.tcp.host, bus.tcp.port)
+    elif bus.tcp.window > 1:
+        return PipelinedTcpClient(
+            bus.tcp.host, bus.tcp.port, bus.tcp.window, bus.tcp.slave_window
+        )
+    else:
+        return AsyncModbusTcpClient(bus.tcp.host, port=bus.tcp.port)
 
 
-def make(cfg: MbeConfig) -> ModbusBaseSyncClient:
-    if cfg.mode == "serial":
-        if cfg.serial.port is None:
-            raise ValueError("No serial port specified")
-        return ModbusSerialClient(cfg.serial.port, baudrate=cfg.serial.baud)
+def make_bus(
+    cfg: MbeConfig, metrics: Optional[Metrics] = None, bus: Optional[BusConfig] = None
+) -> Bus:
+    """Make an asyncio Bus for bus, by default the configured default bus. Must be
+    called from within a running event loop."""
+    if bus is None:
+        bus = cfg.default_bus()
+    if bus.mode == Modes.serial:
+        return Bus(
+            bus.name,
+            make_async(bus),
+            make_pacer(bus),
+            metrics=metrics,
+            overhead=RTU_OVERHEAD,
+            resilience=make_resilience(cfg, bus),
+        )
+    elif bus.mode == Modes.rtu_tcp:
+        return Bus(
+            bus.name,
+            make_async(bus),
+            metrics=metrics,
+            overhead=RTU_OVERHEAD,
+            resilience=make_resilience(cfg, bus),
+        )
     else:
-        return ModbusTcpClient(cfg.tcp.host)
+        return Bus(
+            bus.name,
+            make_async(bus),
+            metrics=metrics,
+            overhead=TCP_OVERHEAD,
+            resilience=make_resilience(cfg, bus),
+            window=bus.tcp.window,
+        )
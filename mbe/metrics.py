@@ -0,0 +1,528 @@
+"""Per-transaction metrics of the bus clients.
+
+Metrics keeps, for each bus, slave and function code, a histogram of transaction
+latencies and counters of outcomes, Modbus exception responses, retries, bytes on
+the wire and the time the bus was busy. InstrumentedClient records every
+transaction of a sync client; Bus records into the Metrics it is given.
+
+Outcomes are:
+
+    ok         a normal response
+    exception  a Modbus exception response (counted per exception code)
+    timeout    no valid response. pymodbus discards frames with a bad CRC, so
+               CRC errors are counted here too.
+    error      any other failure, e.g. the connection could not be opened
+
+A bus is busy while at least one transaction is in progress. On a half-duplex
+serial bus transactions follow each other, but a pipelined TCP connection (see
+mbe.pipeline) has several in flight at once, so the busy time of a bus or device is
+the union of its transaction intervals, not the sum of their durations, which the
+busy seconds of each function code still count. Utilization is busy time over the
+time since the metrics started, at most 1. Bytes are those of the request and response frames,
+including RTU address and CRC or the Modbus TCP MBAP header.
+
+MetricsExporter serves the metrics over HTTP (/metrics in the Prometheus text
+format, /metrics.json as JSON) and/or periodically writes them to a file.
+"""
+
+import asyncio
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from collections import deque
+from dataclasses import dataclass
+from dataclasses import field
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable
+from typing import Optional
+
+from pymodbus.exceptions import ModbusIOException
+from pymodbus.pdu import ModbusPDU
+
+from mbe.cli_config import MetricsFormat
+from mbe.client_wrapper import ClientWrapper
+from mbe.client_wrapper import SyncClient
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets. A 9600 baud RTU read
+# of a few registers takes about 20 ms; a missing device takes the full timeout.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+OK = "ok"
+EXCEPTION = "exception"
+TIMEOUT = "timeout"
+ERROR = "error"
+OUTCOMES = (OK, EXCEPTION, TIMEOUT, ERROR)
+
+# Frame bytes around the PDU: address and CRC, or the MBAP header.
+RTU_OVERHEAD = 3
+TCP_OVERHEAD = 7
+
+DEFAULT_EXPORT_INTERVAL = 10.0
+
+# Seconds of past busy intervals kept to merge transactions into. Part of a
+# transaction overlapping only intervals older than this counts as busy again.
+BUSY_HORIZON = 60.0
+
+
+class Histogram:
+    """Counts of observations in each bucket, by default LATENCY_BUCKETS, plus
+    their sum."""
+
+    bounds: tuple[float, ...]
+    counts: list[int]
+    sum: float
+
+    def __init__(self, bounds: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.bounds = bounds
+        # The last count is for observations above the largest bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def add(self, other: "Histogram") -> None:
+        """Add the observations of other, which has the same bounds."""
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        """(upper bound, observations <= bound) for each bucket, ending with inf."""
+        result = []
+        total = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q quantile."""
+        total = self.count
+        if total == 0:
+            return None
+        for bound, below in self.cumulative():
+            if below >= q * total:
+                return bound
+        return float("inf")
+
+
+@dataclass
+class TransactionStats:
+    """Metrics of the transactions with one function code to one slave."""
+
+    latency: Histogram = field(default_factory=Histogram)
+    outcomes: dict[str, int] = field(default_factory=lambda: dict.fromkeys(OUTCOMES, 0))
+    # exception code -> responses
+    exceptions: dict[int, int] = field(default_factory=dict)
+    retries: int = 0
+    request_bytes: int = 0
+    response_bytes: int = 0
+    busy: float = 0.0
+
+
+class BusyTime:
+    """Total time during which at least one of the recorded intervals was in
+    progress."""
+
+    total: float
+    # Disjoint (start, end) of recent busy intervals, in order.
+    intervals: deque[tuple[float, float]]
+
+    def __init__(self) -> None:
+        self.total = 0.0
+        self.intervals = deque()
+
+    def add(self, start: float, end: float) -> None:
+        intervals = self.intervals
+        covered = 0.0
+        first, last = start, end
+        # Intervals recorded earlier but ending later, as transactions complete
+        # out of order.
+        later: list[tuple[float, float]] = []
+        while intervals and intervals[-1][1] >= start:
+            s, e = intervals.pop()
+            if s > end:
+                later.append((s, e))
+                continue
+            covered += min(e, end) - max(s, start)
+            first, last = min(first, s), max(last, e)
+        self.total += end - start - covered
+        intervals.append((first, last))
+        intervals.extend(reversed(later))
+        while intervals[0][1] < end - BUSY_HORIZON:
+            intervals.popleft()
+
+
+def classify(response: object) -> tuple[str, Optional[int]]:
+    """Outcome of a transaction, and the exception code of exception responses.
+    response is the response PDU, or the exception returned or raised instead."""
+    if isinstance(response, (ModbusIOException, asyncio.TimeoutError, TimeoutError)):
+        return TIMEOUT, None
+    if isinstance(response, BaseException):
+        return ERROR, None
+    if isinstance(response, ModbusPDU) and response.isError():
+        return EXCEPTION, getattr(response, "exception_code", None)
+    return OK, None
+
+
+def pdu_length(pdu: ModbusPDU) -> int:
+    return 1 + len(pdu.encode())
+
+
+class Metrics:
+    """Transaction metrics of one or more buses. Thread safe."""
+
+    clock: Callable[[], float]
+    started: float
+    # (bus, slave) -> device name, for labels
+    names: dict[tuple[str, int], str]
+    # (bus, slave, function code) -> stats
+    stats: dict[tuple[str, int, int], TransactionStats]
+    busy: defaultdict[str, BusyTime]
+    device_busy: defaultdict[tuple[str, int], BusyTime]
+
+    def __init__(
+        self,
+        names: Optional[dict[tuple[str, int], str]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.clock = clock
+        self.started = clock()
+        self.names = dict(names or {})
+        self.stats = {}
+        self.busy = defaultdict(BusyTime)
+        self.device_busy = defaultdict(BusyTime)
+        self.lock = threading.Lock()
+
+    def _stats(self, bus: str, slave: int, function_code: int) -> TransactionStats:
+        key = (bus, slave, function_code)
+        if (stats := self.stats.get(key)) is None:
+            stats = self.stats[key] = TransactionStats()
+        return stats
+
+    def observe(
+        self,
+        bus: str,
+        request: ModbusPDU,
+        response: object,
+        duration: float,
+        overhead: int,
+    ) -> None:
+        """Record a transaction. response is the response PDU, None if no response
+        was expected, or the exception returned or raised instead of a response."""
+        if response is None:
+            outcome, code = OK, None
+        else:
+            outcome, code = classify(response)
+        request_bytes = overhead + pdu_length(request)
+        response_bytes = 0
+        if isinstance(response, ModbusPDU):
+            response_bytes = overhead + pdu_length(response)
+        end = self.clock()
+        with self.lock:
+            self.busy[bus].add(end - duration, end)
+            self.device_busy[(bus, request.slave_id)].add(end - duration, end)
+            stats = self._stats(bus, request.slave_id, request.function_code)
+            stats.latency.observe(duration)
+            stats.outcomes[outcome] += 1
+            if code is not None:
+                stats.exceptions[code] = stats.exceptions.get(code, 0) + 1
+            stats.request_bytes += request_bytes
+            stats.response_bytes += response_bytes
+            stats.busy += duration
+
+    def retry(self, bus: str, slave: int, function_code: int) -> None:
+        """Record that a transaction is being retried."""
+        with self.lock:
+            self._stats(bus, slave, function_code).retries += 1
+
+    def elapsed(self) -> float:
+        return max(self.clock() - self.started, 1e-9)
+
+    def _labels(self, bus: str, slave: int) -> dict[str, str]:
+        return dict(bus=bus, slave=str(slave), device=self.names.get((bus, slave), ""))
+
+    def to_json(self) -> dict:
+        with self.lock:
+            elapsed = self.elapsed()
+            buses: dict[str, dict] = {}
+            for (bus, slave, fc), stats in sorted(self.stats.items()):
+                b = buses.setdefault(
+                    bus,
+                    dict(utilization=self.busy[bus].total / elapsed, devices={}),
+                )
+                d = b["devices"].setdefault(
+                    str(slave),
+                    dict(
+                        device=self.names.get((bus, slave), ""),
+                        utilization=self.device_busy[(bus, slave)].total / elapsed,
+                        functions={},
+                    ),
+                )
+                d["functions"][str(fc)] = dict(
+                    transactions=stats.latency.count,
+                    outcomes=dict(stats.outcomes),
+                    exceptions={str(c): n for c, n in stats.exceptions.items()},
+                    retries=stats.retries,
+                    request_bytes=stats.request_bytes,
+                    response_bytes=stats.response_bytes,
+                    busy_seconds=stats.busy,
+                    latency=dict(
+                        sum=stats.latency.sum,
+                        p50=stats.latency.quantile(0.5),
+                        p99=stats.latency.quantile(0.99),
+                        buckets={
+                            str(bound): n for bound, n in stats.latency.cumulative()
+                        },
+                    ),
+                )
+            return dict(elapsed=elapsed, buses=buses)
+
+    def prometheus(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        lines: list[str] = []
+
+        def metric(name: str, kind: str, help: str) -> None:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def sample(name: str, labels: dict[str, str], value: float) -> None:
+            text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            lines.append(f"{name}{{{text}}} {value:g}")
+
+        with self.lock:
+            elapsed = self.elapsed()
+            series = sorted(self.stats.items())
+            metric(
+                "mbe_transaction_duration_seconds",
+                "histogram",
+                "Duration of Modbus transactions.",
+            )
+            for (bus, slave, fc), stats in series:
+                labels = self._labels(bus, slave) | dict(function=str(fc))
+                for bound, n in stats.latency.cumulative():
+                    sample(
+                        "mbe_transaction_duration_seconds_bucket",
+                        labels
+                        | dict(le="+Inf" if bound == float("inf") else f"{bound:g}"),
+                        n,
+                    )
+                sample(
+                    "mbe_transaction_duration_seconds_sum", labels, stats.latency.sum
+                )
+                sample(
+                    "mbe_transaction_duration_seconds_count",
+                    labels,
+                    stats.latency.count,
+                )
+            metric(
+                "mbe_transactions_total", "counter", "Modbus transactions by outcome."
+            )
+            for (bus, slave, fc), stats in series:
+                labels = self._labels(bus, slave) | dict(function=str(fc))
+                for outcome, n in stats.outcomes.items():
+                    sample("mbe_transactions_total", labels | dict(outcome=outcome), n)
+            metric(
+                "mbe_exception_responses_total",
+                "counter",
+                "Modbus exception responses by exception code.",
+            )
+            for (bus, slave, fc), stats in series:
+                labels = self._labels(bus, slave) | dict(function=str(fc))
+                for code, n in sorted(stats.exceptions.items()):
+                    sample(
+                        "mbe_exception_responses_total",
+                        labels | dict(code=str(code)),
+                        n,
+                    )
+            for name, help, attr in (
+                ("mbe_retries_total", "Retried Modbus transactions.", "retries"),
+                (
+                    "mbe_request_bytes_total",
+                    "Bytes of request frames.",
+                    "request_bytes",
+                ),
+                (
+                    "mbe_response_bytes_total",
+                    "Bytes of response frames.",
+                    "response_bytes",
+                ),
+                (
+                    "mbe_busy_seconds_total",
+                    "Seconds spent in transactions, overlapping ones each counted.",
+                    "busy",
+                ),
+            ):
+                metric(name, "counter", help)
+                for (bus, slave, fc), stats in series:
+                    labels = self._labels(bus, slave) | dict(function=str(fc))
+                    sample(name, labels, getattr(stats, attr))
+            metric(
+                "mbe_bus_utilization",
+                "gauge",
+                "Fraction of the time since start the bus spent in transactions.",
+            )
+            for bus, busy in sorted(self.busy.items()):
+                sample("mbe_bus_utilization", dict(bus=bus), busy.total / elapsed)
+            metric(
+                "mbe_device_utilization",
+                "gauge",
+                "Fraction of the time since start the bus spent in transactions with the device.",
+            )
+            for (bus, slave), busy in sorted(self.device_busy.items()):
+                sample(
+                    "mbe_device_utilization",
+                    self._labels(bus, slave),
+                    busy.total / elapsed,
+                )
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class InstrumentedClient(ClientWrapper):
+    """Records every transaction of a sync client on bus in metrics."""
+
+    metrics: Metrics
+    bus: str
+    overhead: int
+
+    def __init__(
+        self, client: SyncClient, metrics: Metrics, bus: str, overhead: int
+    ) -> None:
+        super().__init__(client)
+        self.metrics = metrics
+        self.bus = bus
+        self.overhead = overhead
+
+    def execute(self, no_response_expected: bool, request: ModbusPDU) -> ModbusPDU:
+        start = time.monotonic()
+        response: object = None
+        try:
+            response = self.client.execute(no_response_expected, request)
+            return response  # type: ignore[return-value]
+        except Exception as e:
+            response = e
+            raise
+        finally:
+            self.metrics.observe(
+                self.bus, request, response, time.monotonic() - start, self.overhead
+            )
+
+
+def render(metrics: Metrics, format: MetricsFormat) -> str:
+    if format == MetricsFormat.json:
+        return json.dumps(metrics.to_json(), indent=2) + "\n"
+    return metrics.prometheus()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "MetricsServer"
+
+    def do_GET(self) -> None:
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            body = self.server.metrics.prometheus().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/metrics.json":
+            body = render(self.server.metrics, MetricsFormat.json).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format, *args)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, metrics: Metrics, host: str, port: int) -> None:
+        self.metrics = metrics
+        super().__init__((host, port), _Handler)
+
+
+def write_metrics(metrics: Metrics, path: Path, format: MetricsFormat) -> None:
+    """Replace path with the current metrics, so readers never see a partial file."""
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(render(metrics, format))
+    os.replace(tmp, path)
+
+
+class MetricsExporter:
+    """Serves metrics over HTTP on host:port and/or writes them to file every
+    interval seconds and on stop()."""
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        file: Optional[Path] = None,
+        format: MetricsFormat = MetricsFormat.prometheus,
+        interval: float = DEFAULT_EXPORT_INTERVAL,
+        host: str = "127.0.0.1",
+        port: Optional[int] = None,
+    ) -> None:
+        self.metrics = metrics
+        self.file = file
+        self.format = format
+        self.interval = interval
+        self.server = None if port is None else MetricsServer(metrics, host, port)
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    def _write_loop(self) -> None:
+        assert self.file is not None
+        while not self._stop.wait(self.interval):
+            try:
+                write_metrics(self.metrics, self.file, self.format)
+            except OSError as e:
+                logger.warning("Writing metrics to %s failed: %s", self.file, e)
+
+    def start(self) -> "MetricsExporter":
+        if self.server is not None:
+            self._threads.append(
+                threading.Thread(target=self.server.serve_forever, daemon=True)
+            )
+        if self.file is not None:
+            self._threads.append(threading.Thread(target=self._write_loop, daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        for thread in self._threads:
+            thread.join()
+        if self.file is not None:
+            write_metrics(self.metrics, self.file, self.format)
+
+    def __enter__(self) -> "MetricsExporter":
+        return self.start()
+
+    def __exit__(self, klass, value, traceback) -> None:
+        self.stop()
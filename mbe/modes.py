@@ -0,0 +1,11 @@
+"""How mbe reaches a bus. Kept apart from mbe.cli_config, and its pydantic import,
+so that the CLI can declare options with it without slowing down every command."""
+
+from enum import Enum
+
+
+class Modes(str, Enum):
+    serial = "serial"
+    tcp = "tcp"
+    # RTU frames to the tcp host and port, for transparent serial gateways.
+    rtu_tcp = "rtu_tcp"
@@ -0,0 +1,108 @@
+"""Inter-frame pacing for Modbus RTU.
+
+An RTU master must leave the bus silent for at least 3.5 character times between
+frames. Some devices also need extra turnaround time before they will accept the
+next request. Pacer tracks when the last frame ended and waits only for whatever
+part of the required interval has not already passed, rather than sleeping a fixed
+amount before every transaction.
+
+Modbus TCP needs no pacing; make_client.make() only paces serial clients.
+"""
+
+import time
+from typing import Callable
+from typing import Optional
+
+from pymodbus.pdu import ModbusPDU
+
+from mbe import tracing
+from mbe.client_wrapper import ClientWrapper
+from mbe.client_wrapper import SyncClient
+
+# Start + 8 data + parity/stop + stop bits, per the Modbus serial line spec.
+BITS_PER_CHAR = 11
+
+# Above 19200 baud the spec fixes the silent interval instead of scaling it.
+FIXED_SILENT_INTERVAL_BAUD = 19200
+FIXED_SILENT_INTERVAL = 0.00175
+
+
+def char_time(baud: int) -> float:
+    """Seconds to transmit one character at baud."""
+    return BITS_PER_CHAR / baud
+
+
+def silent_interval(baud: int) -> float:
+    """Minimum RTU silent interval between frames (3.5 character times)."""
+    if baud > FIXED_SILENT_INTERVAL_BAUD:
+        return FIXED_SILENT_INTERVAL
+    return 3.5 * char_time(baud)
+
+
+class Pacer:
+    """Tracks the end of the last frame and computes the wait before the next one."""
+
+    interval: float
+    turnaround: float
+    device_turnaround: dict[int, float]
+    last_frame_end: Optional[float]
+
+    def __init__(
+        self,
+        baud: int,
+        turnaround: float = 0.0,
+        device_turnaround: Optional[dict[int, float]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.interval = silent_interval(baud)
+        self.turnaround = turnaround
+        self.device_turnaround = dict(device_turnaround or {})
+        self.clock = clock
+        self.last_frame_end = None
+
+    def required_gap(self, device: Optional[int] = None) -> float:
+        """Silence required before a frame addressed to device."""
+        turnaround = self.turnaround
+        if device is not None:
+            turnaround = self.device_turnaround.get(device, turnaround)
+        return max(self.interval, turnaround)
+
+    def delay(self, device: Optional[int] = None) -> float:
+        """Seconds still to wait before sending a frame to device."""
+        if self.last_frame_end is None:
+            return 0.0
+        elapsed = self.clock() - self.last_frame_end
+        return max(0.0, self.required_gap(device) - elapsed)
+
+    def wait(self, device: Optional[int] = None) -> None:
+        if (delay := self.delay(device)) > 0:
+            with tracing.span("pacing", "bus", slave=device):
+                time.sleep(delay)
+
+    def mark(self) -> None:
+        """Record that a frame (or transaction) just ended."""
+        self.last_frame_end = self.clock()
+
+
+class PacedClient(ClientWrapper):
+    """Client wrapper that paces every transaction with a Pacer."""
+
+    pacer: Pacer
+
+    def __init__(self, client: SyncClient, pacer: Pacer) -> None:
+        super().__init__(client)
+        self.pacer = pacer
+
+    def connect(self) -> bool:
+        connected = self.client.connect()
+        # Treat opening the port as the end of a frame, so the line is given one
+        # silent interval to settle before the first request.
+        self.pacer.mark()
+        return connected
+
+    def execute(self, no_response_expected: bool, request: ModbusPDU) -> ModbusPDU:
+        self.pacer.wait(request.slave_id)
+        try:
+            return self.client.execute(no_response_expected, request)
+        finally:
+            self.pacer.mark()
@@ -0,0 +1,248 @@
+"""Pipelined Modbus TCP: several requests in flight on one gateway connection.
+
+A plain Modbus TCP client waits for each response before sending the next request,
+so every transaction through a gateway costs a network round trip on top of its
+time on the RS-485 side. A gateway reads requests from its TCP connection while
+the serial bus is busy and answers them in turn, so with requests already queued
+in the gateway the serial bus never waits for the network.
+
+PipelinedConnection sends up to `window` requests without waiting, tags each with
+its own MBAP transaction id and hands each response to the request with that id.
+Requests to one slave are sent in the order they are made, at most `slave_window`
+at a time, so a write is never overtaken by a later read of the same slave however
+the gateway orders its work. A response that arrives after its request timed out
+is dropped.
+
+Connections are pooled per event loop: all clients for the same gateway host and
+port share one connection, and with it the window, which is the gateway's queue.
+"""
+
+import asyncio
+import itertools
+import logging
+import struct
+import weakref
+from typing import Optional
+
+from pymodbus.exceptions import ConnectionException
+from pymodbus.exceptions import ModbusIOException
+from pymodbus.pdu import DecodePDU
+from pymodbus.pdu import ModbusPDU
+
+logger = logging.getLogger(__name__)
+
+# transaction id, protocol id (0), length of the rest, unit id
+MBAP = struct.Struct(">HHHB")
+DEFAULT_WINDOW = 4
+DEFAULT_TIMEOUT = 3.0
+
+
+class PipelinedConnection:
+    """One connection to a gateway, carrying up to window requests at a time."""
+
+    host: str
+    port: int
+    window: int
+    slave_window: int
+    # transaction id -> future of the response
+    pending: dict[int, asyncio.Future]
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        window: int = DEFAULT_WINDOW,
+        slave_window: int = 1,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.window = window
+        self.slave_window = slave_window
+        self.pending = {}
+        self.users = 0
+        self.decoder = DecodePDU(False)
+        self._slots = asyncio.Semaphore(window)
+        self._slaves: dict[int, asyncio.Semaphore] = {}
+        self._tids = itertools.count(1)
+        self._connecting = asyncio.Lock()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._receiving: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self, timeout: float = DEFAULT_TIMEOUT) -> bool:
+        async with self._connecting:
+            if self.connected:
+                return True
+            try:
+                reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), timeout
+                )
+            except (OSError, asyncio.TimeoutError) as e:
+                logger.warning(
+                    "Connecting to %s:%s failed: %s", self.host, self.port, e
+                )
+                return False
+            self._receiving = asyncio.create_task(self._receive(reader))
+            return True
+
+    def close(self) -> None:
+        if self._receiving is not None:
+            self._receiving.cancel()
+            self._receiving = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._fail_pending(ConnectionException(f"Closed {self}"))
+
+    def _fail_pending(self, error: Exception) -> None:
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+
+    async def _receive(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                header = await reader.readexactly(MBAP.size)
+                tid, _, length, unit = MBAP.unpack(header)
+                pdu = await reader.readexactly(length - 1)
+                if (future := self.pending.pop(tid, None)) is None:
+                    logger.debug("Dropped late response %s from %s", tid, self)
+                    continue
+                if future.done():
+                    continue
+                response = self.decoder.decode(pdu)
+                if response is None:
+                    future.set_exception(
+                        ModbusIOException(f"Unable to decode response from {self}")
+                    )
+                    continue
+                response.transaction_id = tid
+                response.slave_id = unit
+                future.set_result(response)
+        except (asyncio.IncompleteReadError, OSError) as e:
+            logger.warning("Connection to %s lost: %s", self, e)
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._fail_pending(ConnectionException(f"Connection to {self} lost"))
+
+    def _slave(self, slave: int) -> asyncio.Semaphore:
+        if (semaphore := self._slaves.get(slave)) is None:
+            semaphore = self._slaves[slave] = asyncio.Semaphore(self.slave_window)
+        return semaphore
+
+    async def execute(
+        self, no_response_expected: bool, request: ModbusPDU, timeout: float
+    ) -> Optional[ModbusPDU]:
+        """Send request once both its slave and the connection have room for it,
+        and wait up to timeout seconds for its response."""
+        # asyncio semaphores wake waiters in order, keeping each slave's order.
+        async with self._slave(request.slave_id), self._slots:
+            if not self.connected and not await self.connect():
+                raise ConnectionException(f"Not connected to {self}")
+            assert self._writer is not None
+            tid = next(self._tids) & 0xFFFF
+            request.transaction_id = tid
+            pdu = bytes([request.function_code]) + request.encode()
+            self._writer.write(MBAP.pack(tid, 0, len(pdu) + 1, request.slave_id) + pdu)
+            if no_response_expected:
+                return None
+            future = asyncio.get_running_loop().create_future()
+            self.pending[tid] = future
+            try:
+                return await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                raise ModbusIOException(
+                    f"No response from slave {request.slave_id} in {timeout} s"
+                )
+            finally:
+                self.pending.pop(tid, None)
+
+    def __str__(self) -> str:
+        return f"{self.host}:{self.port}"
+
+
+# (host, port) -> connection
+Pool = dict[tuple[str, int], PipelinedConnection]
+
+# The pool of each event loop.
+_pools: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Pool] = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def pooled_connection(
+    host: str, port: int, window: int = DEFAULT_WINDOW, slave_window: int = 1
+) -> PipelinedConnection:
+    """The connection to host:port of the running event loop, made on first use."""
+    pool = _pools.setdefault(asyncio.get_running_loop(), {})
+    if (connection := pool.get((host, port))) is None:
+        connection = pool[(host, port)] = PipelinedConnection(
+            host, port, window, slave_window
+        )
+    return connection
+
+
+class PipelinedTcpClient:
+    """An asyncio client for Bus on a pooled pipelined connection.
+
+    Like pymodbus clients, it has connect(), close() and execute(), retries and a
+    response timeout."""
+
+    connection: PipelinedConnection
+    timeout: float
+    retries: int
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        window: int = DEFAULT_WINDOW,
+        slave_window: int = 1,
+        timeout: float = DEFAULT_TIMEOUT,
+    ) -> None:
+        self.connection = pooled_connection(host, port, window, slave_window)
+        self.timeout = timeout
+        self.retries = 0
+        self._open = False
+
+    @property
+    def window(self) -> int:
+        return self.connection.window
+
+    async def connect(self) -> bool:
+        if not self._open:
+            self._open = True
+            self.connection.users += 1
+        return await self.connection.connect(self.timeout)
+
+    def close(self) -> None:
+        """Stop using the connection, closing it when no client uses it."""
+        if self._open:
+            self._open = False
+            self.connection.users -= 1
+            if self.connection.users == 0:
+                self.connection.close()
+
+    async def execute(
+        self, no_response_expected: bool, request: ModbusPDU
+    ) -> Optional[ModbusPDU]:
+        # Read the timeout before the first await: Bus sets it just before calling.
+        timeout = self.timeout
+        attempt = 0
+        while True:
+            try:
+                return await self.connection.execute(
+                    no_response_expected, request, timeout
+                )
+            except ModbusIOException:
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+
+    def __str__(self) -> str:
+        return f"PipelinedTcpClient({self.connection})"
@@ -0,0 +1,218 @@
+"""Plan reads of a register map as a few contiguous block reads.
+
+A register map is a dict of name -> address (one register) or name -> (address, count),
+as in TaidacentRegisters and SchneiderRegisters. plan_reads() sorts the map by address
+and merges neighbors into blocks that can each be fetched with one
+read_holding_registers() call. read_planned() (or read_planned_async() for asyncio
+clients) performs the reads and splits the results back out by name.
+"""
+
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Iterable
+from typing import Mapping
+from typing import TYPE_CHECKING
+from typing import Awaitable
+from typing import Sequence
+
+if TYPE_CHECKING:
+    # pymodbus is only needed at runtime once a read fails; importing it here
+    # would slow down every mbe command that only needs the register maps.
+    from pymodbus.client.mixin import ModbusClientMixin
+    from pymodbus.pdu import ModbusPDU
+
+    from mbe.client_wrapper import SyncClient
+
+    AsyncClient = ModbusClientMixin[Awaitable[ModbusPDU]]
+
+# Modbus limit for a single read holding registers request.
+MAX_READ_COUNT = 125
+
+# Largest run of unrequested registers that will be read to join two blocks. Each
+# extra register costs 2 bytes on the wire, much less than a transaction costs.
+DEFAULT_MAX_GAP = 16
+
+RegisterMap = Mapping[str, int | tuple[int, int]]
+PoisonRanges = Iterable[tuple[int, int]]
+
+
+@dataclass(frozen=True)
+class RegisterSpec:
+    name: str
+    address: int
+    count: int = 1
+
+    @property
+    def end(self) -> int:
+        return self.address + self.count
+
+
+@dataclass
+class ReadBlock:
+    """A contiguous range of registers read with one request."""
+
+    address: int
+    count: int
+    registers: list[RegisterSpec] = field(default_factory=list)
+
+    @property
+    def end(self) -> int:
+        return self.address + self.count
+
+    def split(self, words: Sequence[int]) -> dict[str, list[int]]:
+        """Split the words read for this block back out by register name."""
+        if len(words) < self.count:
+            raise ValueError(
+                f"Read of 0x{self.address:04X} returned {len(words)} registers, expected {self.count}"
+            )
+        return {
+            spec.name: list(
+                words[spec.address - self.address : spec.end - self.address]
+            )
+            for spec in self.registers
+        }
+
+
+def register_specs(registers: RegisterMap) -> list[RegisterSpec]:
+    """Convert a register map into RegisterSpecs, sorted by address."""
+    specs = []
+    for name, entry in registers.items():
+        if isinstance(entry, tuple):
+            address, count = entry
+        else:
+            address, count = entry, 1
+        specs.append(RegisterSpec(name, address, count))
+    return sorted(specs, key=lambda spec: (spec.address, spec.count))
+
+
+def _overlaps_poison(start: int, end: int, poison: list[tuple[int, int]]) -> bool:
+    return any(start < p_addr + p_count and p_addr < end for p_addr, p_count in poison)
+
+
+def plan_reads(
+    registers: RegisterMap,
+    max_gap: int = DEFAULT_MAX_GAP,
+    max_count: int = MAX_READ_COUNT,
+    poison: PoisonRanges = (),
+) -> list[ReadBlock]:
+    """Merge a register map into the fewest block reads.
+
+    Neighboring registers are merged if no more than max_gap unrequested registers
+    separate them, the resulting block is no longer than max_count and the block
+    would not cover any of the poison ranges, given as (address, count). Registers
+    that themselves overlap a poison range are read on their own.
+    """
+    poison = list(poison)
+    blocks: list[ReadBlock] = []
+    for spec in register_specs(registers):
+        if spec.count > max_count:
+            raise ValueError(
+                f"Register {spec.name} count {spec.count} exceeds max_count {max_count}"
+            )
+        if blocks:
+            block = blocks[-1]
+            new_end = max(block.end, spec.end)
+            if (
+                spec.address - block.end <= max_gap
+                and new_end - block.address <= max_count
+                and not _overlaps_poison(block.address, new_end, poison)
+            ):
+                block.count = new_end - block.address
+                block.registers.append(spec)
+                continue
+        blocks.append(ReadBlock(spec.address, spec.count, [spec]))
+    return blocks
+
+
+def _block_results(
+    block: ReadBlock, resp: "ModbusPDU | Exception"
+) -> dict[str, list[int] | Exception]:
+    if isinstance(resp, Exception):
+        return {spec.name: resp for spec in block.registers}
+    from pymodbus.exceptions import ModbusException
+
+    if resp.isError():
+        error = ModbusException(str(resp))
+        return {spec.name: error for spec in block.registers}
+    try:
+        return dict(block.split(resp.registers))
+    except ValueError as e:
+        # A short response fails the registers of the block like an error one.
+        error = ModbusException(str(e))
+        return {spec.name: error for spec in block.registers}
+
+
+def _needs_fallback(
+    block: ReadBlock, block_results: dict[str, list[int] | Exception]
+) -> bool:
+    return len(block.registers) > 1 and any(
+        isinstance(v, Exception) for v in block_results.values()
+    )
+
+
+def _single_blocks(block: ReadBlock) -> list[ReadBlock]:
+    return [ReadBlock(spec.address, spec.count, [spec]) for spec in block.registers]
+
+
+def _read_block(
+    client: "SyncClient", device: int, block: ReadBlock
+) -> dict[str, list[int] | Exception]:
+    from pymodbus.exceptions import ModbusException
+
+    # A raised error, e.g. resilience.CircuitOpen once the device stopped
+    # answering, fails the registers of the block like a returned one.
+    resp: "ModbusPDU | Exception"
+    try:
+        resp = client.read_holding_registers(
+            address=block.address, slave=device, count=block.count
+        )
+    except ModbusException as e:
+        resp = e
+    return _block_results(block, resp)
+
+
+def read_planned(
+    client: "SyncClient", device: int, plan: list[ReadBlock]
+) -> dict[str, list[int] | Exception]:
+    """Read each block of a plan and return the registers read, by name.
+
+    If a merged block fails, its registers are re-read individually, so that one
+    unreadable register only costs its own result.
+    """
+    results: dict[str, list[int] | Exception] = {}
+    for block in plan:
+        block_results = _read_block(client, device, block)
+        if _needs_fallback(block, block_results):
+            for single in _single_blocks(block):
+                block_results.update(_read_block(client, device, single))
+        results.update(block_results)
+    return results
+
+
+async def _read_block_async(
+    client: "AsyncClient", device: int, block: ReadBlock
+) -> dict[str, list[int] | Exception]:
+    from pymodbus.exceptions import ModbusException
+
+    resp: "ModbusPDU | Exception"
+    try:
+        resp = await client.read_holding_registers(
+            address=block.address, slave=device, count=block.count
+        )
+    except ModbusException as e:
+        resp = e
+    return _block_results(block, resp)
+
+
+async def read_planned_async(
+    client: "AsyncClient", device: int, plan: list[ReadBlock]
+) -> dict[str, list[int] | Exception]:
+    """Async version of read_planned(), for asyncio clients."""
+    results: dict[str, list[int] | Exception] = {}
+    for block in plan:
+        block_results = await _read_block_async(client, device, block)
+        if _needs_fallback(block, block_results):
+            for single in _single_blocks(block):
+                block_results.update(await _read_block_async(client, device, single))
+        results.update(block_results)
+    return results
@@ -0,0 +1,125 @@
+"""DevicePollers for the devices supported by mbe."""
+
+from typing import Optional
+
+from pymodbus.exceptions import ModbusException
+
+from mbe.cli_config import DeviceConfig
+from mbe.cli_config import DeviceTypes
+from mbe.decode import decode_value
+from mbe.engine import Bus
+from mbe.engine import DevicePoller
+from mbe.engine import Reading
+from mbe.planner import plan_reads
+from mbe.planner import read_planned_async
+from mbe.schneider import SCHNEIDER_MAX_GAP
+from mbe.schneider import SchneiderEncodings
+from mbe.schneider import SchneiderMeasurements
+from mbe.schneider import SchneiderPoisonRanges
+from mbe.schneider import SchneiderRegisters
+from mbe.taidecent import TaidacentRegisters
+from mbe.taidecent import TaidecentEncodings
+from mbe.waveshare_relays import WAVESHARE_READ_ALL_RELAYS_ADDRESS
+from mbe.waveshare_relays import WAVESHARE_READ_WRITE_ALL_RELAYS_COUNT
+
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+class TaidecentPoller(DevicePoller):
+    """Reads temperature (°C) and humidity (%)."""
+
+    plan = plan_reads(
+        {name: TaidacentRegisters[name] for name in ("Temperature", "Humidity")}
+    )
+
+    def __init__(
+        self,
+        device: int,
+        interval: float = DEFAULT_POLL_INTERVAL,
+        name: str = "taidecent",
+    ) -> None:
+        super().__init__(name, device, interval)
+
+    async def poll(self, bus: Bus) -> list[Reading]:
+        results = await read_planned_async(bus, self.device, self.plan)
+        readings = []
+        for name, result in results.items():
+            if isinstance(result, Exception):
+                raise result
+            readings.append(
+                self.reading(name, decode_value(TaidecentEncodings[name], result))
+            )
+        return readings
+
+
+class WaveshareRelaysPoller(DevicePoller):
+    """Reads the state of all relays as a bitmask, relay 0 in bit 0."""
+
+    def __init__(
+        self,
+        device: int,
+        interval: float = DEFAULT_POLL_INTERVAL,
+        name: str = "waveshare_relays",
+    ) -> None:
+        super().__init__(name, device, interval)
+
+    async def poll(self, bus: Bus) -> list[Reading]:
+        resp = await bus.read_coils(
+            address=WAVESHARE_READ_ALL_RELAYS_ADDRESS,
+            count=WAVESHARE_READ_WRITE_ALL_RELAYS_COUNT,
+            slave=self.device,
+        )
+        if resp.isError():
+            raise ModbusException(str(resp))
+        states = 0
+        for bit_idx, bit in enumerate(
+            resp.bits[:WAVESHARE_READ_WRITE_ALL_RELAYS_COUNT]
+        ):
+            if bit:
+                states |= 1 << bit_idx
+        return [self.reading("Relays", states)]
+
+
+class SchneiderPoller(DevicePoller):
+    """Reads current (A), voltage (V) and frequency (Hz)."""
+
+    plan = plan_reads(
+        {name: SchneiderRegisters[name] for name in SchneiderMeasurements},
+        max_gap=SCHNEIDER_MAX_GAP,
+        poison=SchneiderPoisonRanges,
+    )
+
+    def __init__(
+        self,
+        device: int,
+        interval: float = DEFAULT_POLL_INTERVAL,
+        name: str = "schneider",
+    ) -> None:
+        super().__init__(name, device, interval)
+
+    async def poll(self, bus: Bus) -> list[Reading]:
+        results = await read_planned_async(bus, self.device, self.plan)
+        readings = []
+        for name, result in results.items():
+            if isinstance(result, Exception):
+                raise result
+            readings.append(
+                self.reading(name, decode_value(SchneiderEncodings[name], result))
+            )
+        return readings
+
+
+Pollers: dict[DeviceTypes, type[DevicePoller]] = {
+    DeviceTypes.taidecent: TaidecentPoller,
+    DeviceTypes.waveshare_relays: WaveshareRelaysPoller,
+    DeviceTypes.schneider: SchneiderPoller,
+}
+
+
+def make_poller(device: DeviceConfig, interval: Optional[float] = None) -> DevicePoller:
+    """Poller for a configured device. interval, if given, overrides the device's."""
+    if interval is None:
+        interval = device.interval or DEFAULT_POLL_INTERVAL
+    poller = Pollers[device.type](device.id, interval)  # type: ignore[call-arg]
+    poller.name = device.label
+    return poller
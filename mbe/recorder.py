@@ -0,0 +1,158 @@
+"""Fixed-memory time series of polled readings.
+
+Each point (device, point name) gets a RingBuffer of timestamps and values in two
+preallocated array.array("d"). Once a buffer is full the oldest samples are
+overwritten, so memory use depends only on the number of points and the capacity,
+however long the recorder runs.
+"""
+
+import math
+from array import array
+from dataclasses import dataclass
+from typing import Iterator
+from typing import Optional
+
+from mbe.engine import Reading
+
+# One day of samples at the default 2 second poll interval, about 0.69 MB per point
+# (two arrays of 8 byte doubles).
+DEFAULT_CAPACITY = 43200
+
+
+@dataclass
+class Bucket:
+    """Summary of the samples in [start, start + step)."""
+
+    start: float
+    count: int
+    min: float
+    max: float
+    mean: float
+
+
+class RingBuffer:
+    """The last capacity (timestamp, value) samples of one point, oldest first."""
+
+    capacity: int
+    timestamps: array
+    values: array
+    head: int
+    size: int
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        if capacity <= 0:
+            raise ValueError(f"capacity must be positive, got {capacity}")
+        self.capacity = capacity
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.values = array("d", bytes(8 * capacity))
+        self.head = 0  # index of the oldest sample
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _slot(self, i: int) -> int:
+        return (self.head + i) % self.capacity
+
+    def append(self, timestamp: float, value: float) -> None:
+        if self.size < self.capacity:
+            slot = self._slot(self.size)
+            self.size += 1
+        else:
+            slot = self.head
+            self.head = (self.head + 1) % self.capacity
+        self.timestamps[slot] = timestamp
+        self.values[slot] = value
+
+    def last(self) -> Optional[tuple[float, float]]:
+        if not self.size:
+            return None
+        slot = self._slot(self.size - 1)
+        return self.timestamps[slot], self.values[slot]
+
+    def _bisect(self, timestamp: float) -> int:
+        """Index of the first sample at or after timestamp."""
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamps[self._slot(mid)] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def samples(
+        self, start: Optional[float] = None, end: Optional[float] = None
+    ) -> Iterator[tuple[float, float]]:
+        """Yield (timestamp, value) for samples in [start, end), oldest first."""
+        first = 0 if start is None else self._bisect(start)
+        last = self.size if end is None else self._bisect(end)
+        for i in range(first, last):
+            slot = self._slot(i)
+            yield self.timestamps[slot], self.values[slot]
+
+    def downsample(
+        self, start: float, end: float, step: Optional[float] = None
+    ) -> list[Bucket]:
+        """Min, max and mean of [start, end) in buckets of step seconds.
+
+        With no step the whole window is one bucket. Empty buckets are omitted.
+        """
+        if step is None:
+            step = end - start
+        if step <= 0:
+            raise ValueError(f"step must be positive, got {step}")
+        buckets: list[Bucket] = []
+        bucket_idx = -1
+        total = 0.0
+        for timestamp, value in self.samples(start, end):
+            idx = math.floor((timestamp - start) / step)
+            if idx != bucket_idx:
+                if buckets:
+                    buckets[-1].mean = total / buckets[-1].count
+                buckets.append(Bucket(start + idx * step, 0, value, value, 0.0))
+                bucket_idx = idx
+                total = 0.0
+            bucket = buckets[-1]
+            bucket.count += 1
+            bucket.min = min(bucket.min, value)
+            bucket.max = max(bucket.max, value)
+            total += value
+        if buckets:
+            buckets[-1].mean = total / buckets[-1].count
+        return buckets
+
+
+class Recorder:
+    """Engine sink that records numeric readings into one RingBuffer per point."""
+
+    capacity: int
+    series: dict[tuple[str, str], RingBuffer]
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        self.capacity = capacity
+        self.series = {}
+
+    def record(self, reading: Reading) -> None:
+        if isinstance(reading.value, str):
+            return
+        key = (reading.device, reading.point)
+        if (series := self.series.get(key)) is None:
+            series = self.series[key] = RingBuffer(self.capacity)
+        series.append(reading.timestamp, reading.value)
+
+    def points(self) -> list[tuple[str, str]]:
+        return sorted(self.series)
+
+    def downsample(
+        self,
+        device: str,
+        point: str,
+        start: float,
+        end: float,
+        step: Optional[float] = None,
+    ) -> list[Bucket]:
+        series = self.series.get((device, point))
+        if series is None:
+            return []
+        return series.downsample(start, end, step)
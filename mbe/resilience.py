@@ -0,0 +1,266 @@
+"""Adaptive timeouts, retries and circuit breaking per device.
+
+A fixed response timeout is either far too long for a device that answers in 20 ms
+or too short for a slow one, and a device that has gone offline costs every poll a
+full timeout. Resilience keeps, for each slave of a bus:
+
+    * Smoothed response time and its variation (srtt, rttvar), as TCP does
+      (RFC 6298). The timeout of a transaction is srtt + 4 * rttvar, kept between
+      min_timeout and max_timeout, and doubles after each transaction without
+      response until one is answered. Retried transactions are not sampled, since
+      a late answer may be to the earlier attempt.
+    * A circuit breaker. After `failures` transactions in a row without response,
+      the slave is skipped for `cooldown` seconds: its transactions fail at once
+      with CircuitOpen without touching the bus. Then one probe transaction is let
+      through. If it is answered the breaker closes, otherwise it opens again for
+      twice as long, up to max_cooldown.
+
+Transactions without response are retried up to `retries` times, after a random
+delay of up to backoff * 2**attempt seconds (at most max_backoff), so retries of
+several devices do not line up. Exception responses are answers and are neither
+retried nor counted as failures, except a gateway's report that the device did not
+respond.
+
+Bus (asyncio) and ResilientClient (sync) apply a Resilience to their transactions.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+from typing import Callable
+from typing import Optional
+
+from pymodbus.client import ModbusSerialClient
+from pymodbus.client.base import ModbusBaseClient
+from pymodbus.client.base import ModbusBaseSyncClient
+from pymodbus.exceptions import ModbusIOException
+from pymodbus.pdu import ExceptionResponse
+from pymodbus.pdu import ModbusPDU
+
+from mbe.cli_config import ResilienceConfig
+from mbe.client_wrapper import ClientWrapper
+from mbe.client_wrapper import SyncClient
+from mbe.pipeline import PipelinedTcpClient
+from mbe.rtu_tcp import RtuOverTcpClient
+from mbe.rtu_tcp import RtuOverTcpSyncClient
+
+if TYPE_CHECKING:
+    from mbe.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpen(ModbusIOException):
+    """A transaction refused because its slave has stopped answering."""
+
+
+# Exception code of a gateway whose target device did not respond.
+GATEWAY_NO_RESPONSE = 0x0B
+
+
+def no_response(response: object) -> bool:
+    """Whether response, or the exception raised instead, means the slave did not
+    answer. pymodbus asyncio clients return an ExceptionResponse without exception
+    code when a request times out."""
+    if isinstance(response, (ModbusIOException, asyncio.TimeoutError, TimeoutError)):
+        return True
+    return isinstance(response, ExceptionResponse) and response.exception_code in (
+        0,
+        GATEWAY_NO_RESPONSE,
+    )
+
+
+@dataclass
+class SlaveState:
+    srtt: Optional[float] = None
+    rttvar: float = 0.0
+    timeout: float = 0.0
+    state: str = CLOSED
+    failures: int = 0
+    cooldown: float = 0.0
+    # clock() when an open breaker lets the next probe through
+    retry_at: float = 0.0
+
+
+class Resilience:
+    """Timeouts, retry delays and circuit breakers for the slaves of one bus."""
+
+    config: ResilienceConfig
+    slaves: dict[int, SlaveState]
+
+    def __init__(
+        self,
+        config: Optional[ResilienceConfig] = None,
+        name: str = "",
+        clock: Callable[[], float] = time.monotonic,
+        rng: Optional[random.Random] = None,
+    ) -> None:
+        self.config = ResilienceConfig() if config is None else config
+        self.name = name
+        self.clock = clock
+        self.rng = random.Random() if rng is None else rng
+        self.slaves = {}
+
+    def _slave(self, slave: int) -> SlaveState:
+        if (state := self.slaves.get(slave)) is None:
+            state = self.slaves[slave] = SlaveState(
+                timeout=self.config.timeout, cooldown=self.config.cooldown
+            )
+        return state
+
+    def timeout(self, slave: int) -> float:
+        """Seconds to wait for the response of slave."""
+        return self._slave(slave).timeout
+
+    def admit(self, slave: int) -> None:
+        """Raise CircuitOpen unless a transaction with slave may go on the bus."""
+        state = self._slave(slave)
+        if state.state == CLOSED:
+            return
+        if state.state == OPEN and self.clock() >= state.retry_at:
+            state.state = HALF_OPEN
+            return
+        raise CircuitOpen(f"Slave {slave} on {self.name} is not answering")
+
+    def answered(self, slave: int, rtt: float, sample: bool = True) -> None:
+        """Record an answer from slave, rtt seconds after the request. Only
+        transactions that were not retried are sampled."""
+        c = self.config
+        state = self._slave(slave)
+        if sample:
+            if state.srtt is None:
+                state.srtt, state.rttvar = rtt, rtt / 2
+            else:
+                state.rttvar = 0.75 * state.rttvar + 0.25 * abs(state.srtt - rtt)
+                state.srtt = 0.875 * state.srtt + 0.125 * rtt
+        if state.srtt is not None:
+            state.timeout = min(
+                c.max_timeout, max(c.min_timeout, state.srtt + 4 * state.rttvar)
+            )
+        if state.state != CLOSED:
+            logger.info("Slave %s on %s is answering again", slave, self.name)
+        state.state = CLOSED
+        state.failures = 0
+        state.cooldown = c.cooldown
+
+    def skipped(self, slave: int) -> None:
+        """Record that a transaction admitted for slave did not go on the bus after
+        all, so that a half-open breaker lets the next one through instead."""
+        state = self._slave(slave)
+        if state.state == HALF_OPEN:
+            state.state = OPEN
+
+    def failed(self, slave: int) -> None:
+        """Record a transaction with slave without response."""
+        c = self.config
+        state = self._slave(slave)
+        state.timeout = min(c.max_timeout, 2 * state.timeout)
+        state.failures += 1
+        if state.state == HALF_OPEN:
+            state.cooldown = min(c.max_cooldown, 2 * state.cooldown)
+        elif state.state == OPEN or state.failures < c.failures:
+            return
+        else:
+            logger.warning(
+                "Slave %s on %s is not answering, skipping it for %.0f s",
+                slave,
+                self.name,
+                state.cooldown,
+            )
+        state.state = OPEN
+        state.retry_at = self.clock() + state.cooldown
+
+    def retry_delay(self, slave: int, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying a transaction with slave that has failed
+        attempt + 1 times, or None if it is not to be retried."""
+        c = self.config
+        if attempt >= c.retries or self._slave(slave).state != CLOSED:
+            return None
+        return self.rng.uniform(0, min(c.max_backoff, c.backoff * 2**attempt))
+
+
+# Clients whose timeout ResilientClient sets.
+RawClient = ModbusBaseSyncClient | RtuOverTcpSyncClient
+
+
+def set_timeout(
+    client: ModbusBaseClient | RawClient | PipelinedTcpClient | RtuOverTcpClient,
+    timeout: float,
+) -> None:
+    """Make the response timeout of a client timeout seconds."""
+    if isinstance(client, (PipelinedTcpClient, RtuOverTcpClient, RtuOverTcpSyncClient)):
+        client.timeout = timeout
+        return
+    if isinstance(client, ModbusBaseClient):
+        # asyncio clients wait using a copy of their comm_params.
+        client.ctx.comm_params.timeout_connect = timeout
+        return
+    client.comm_params.timeout_connect = timeout
+    if isinstance(client, ModbusSerialClient) and client.socket is not None:
+        client.socket.timeout = timeout
+
+
+class ResilientClient(ClientWrapper):
+    """Applies resilience to the transactions of a sync client, recording retries
+    in metrics if given.
+
+    Timeouts are set on raw, the pymodbus client at the bottom of client."""
+
+    resilience: Resilience
+    raw: RawClient
+    metrics: Optional["Metrics"]
+
+    def __init__(
+        self,
+        client: SyncClient,
+        raw: RawClient,
+        resilience: Resilience,
+        metrics: Optional["Metrics"] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        super().__init__(client)
+        self.raw = raw
+        self.resilience = resilience
+        self.metrics = metrics
+        self.sleep = sleep
+        raw.retries = 0
+
+    def execute(self, no_response_expected: bool, request: ModbusPDU) -> ModbusPDU:
+        slave = request.slave_id
+        attempt = 0
+        while True:
+            self.resilience.admit(slave)
+            set_timeout(self.raw, self.resilience.timeout(slave))
+            start = time.monotonic()
+            error: Optional[Exception] = None
+            response: object = None
+            try:
+                response = self.client.execute(no_response_expected, request)
+            except Exception as e:
+                error = e
+            outcome = response if error is None else error
+            if no_response_expected or not no_response(outcome):
+                if error is None:
+                    self.resilience.answered(
+                        slave,
+                        time.monotonic() - start,
+                        sample=attempt == 0 and not no_response_expected,
+                    )
+                break
+            self.resilience.failed(slave)
+            if (delay := self.resilience.retry_delay(slave, attempt)) is None:
+                break
+            if self.metrics is not None:
+                self.metrics.retry(self.resilience.name, slave, request.function_code)
+            self.sleep(delay)
+            attempt += 1
+        if error is not None:
+            raise error
+        return response  # type: ignore[return-value]
@@ -0,0 +1,265 @@
+"""Modbus RTU frame codec: CRC16, frame lengths and field decoding.
+
+An RTU frame is slave id, function code, data and a little-endian CRC16. Frames
+carry no length field; their length follows from the function code, whether the
+frame is a request or a response, and for some frames a byte count in the data.
+
+FrameBuffer builds requests and parses responses of a master in two preallocated
+buffers, for transports that carry RTU frames (serial ports and RTU over TCP), so
+the frames of a transaction are never copied or allocated.
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+
+def _make_crc_table() -> list[int]:
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+        table.append(crc)
+    return table
+
+
+CRC_TABLE = _make_crc_table()
+
+
+def crc16(data: bytes | bytearray | memoryview) -> int:
+    """Modbus CRC16 of data."""
+    crc = 0xFFFF
+    table = CRC_TABLE
+    for b in data:
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+    return crc
+
+
+def crc_ok(frame: bytes | bytearray | memoryview) -> bool:
+    """True if the last two bytes of frame are the CRC of the rest."""
+    if len(frame) < 4:
+        return False
+    return crc16(frame[:-2]) == frame[-2] | (frame[-1] << 8)
+
+
+MIN_FRAME_LEN = 4
+MAX_FRAME_LEN = 256
+
+EXCEPTION_BIT = 0x80
+
+ExceptionCodes = {
+    1: "ILLEGAL FUNCTION",
+    2: "ILLEGAL DATA ADDRESS",
+    3: "ILLEGAL DATA VALUE",
+    4: "SERVER DEVICE FAILURE",
+    5: "ACKNOWLEDGE",
+    6: "SERVER DEVICE BUSY",
+    8: "MEMORY PARITY ERROR",
+    10: "GATEWAY PATH UNAVAILABLE",
+    11: "GATEWAY TARGET DEVICE FAILED TO RESPOND",
+}
+
+READ_FUNCTIONS = (0x01, 0x02, 0x03, 0x04)
+WRITE_SINGLE_FUNCTIONS = (0x05, 0x06)
+WRITE_MULTIPLE_FUNCTIONS = (0x0F, 0x10)
+READ_WRITE_REGISTERS = 0x17
+
+
+def candidate_lengths(buf: bytes | bytearray | memoryview, start: int = 0):
+    """Possible (length, is_request) of a frame beginning at buf[start].
+
+    Lengths that depend on a byte count not yet in buf are omitted.
+    """
+    n = len(buf) - start
+    if n < 2:
+        return []
+    fc = buf[start + 1]
+    if fc & EXCEPTION_BIT:
+        return [(5, False)]
+    candidates = []
+    if fc in READ_FUNCTIONS:
+        candidates.append((8, True))
+        if n >= 3:
+            candidates.append((5 + buf[start + 2], False))
+    elif fc in WRITE_SINGLE_FUNCTIONS:
+        candidates.append((8, True))
+        candidates.append((8, False))
+    elif fc in WRITE_MULTIPLE_FUNCTIONS:
+        if n >= 7:
+            candidates.append((9 + buf[start + 6], True))
+        candidates.append((8, False))
+    elif fc == READ_WRITE_REGISTERS:
+        if n >= 11:
+            candidates.append((13 + buf[start + 10], True))
+        if n >= 3:
+            candidates.append((5 + buf[start + 2], False))
+    return candidates
+
+
+@dataclass
+class Frame:
+    """A decoded RTU frame. Fields that do not apply to the frame are None."""
+
+    timestamp: float
+    data: bytes
+    crc_ok: bool
+    is_request: Optional[bool] = None
+    address: Optional[int] = None
+    count: Optional[int] = None
+    values: Optional[list[int]] = None
+    exception_code: Optional[int] = None
+
+    @property
+    def slave(self) -> int:
+        return self.data[0] if self.data else -1
+
+    @property
+    def function(self) -> int:
+        return self.data[1] if len(self.data) > 1 else -1
+
+    @property
+    def is_exception(self) -> bool:
+        return self.exception_code is not None
+
+
+def _words(data: bytes) -> list[int]:
+    return [(data[i] << 8) | data[i + 1] for i in range(0, len(data) - 1, 2)]
+
+
+def decode_frame(
+    data: bytes, timestamp: float, is_request: Optional[bool] = None
+) -> Frame:
+    """Decode the fields of a frame.
+
+    If is_request is None it is inferred from the frame length where possible.
+    """
+    frame = Frame(timestamp, data, crc_ok(data), is_request)
+    if not frame.crc_ok or len(data) < 5:
+        return frame
+    fc = data[1]
+    if fc & EXCEPTION_BIT:
+        frame.is_request = False
+        frame.exception_code = data[2]
+        return frame
+    if frame.is_request is None:
+        matches = [r for length, r in candidate_lengths(data) if length == len(data)]
+        if len(matches) == 1:
+            frame.is_request = matches[0]
+    if frame.is_request is None:
+        return frame
+    if fc in READ_FUNCTIONS:
+        if frame.is_request:
+            frame.address = (data[2] << 8) | data[3]
+            frame.count = (data[4] << 8) | data[5]
+        elif fc in (0x03, 0x04):
+            frame.values = _words(data[3:-2])
+            frame.count = len(frame.values)
+        else:
+            bits: list[int] = []
+            for byte in data[3:-2]:
+                bits.extend((byte >> i) & 1 for i in range(8))
+            frame.values = bits
+    elif fc in WRITE_SINGLE_FUNCTIONS:
+        frame.address = (data[2] << 8) | data[3]
+        frame.values = [(data[4] << 8) | data[5]]
+    elif fc in WRITE_MULTIPLE_FUNCTIONS:
+        frame.address = (data[2] << 8) | data[3]
+        frame.count = (data[4] << 8) | data[5]
+        if frame.is_request and fc == 0x10:
+            frame.values = _words(data[7:-2])
+    elif fc == READ_WRITE_REGISTERS:
+        if frame.is_request:
+            frame.address = (data[2] << 8) | data[3]
+            frame.count = (data[4] << 8) | data[5]
+        else:
+            frame.values = _words(data[3:-2])
+    return frame
+
+
+class FrameBuffer:
+    """Preallocated transmit and receive buffers of one RTU master.
+
+    encode() builds a request in the transmit buffer. Received bytes are written
+    into space(), then counted with received(n), until response() finds the
+    response to the request. All results are views into the buffers, valid until
+    the next encode().
+    """
+
+    tx: bytearray
+    rx: bytearray
+    # Bytes in rx.
+    length: int
+
+    def __init__(self) -> None:
+        self.tx = bytearray(MAX_FRAME_LEN)
+        self.rx = bytearray(MAX_FRAME_LEN)
+        self._tx = memoryview(self.tx)
+        self._rx = memoryview(self.rx)
+        self.length = 0
+        self.slave = 0
+        self.function = 0
+
+    def encode(
+        self, slave: int, function: int, data: bytes | bytearray | memoryview
+    ) -> memoryview:
+        """The request frame with data to slave, emptying the receive buffer."""
+        end = 2 + len(data)
+        if end + 2 > MAX_FRAME_LEN:
+            raise ValueError(f"RTU frame of {end + 2} bytes is too long")
+        tx = self.tx
+        tx[0] = slave
+        tx[1] = function
+        tx[2:end] = data
+        crc = crc16(self._tx[:end])
+        tx[end] = crc & 0xFF
+        tx[end + 1] = crc >> 8
+        self.slave = slave
+        self.function = function
+        self.length = 0
+        return self._tx[: end + 2]
+
+    def space(self) -> memoryview:
+        """The free part of the receive buffer. A full buffer is emptied first:
+        it cannot hold a response any more."""
+        if self.length == MAX_FRAME_LEN:
+            self.length = 0
+        return self._rx[self.length :]
+
+    def received(self, n: int) -> None:
+        """Count n bytes written into space()."""
+        self.length += n
+
+    def _discard(self, n: int) -> None:
+        rx = self.rx
+        rx[: self.length - n] = self._rx[n : self.length]
+        self.length -= n
+
+    def response(self) -> Optional[memoryview]:
+        """The response frame to the request, once it has been received in full.
+
+        Bytes that cannot start it, such as the rest of an earlier response or
+        line noise, are discarded. Only responses of functions whose length
+        candidate_lengths() knows are recognized.
+        """
+        rx = self.rx
+        while self.length:
+            if rx[0] != self.slave or (
+                self.length > 1 and rx[1] & ~EXCEPTION_BIT != self.function
+            ):
+                self._discard(1)
+                continue
+            for length, is_request in candidate_lengths(self._rx[: self.length]):
+                if not is_request:
+                    break
+            else:
+                return None
+            if length > self.length:
+                return None
+            frame = self._rx[:length]
+            if crc_ok(frame):
+                return frame
+            self._discard(1)
+        return None
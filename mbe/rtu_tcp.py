@@ -0,0 +1,236 @@
+"""Modbus RTU frames over TCP, for serial gateways in transparent mode.
+
+Many cheap RS-485 gateways forward TCP bytes to the serial line unchanged instead
+of translating Modbus TCP, so the master speaks RTU, CRC and all, on the socket.
+Without MBAP headers a response is found by its length, as on a serial line, and
+nothing but the slave id, function code and CRC tells a late response from the
+one awaited, so only one transaction is on the connection at a time.
+
+Both clients build their requests and receive their responses in the preallocated
+buffers of an rtu.FrameBuffer, the codec of the serial scanner too: the asyncio
+client has the event loop read straight into the receive buffer (a
+BufferedProtocol), and the sync client uses recv_into(). pymodbus still allocates
+the request data and the decoded response.
+"""
+
+import asyncio
+import logging
+import socket
+import time
+from typing import Optional
+
+from pymodbus.exceptions import ConnectionException
+from pymodbus.exceptions import ModbusIOException
+from pymodbus.pdu import DecodePDU
+from pymodbus.pdu import ModbusPDU
+
+from mbe.client_wrapper import SyncClientBase
+from mbe.rtu import FrameBuffer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 3.0
+
+
+def _decode(decoder: DecodePDU, frame: memoryview) -> ModbusPDU:
+    response = decoder.decode(bytes(frame[1:-2]))
+    if response is None:
+        raise ModbusIOException(f"Unable to decode response from slave {frame[0]}")
+    response.slave_id = frame[0]
+    return response
+
+
+class _RtuProtocol(asyncio.BufferedProtocol):
+    """Receives into the FrameBuffer of a client, waking it when the response is
+    complete."""
+
+    def __init__(self, frames: FrameBuffer) -> None:
+        self.frames = frames
+        self.transport: Optional[asyncio.Transport] = None
+        self.waiter: Optional[asyncio.Future] = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        assert isinstance(transport, asyncio.Transport)
+        self.transport = transport
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.frames.space()
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self.frames.received(nbytes)
+        if self.waiter is not None and not self.waiter.done():
+            if (frame := self.frames.response()) is not None:
+                self.waiter.set_result(frame)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.transport = None
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_exception(ConnectionException(f"Connection lost: {exc}"))
+
+
+class RtuOverTcpClient:
+    """An asyncio client for Bus, speaking RTU to a transparent gateway.
+
+    Like pymodbus clients, it has connect(), close() and execute(), retries and a
+    response timeout."""
+
+    host: str
+    port: int
+    timeout: float
+    retries: int
+    window = 1
+
+    def __init__(self, host: str, port: int, timeout: float = DEFAULT_TIMEOUT) -> None:
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = 0
+        self.frames = FrameBuffer()
+        self.decoder = DecodePDU(False)
+        self._protocol = _RtuProtocol(self.frames)
+        self._lock = asyncio.Lock()
+
+    @property
+    def connected(self) -> bool:
+        transport = self._protocol.transport
+        return transport is not None and not transport.is_closing()
+
+    async def connect(self) -> bool:
+        if self.connected:
+            return True
+        try:
+            await asyncio.wait_for(
+                asyncio.get_running_loop().create_connection(
+                    lambda: self._protocol, self.host, self.port
+                ),
+                self.timeout,
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.warning("Connecting to %s failed: %s", self, e)
+            return False
+        return True
+
+    def close(self) -> None:
+        if self._protocol.transport is not None:
+            self._protocol.transport.close()
+
+    async def _transact(
+        self, no_response_expected: bool, request: ModbusPDU, timeout: float
+    ) -> Optional[ModbusPDU]:
+        if not self.connected and not await self.connect():
+            raise ConnectionException(f"Not connected to {self}")
+        protocol = self._protocol
+        assert protocol.transport is not None
+        waiter = protocol.waiter = asyncio.get_running_loop().create_future()
+        protocol.transport.write(
+            self.frames.encode(
+                request.slave_id, request.function_code, request.encode()
+            )
+        )
+        if no_response_expected:
+            return None
+        try:
+            frame = await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            raise ModbusIOException(
+                f"No response from slave {request.slave_id} in {timeout} s"
+            )
+        finally:
+            protocol.waiter = None
+        return _decode(self.decoder, frame)
+
+    async def execute(
+        self, no_response_expected: bool, request: ModbusPDU
+    ) -> Optional[ModbusPDU]:
+        # Read the timeout before the first await: Bus sets it just before calling.
+        timeout = self.timeout
+        attempt = 0
+        async with self._lock:
+            while True:
+                try:
+                    return await self._transact(no_response_expected, request, timeout)
+                except ModbusIOException:
+                    if attempt >= self.retries:
+                        raise
+                    attempt += 1
+
+    def __str__(self) -> str:
+        return f"RtuOverTcpClient({self.host}:{self.port})"
+
+
+class RtuOverTcpSyncClient(SyncClientBase):
+    """A sync client speaking RTU to a transparent gateway."""
+
+    host: str
+    port: int
+    timeout: float
+    retries: int
+    sock: Optional[socket.socket]
+
+    def __init__(
+        self, host: str, port: int, timeout: float = DEFAULT_TIMEOUT, retries: int = 3
+    ) -> None:
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.sock = None
+        self.frames = FrameBuffer()
+        self.decoder = DecodePDU(False)
+
+    def connect(self) -> bool:
+        if self.sock is not None:
+            return True
+        try:
+            self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        except OSError as e:
+            logger.warning("Connecting to %s failed: %s", self, e)
+            return False
+        return True
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _transact(self, no_response_expected: bool, request: ModbusPDU) -> ModbusPDU:
+        if not self.connect():
+            raise ConnectionException(f"Not connected to {self}")
+        assert self.sock is not None
+        frames = self.frames
+        try:
+            self.sock.sendall(
+                frames.encode(request.slave_id, request.function_code, request.encode())
+            )
+            if no_response_expected:
+                return None  # type: ignore[return-value]
+            deadline = time.monotonic() + self.timeout
+            while (frame := frames.response()) is None:
+                if (remaining := deadline - time.monotonic()) <= 0:
+                    raise socket.timeout()
+                self.sock.settimeout(remaining)
+                if not (n := self.sock.recv_into(frames.space())):
+                    raise ConnectionError("connection closed")
+                frames.received(n)
+        except socket.timeout:
+            raise ModbusIOException(
+                f"No response from slave {request.slave_id} in {self.timeout} s"
+            )
+        except OSError as e:
+            self.close()
+            raise ConnectionException(f"Connection to {self} lost: {e}")
+        return _decode(self.decoder, frame)
+
+    def execute(self, no_response_expected: bool, request: ModbusPDU) -> ModbusPDU:
+        attempt = 0
+        while True:
+            try:
+                return self._transact(no_response_expected, request)
+            except ModbusIOException:
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+
+    def __str__(self) -> str:
+        return f"RtuOverTcpSyncClient({self.host}:{self.port})"
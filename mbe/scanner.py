@@ -0,0 +1,389 @@
+"""Find the devices on a bus by sweeping slave ids.
+
+Each slave id is probed with a single register read. Most ids have no device, so
+the time a sweep takes is dominated by waiting for responses that never come. The
+scanner therefore talks to the port or gateway directly rather than through a
+pymodbus client, with a timeout that starts short and adapts to the response times
+actually seen on that bus. Every responder is then fingerprinted by reading the
+identifying registers of the device types mbe knows.
+
+Buses (serial ports, or TCP gateways speaking Modbus TCP or passing RTU frames
+through) are scanned in parallel, one thread each. The
+baud rates of one serial port are necessarily tried one after the other.
+"""
+
+import logging
+import socket
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Callable
+from typing import Iterable
+from typing import Optional
+from typing import Protocol
+
+from mbe.decode import Encoding
+from mbe.decode import decode_value
+from mbe.decode import string
+from mbe.decode import uint16
+from mbe.pacing import Pacer
+from mbe.pacing import char_time
+from mbe.rtu import EXCEPTION_BIT
+from mbe.rtu import FrameBuffer
+from mbe.schneider import SchneiderRegisters
+from mbe.taidecent import TaidacentRegisters
+from mbe.waveshare_relays import WaveShareRelayReadRegisters
+
+logger = logging.getLogger(__name__)
+
+MIN_SLAVE_ID = 1
+MAX_SLAVE_ID = 247
+
+MODBUS_TCP_PORT = 502
+
+# Timeout before any device has answered, covering slow devices and gateways.
+INITIAL_TIMEOUT = 0.1
+# Once devices answer, wait this many times the slowest response seen.
+TIMEOUT_FACTOR = 3.0
+MIN_TIMEOUT = 0.01
+MAX_TIMEOUT = 1.0
+
+READ_HOLDING_REGISTERS = 0x03
+# Exception codes with which a gateway answers for slaves that did not answer it:
+# gateway path unavailable and gateway target device failed to respond.
+GATEWAY_EXCEPTIONS = (0x0A, 0x0B)
+
+
+@dataclass
+class Fingerprint:
+    """A register that identifies a device type if it can be read."""
+
+    device: str
+    register: str
+    address: int
+    count: int
+    encoding: Encoding
+
+
+# The first is also the presence probe: any response to it, even an exception,
+# means a device has that slave id, except a gateway's report that no device
+# answered (GATEWAY_EXCEPTIONS).
+Fingerprints = [
+    Fingerprint("taidecent", "ModelCode", TaidacentRegisters["ModelCode"], 1, uint16()),
+    Fingerprint(
+        "waveshare_relays",
+        "SoftwareVersion",
+        WaveShareRelayReadRegisters["SoftwareVersion"],
+        1,
+        uint16(),
+    ),
+    Fingerprint(
+        "schneider",
+        "Name",
+        SchneiderRegisters["Name"][0],
+        SchneiderRegisters["Name"][1],
+        string(SchneiderRegisters["Name"][1]),
+    ),
+]
+
+
+@dataclass
+class Responder:
+    bus: str
+    slave: int
+    response_time: float
+    baud: Optional[int] = None
+    # device type -> value of its identifying register
+    fingerprints: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def device(self) -> Optional[str]:
+        return next(iter(self.fingerprints), None)
+
+
+class AdaptiveTimeout:
+    """Response timeout that shrinks to a multiple of the slowest response seen."""
+
+    floor: float
+    initial: float
+    slowest: Optional[float]
+
+    def __init__(self, floor: float = MIN_TIMEOUT, initial: float = INITIAL_TIMEOUT):
+        self.floor = floor
+        self.initial = initial
+        self.slowest = None
+
+    @property
+    def timeout(self) -> float:
+        if self.slowest is None:
+            return self.initial
+        return min(MAX_TIMEOUT, max(self.floor, TIMEOUT_FACTOR * self.slowest))
+
+    def observe(self, response_time: float) -> None:
+        if self.slowest is None or response_time > self.slowest:
+            self.slowest = response_time
+
+
+class Transport(Protocol):
+    name: str
+
+    def transact(self, slave: int, pdu: bytes, timeout: float) -> Optional[bytes]:
+        """Send a request PDU to slave. Returns the response PDU, or None if there
+        was no valid response within timeout."""
+        ...
+
+    def close(self) -> None: ...
+
+
+class SerialTransport:
+    """Modbus RTU on a serial port."""
+
+    def __init__(self, port: str, baud: int) -> None:
+        import serial
+
+        self.name = port
+        self.baud = baud
+        self.ser = serial.Serial(port, baudrate=baud, timeout=0)
+        self.pacer = Pacer(baud)
+        self.pacer.mark()
+        self.frames = FrameBuffer()
+
+    def frame_time(self, length: int) -> float:
+        return length * char_time(self.baud)
+
+    def transact(self, slave: int, pdu: bytes, timeout: float) -> Optional[bytes]:
+        frames = self.frames
+        self.pacer.wait(slave)
+        self.ser.reset_input_buffer()
+        self.ser.write(frames.encode(slave, pdu[0], memoryview(pdu)[1:]))
+        self.ser.flush()
+        deadline = time.monotonic() + timeout
+        try:
+            while (remaining := deadline - time.monotonic()) > 0:
+                self.ser.timeout = remaining
+                n = self.ser.readinto(frames.space()[: self.ser.in_waiting or 1])
+                if not n:
+                    break
+                frames.received(n)
+                if (frame := frames.response()) is not None:
+                    return bytes(frame[1:-2])
+            return None
+        finally:
+            self.pacer.mark()
+
+    def close(self) -> None:
+        self.ser.close()
+
+
+class TcpTransport:
+    """Modbus TCP to a gateway or device."""
+
+    MBAP = struct.Struct(">HHHB")
+
+    def __init__(self, host: str, port: int = MODBUS_TCP_PORT) -> None:
+        self.name = f"{host}:{port}"
+        self.sock = socket.create_connection((host, port), timeout=MAX_TIMEOUT)
+        self.transaction_id = 0
+
+    def _recv_exactly(self, n: int) -> bytes:
+        data = bytearray()
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError(f"{self.name} closed the connection")
+            data += chunk
+        return bytes(data)
+
+    def transact(self, slave: int, pdu: bytes, timeout: float) -> Optional[bytes]:
+        self.transaction_id = (self.transaction_id + 1) & 0xFFFF
+        self.sock.sendall(
+            self.MBAP.pack(self.transaction_id, 0, len(pdu) + 1, slave) + pdu
+        )
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            self.sock.settimeout(remaining)
+            try:
+                tid, _, length, unit = self.MBAP.unpack(
+                    self._recv_exactly(self.MBAP.size)
+                )
+                response = self._recv_exactly(length - 1)
+            except socket.timeout:
+                return None
+            # Late responses to earlier, timed out probes are skipped.
+            if tid == self.transaction_id and unit == slave:
+                return response
+        return None
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+class RtuTcpTransport:
+    """Modbus RTU frames to a gateway that passes them through to its serial bus."""
+
+    def __init__(self, host: str, port: int) -> None:
+        self.name = f"{host}:{port}"
+        self.sock = socket.create_connection((host, port), timeout=MAX_TIMEOUT)
+        self.frames = FrameBuffer()
+
+    def transact(self, slave: int, pdu: bytes, timeout: float) -> Optional[bytes]:
+        frames = self.frames
+        self.sock.sendall(frames.encode(slave, pdu[0], memoryview(pdu)[1:]))
+        deadline = time.monotonic() + timeout
+        # Late responses to earlier probes are from other slaves, and skipped.
+        while (frame := frames.response()) is None:
+            if (remaining := deadline - time.monotonic()) <= 0:
+                return None
+            self.sock.settimeout(remaining)
+            try:
+                n = self.sock.recv_into(frames.space())
+            except socket.timeout:
+                return None
+            if not n:
+                raise ConnectionError(f"{self.name} closed the connection")
+            frames.received(n)
+        return bytes(frame[1:-2])
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+def read_request(address: int, count: int) -> bytes:
+    return struct.pack(">BHH", READ_HOLDING_REGISTERS, address, count)
+
+
+def _registers(pdu: bytes) -> Optional[list[int]]:
+    if not pdu or pdu[0] & EXCEPTION_BIT or len(pdu) < 2:
+        return None
+    data = pdu[2 : 2 + pdu[1]]
+    return [int.from_bytes(data[i : i + 2], "big") for i in range(0, len(data) - 1, 2)]
+
+
+def _absent(pdu: bytes) -> bool:
+    """Whether pdu is a gateway's report that the slave did not answer it."""
+    return (
+        len(pdu) >= 2 and bool(pdu[0] & EXCEPTION_BIT) and pdu[1] in GATEWAY_EXCEPTIONS
+    )
+
+
+def fingerprint(
+    transport: Transport, slave: int, timeout: float, responder: Responder
+) -> None:
+    """Read each Fingerprint register of slave into responder.fingerprints."""
+    for fp in Fingerprints:
+        pdu = transport.transact(slave, read_request(fp.address, fp.count), timeout)
+        words = _registers(pdu) if pdu is not None else None
+        if words is not None and len(words) == fp.count:
+            responder.fingerprints[fp.device] = str(decode_value(fp.encoding, words))
+
+
+def scan_transport(
+    transport: Transport,
+    slaves: Iterable[int],
+    timeout: AdaptiveTimeout,
+    baud: Optional[int] = None,
+    on_found: Optional[Callable[[Responder], None]] = None,
+) -> list[Responder]:
+    """Probe slaves on transport, fingerprinting each one that answers."""
+    probe = Fingerprints[0]
+    request = read_request(probe.address, probe.count)
+    found = []
+    for slave in slaves:
+        start = time.monotonic()
+        pdu = transport.transact(slave, request, timeout.timeout)
+        if pdu is None or _absent(pdu):
+            continue
+        response_time = time.monotonic() - start
+        timeout.observe(response_time)
+        responder = Responder(transport.name, slave, response_time, baud)
+        fingerprint(transport, slave, timeout.timeout, responder)
+        found.append(responder)
+        if on_found is not None:
+            on_found(responder)
+    return found
+
+
+def scan_serial(
+    port: str,
+    bauds: Iterable[int],
+    slaves: Iterable[int],
+    initial_timeout: float = INITIAL_TIMEOUT,
+    on_found: Optional[Callable[[Responder], None]] = None,
+) -> list[Responder]:
+    found = []
+    slaves = list(slaves)
+    for baud in bauds:
+        transport = SerialTransport(port, baud)
+        try:
+            # The response to a probe takes at least its own transmission time.
+            floor = MIN_TIMEOUT + transport.frame_time(8 + 7)
+            timeout = AdaptiveTimeout(floor, max(initial_timeout, floor))
+            found += scan_transport(transport, slaves, timeout, baud, on_found)
+        finally:
+            transport.close()
+    return found
+
+
+def scan_tcp(
+    host: str,
+    port: int,
+    slaves: Iterable[int],
+    initial_timeout: float = INITIAL_TIMEOUT,
+    on_found: Optional[Callable[[Responder], None]] = None,
+    rtu: bool = False,
+) -> list[Responder]:
+    """Scan a gateway speaking Modbus TCP, or if rtu passing RTU frames through."""
+    transport: Transport = (
+        RtuTcpTransport(host, port) if rtu else TcpTransport(host, port)
+    )
+    try:
+        timeout = AdaptiveTimeout(initial=initial_timeout)
+        return scan_transport(transport, slaves, timeout, on_found=on_found)
+    finally:
+        transport.close()
+
+
+def scan(
+    ports: Iterable[str] = (),
+    bauds: Iterable[int] = (9600,),
+    hosts: Iterable[tuple[str, int]] = (),
+    slaves: Iterable[int] = range(MIN_SLAVE_ID, MAX_SLAVE_ID + 1),
+    initial_timeout: float = INITIAL_TIMEOUT,
+    on_found: Optional[Callable[[Responder], None]] = None,
+    rtu_hosts: Iterable[tuple[str, int]] = (),
+) -> list[Responder]:
+    """Scan serial ports at each of bauds, Modbus TCP (host, port)s and RTU over TCP
+    rtu_hosts, all in parallel.
+
+    on_found is called, from the scanning threads, as each responder is found.
+    """
+    bauds = list(bauds)
+    slaves = list(slaves)
+    hosts = list(hosts)
+    ports = list(ports)
+    rtu_hosts = list(rtu_hosts)
+    workers = max(1, len(ports) + len(hosts) + len(rtu_hosts))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(scan_serial, port, bauds, slaves, initial_timeout, on_found)
+            for port in ports
+        ]
+        futures += [
+            pool.submit(scan_tcp, host, port, slaves, initial_timeout, on_found)
+            for host, port in hosts
+        ]
+        futures += [
+            pool.submit(
+                scan_tcp, host, port, slaves, initial_timeout, on_found, rtu=True
+            )
+            for host, port in rtu_hosts
+        ]
+        found = []
+        for future in futures:
+            try:
+                found += future.result()
+            except OSError as e:
+                logger.warning("Scan failed: %s", e)
+    return found
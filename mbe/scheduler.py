@@ -0,0 +1,150 @@
+"""Priority and deadline scheduling of the transactions on one bus.
+
+A bus carries one transaction at a time. When several tasks want it, BusScheduler
+gives the next free slot to the waiting transaction with the most urgent priority
+class, then the earliest deadline, then the one that has waited longest:
+
+    CONTROL      writes, e.g. switching a relay
+    INTERACTIVE  reads a user is waiting for
+    TELEMETRY    periodic polling
+    BACKGROUND   configuration and identity reads
+
+A transaction already on the bus is never interrupted, so a control write waits at
+most for the transaction in progress, however many telemetry reads are queued.
+A bus that can carry several transactions at once, such as a pipelined TCP gateway
+connection (see mbe.pipeline), has a scheduler with that capacity.
+
+Tasks choose the priority and deadline of their transactions with scheduled().
+Without it, writes are CONTROL and reads TELEMETRY. A transaction still queued at
+its deadline fails with DeadlineExceeded instead of spending bus time on a result
+nobody is waiting for any more.
+"""
+
+import asyncio
+import contextlib
+import heapq
+import itertools
+import time
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import AsyncIterator
+from typing import Iterator
+from typing import Optional
+
+
+class Priority(IntEnum):
+    CONTROL = 0
+    INTERACTIVE = 1
+    TELEMETRY = 2
+    BACKGROUND = 3
+
+
+# Function codes that write coils or registers.
+WRITE_FUNCTIONS = frozenset((0x05, 0x06, 0x0F, 0x10, 0x16, 0x17))
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """The deadline of a transaction passed before the bus was free."""
+
+
+# (priority, absolute deadline) set by scheduled() for the current task.
+_scheduling: ContextVar[Optional[tuple[Priority, Optional[float]]]] = ContextVar(
+    "scheduling", default=None
+)
+
+
+@contextlib.contextmanager
+def scheduled(priority: Priority, timeout: Optional[float] = None) -> Iterator[None]:
+    """Give transactions in this context priority, and if timeout is given a
+    deadline timeout seconds from now. Applies to the current asyncio task and the
+    tasks it creates."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    token = _scheduling.set((priority, deadline))
+    try:
+        yield
+    finally:
+        _scheduling.reset(token)
+
+
+def scheduling(function_code: int) -> tuple[Priority, Optional[float]]:
+    """Priority and deadline of a transaction with function_code in this context."""
+    if (current := _scheduling.get()) is not None:
+        return current
+    if function_code in WRITE_FUNCTIONS:
+        return Priority.CONTROL, None
+    return Priority.TELEMETRY, None
+
+
+class BusScheduler:
+    """Grants the bus to capacity transactions at a time, most urgent first."""
+
+    capacity: int
+    # Transactions granted the bus and not yet released
+    active: int
+    # (priority, deadline, sequence, future) of waiting transactions
+    queue: list[tuple[Priority, float, int, asyncio.Future]]
+
+    def __init__(self, capacity: int = 1) -> None:
+        self.capacity = capacity
+        self.active = 0
+        self.queue = []
+        self._sequence = itertools.count()
+
+    @property
+    def busy(self) -> bool:
+        return self.active >= self.capacity
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
+    async def acquire(
+        self, priority: Priority = Priority.TELEMETRY, deadline: Optional[float] = None
+    ) -> None:
+        if deadline is not None and time.monotonic() >= deadline:
+            raise DeadlineExceeded("Deadline passed before the transaction was queued")
+        if not self.busy and not self.queue:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        entry = (
+            priority,
+            float("inf") if deadline is None else deadline,
+            next(self._sequence),
+            future,
+        )
+        heapq.heappush(self.queue, entry)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Granted the bus just as it was cancelled: pass it on.
+                self.release()
+            raise
+
+    def release(self) -> None:
+        """Give the bus to the most urgent waiting transaction, failing those whose
+        deadline has passed."""
+        self.active -= 1
+        now = time.monotonic()
+        while self.queue:
+            _, deadline, _, future = heapq.heappop(self.queue)
+            if future.done():
+                continue
+            if now >= deadline:
+                future.set_exception(
+                    DeadlineExceeded("Deadline passed waiting for the bus")
+                )
+                continue
+            future.set_result(None)
+            self.active += 1
+            return
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self, priority: Priority = Priority.TELEMETRY, deadline: Optional[float] = None
+    ) -> AsyncIterator[None]:
+        await self.acquire(priority, deadline)
+        try:
+            yield
+        finally:
+            self.release()
@@ -1,9 +1,15 @@
-import time
-
-from pymodbus.client.base import ModbusBaseSyncClient
-from pymodbus.pdu.register_read_message import ReadInputRegistersResponse
+from typing import TYPE_CHECKING
 
+from mbe.decode import decode_value
+from mbe.decode import float32
+from mbe.decode import string
+from mbe.decode import uint16
 from mbe.io import set_device_id
+from mbe.planner import plan_reads
+from mbe.planner import read_planned
+
+if TYPE_CHECKING:
+    from mbe.client_wrapper import SyncClient
 
 SchneiderRegisters = dict(
     Name=(0x001D, 10),
@@ -20,31 +26,69 @@ SchneiderRegisters = dict(
     Frequency=(0x0C25, 2),
 )
 
+# Ranges that cause read errors. Block reads must not span these.
+SchneiderPoisonRanges = [
+    (0x0031, 10),  # Model
+    (0x0045, 10),  # Manufacturer
+    (0x0081, 1),  # SerialNumber
+]
+
+# The measurement registers form one contiguous block on the meter, so block reads
+# may bridge wider gaps than the default.
+SCHNEIDER_MAX_GAP = 32
+
+# Registers that rarely change, by register class. See mbe.cache.
+SchneiderRegisterClasses = dict(
+    Name="identity",
+    Protocol="config",
+    Address="address",
+    BaudRate="config",
+    Parity="config",
+)
+
+SchneiderEncodings = dict(
+    Name=string(10),
+    Protocol=uint16(),
+    Address=uint16(),
+    BaudRate=uint16(),
+    Parity=uint16(),
+    I1_Phase1Current=float32(),
+    Voltage_LN_1=float32(),
+    Frequency=float32(),
+)
+
+# Measurement registers, in A, V and Hz.
+SchneiderMeasurements = ("I1_Phase1Current", "Voltage_LN_1", "Frequency")
+
 SCHNEIDER_DEVICE_ID_FACTORY = 1
 SCHNEIDER_DEVICE_ID = 12
 
 
 class Schneider:
-    client: ModbusBaseSyncClient
+    client: "SyncClient"
     device: int
 
-    def __init__(self, client: ModbusBaseSyncClient, device: int = SCHNEIDER_DEVICE_ID):
+    def __init__(self, client: "SyncClient", device: int = SCHNEIDER_DEVICE_ID):
         self.client = client
         self.device = device
 
     def read_registers(self) -> None:
         print("Schneider Electric Meter")
-        for name, (address, count) in SchneiderRegisters.items():
-            time.sleep(1.0)
-            resp = self.client.read_holding_registers(
-                address=address, slave=self.device, count=count
-            )
+        plan = plan_reads(
+            SchneiderRegisters,
+            max_gap=SCHNEIDER_MAX_GAP,
+            poison=SchneiderPoisonRanges,
+        )
+        results = read_planned(self.client, self.device, plan)
+        for name, (address, _count) in SchneiderRegisters.items():
             s = f"Read 0x{address:04X}   {name:20}: "
-            if not isinstance(resp, ReadInputRegistersResponse):
-                s += str(resp)
+            result = results[name]
+            if isinstance(result, Exception):
+                s += str(result)
             else:
-                for c in resp.registers:  # noqa
+                for c in result:
                     s += f"{c:04X} "
+                s += f" {decode_value(SchneiderEncodings[name], result)}"
             print(s)
 
     def set_device_id(self, new_device_id) -> None:
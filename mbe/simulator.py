@@ -0,0 +1,277 @@
+"""Simulated Taidecent, Waveshare relay and Schneider devices on a pymodbus server.
+
+The devices answer with plausible values at the addresses of their register maps.
+They share one SimulatedBus, which serializes transactions like a real RTU bus and
+can delay each response by a fixed latency plus, with a baud rate, the time the
+request and response frames would take on a serial line.
+
+    with Simulator(latency=0.005, baud=9600) as sim:
+        client = ModbusTcpClient("127.0.0.1", port=sim.port)
+"""
+
+import asyncio
+import math
+import socket
+import struct
+import threading
+from typing import Optional
+
+from pymodbus.datastore import ModbusSequentialDataBlock
+from pymodbus.datastore import ModbusServerContext
+from pymodbus.datastore import ModbusSlaveContext
+from pymodbus.datastore import ModbusSparseDataBlock
+from pymodbus.server import ModbusTcpServer
+from pymodbus.server.async_io import ModbusServerRequestHandler
+
+from mbe.pacing import char_time
+from mbe.schneider import SCHNEIDER_DEVICE_ID
+from mbe.schneider import SchneiderRegisters
+from mbe.taidecent import TAIDECENT_DEVICE_ID
+from mbe.taidecent import TaidacentRegisters
+from mbe.waveshare_relays import WAVESHARE_READ_WRITE_ALL_RELAYS_COUNT
+from mbe.waveshare_relays import WAVESHARE_RELAY_DEVICE_ID
+from mbe.waveshare_relays import WAVESHARE_WRITE_ALL_RELAYS_IDX
+from mbe.waveshare_relays import WaveShareRelayReadRegisters
+
+READ_FUNCTIONS = (0x01, 0x02, 0x03, 0x04)
+
+
+def _frame_lengths(fc: int, count: int) -> tuple[int, int]:
+    """Lengths of the RTU request and response frames of a transaction."""
+    if fc in (0x01, 0x02):
+        return 8, 5 + math.ceil(count / 8)
+    if fc in (0x03, 0x04):
+        return 8, 5 + 2 * count
+    if fc == 0x0F:
+        return 9 + math.ceil(count / 8), 8
+    if fc in (0x10, 0x17):
+        return 9 + 2 * count, 8
+    return 8, 8
+
+
+class SimulatedBus:
+    """Serializes the transactions of the devices on it and delays each response."""
+
+    latency: float
+    baud: Optional[int]
+
+    def __init__(self, latency: float = 0.0, baud: Optional[int] = None) -> None:
+        self.latency = latency
+        self.baud = baud
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        # Created on first use, inside the server's event loop.
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def delay(self, fc: int, count: int) -> float:
+        delay = self.latency
+        if self.baud is not None:
+            request, response = _frame_lengths(fc, count)
+            delay += (request + response) * char_time(self.baud)
+        return delay
+
+    async def transact(self, fc: int, count: int) -> None:
+        if (delay := self.delay(fc, count)) > 0:
+            async with self.lock:
+                await asyncio.sleep(delay)
+
+
+class SimulatedDevice(ModbusSlaveContext):
+    """A slave whose reads and writes take the time of a transaction on its bus."""
+
+    bus: SimulatedBus
+
+    def __init__(self, bus: SimulatedBus, **kwargs) -> None:
+        super().__init__(zero_mode=True, **kwargs)
+        self.bus = bus
+
+    async def async_getValues(self, fc_as_hex, address, count=1):
+        # Writes read back what they wrote; they were already delayed in setValues.
+        if fc_as_hex in READ_FUNCTIONS:
+            await self.bus.transact(fc_as_hex, count)
+        return self.getValues(fc_as_hex, address, count)
+
+    async def async_setValues(self, fc_as_hex, address, values):
+        await self.bus.transact(fc_as_hex, len(values))
+        self.setValues(fc_as_hex, address, values)
+
+
+class SimulatedRelays(SimulatedDevice):
+    """Waveshare relay board, including the write-all-relays coil address."""
+
+    def setValues(self, fc_as_hex, address, values):
+        if fc_as_hex == 0x05 and address == WAVESHARE_WRITE_ALL_RELAYS_IDX:
+            super().setValues(
+                fc_as_hex, 0, list(values) * WAVESHARE_READ_WRITE_ALL_RELAYS_COUNT
+            )
+        super().setValues(fc_as_hex, address, values)
+
+
+def _float_words(value: float) -> list[int]:
+    return list(struct.unpack(">HH", struct.pack(">f", value)))
+
+
+def _string_words(s: str, count: int) -> list[int]:
+    data = s.encode().ljust(2 * count, b"\0")[: 2 * count]
+    return list(struct.unpack(f">{count}H", data))
+
+
+def taidecent(bus: SimulatedBus, device: int = TAIDECENT_DEVICE_ID) -> SimulatedDevice:
+    values = [0] * (max(TaidacentRegisters.values()) + 1)
+    for name, value in dict(
+        Temperature=2150,
+        Humidity=4530,
+        ModelCode=0x0C1B,
+        MeasuringPoints=1,
+        DeviceAddress=device,
+        BaudRate=2,
+        CommunicationMode=0,
+        ProtocolType=0,
+    ).items():
+        values[TaidacentRegisters[name]] = value
+    return SimulatedDevice(bus, hr=ModbusSequentialDataBlock(0, values))
+
+
+def waveshare_relays(
+    bus: SimulatedBus, device: int = WAVESHARE_RELAY_DEVICE_ID
+) -> SimulatedDevice:
+    return SimulatedRelays(
+        bus,
+        co=ModbusSequentialDataBlock(0, [False] * (WAVESHARE_WRITE_ALL_RELAYS_IDX + 1)),
+        hr=ModbusSparseDataBlock(
+            {
+                WaveShareRelayReadRegisters["DeviceAddress"]: device,
+                WaveShareRelayReadRegisters["SoftwareVersion"]: 0x0100,
+            }
+        ),
+    )
+
+
+def schneider(bus: SimulatedBus, device: int = SCHNEIDER_DEVICE_ID) -> SimulatedDevice:
+    # Planned block reads span gaps between registers, so every address up to the
+    # highest register is backed.
+    end = max(address + count for address, count in SchneiderRegisters.values())
+    values = [0] * end
+
+    def put(name: str, words: list[int]) -> None:
+        address = SchneiderRegisters[name][0]
+        values[address : address + len(words)] = words
+
+    put("Name", _string_words("iEM3155", SchneiderRegisters["Name"][1]))
+    put("Protocol", [1])
+    put("Address", [device])
+    put("BaudRate", [1])
+    put("I1_Phase1Current", _float_words(4.25))
+    put("Voltage_LN_1", _float_words(239.6))
+    put("Frequency", _float_words(50.02))
+    return SimulatedDevice(bus, hr=ModbusSequentialDataBlock(0, values))
+
+
+def server_context(
+    bus: SimulatedBus,
+    taidecent_id: int = TAIDECENT_DEVICE_ID,
+    relays_id: int = WAVESHARE_RELAY_DEVICE_ID,
+    schneider_id: int = SCHNEIDER_DEVICE_ID,
+) -> ModbusServerContext:
+    return ModbusServerContext(
+        slaves={
+            taidecent_id: taidecent(bus, taidecent_id),
+            relays_id: waveshare_relays(bus, relays_id),
+            schneider_id: schneider(bus, schneider_id),
+        },
+        single=False,
+    )
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# MBAP header: transaction id, protocol id, length of the rest, unit id.
+MBAP = struct.Struct(">HHHB")
+
+
+class _FrameHandler(ModbusServerRequestHandler):
+    """Queues each Modbus TCP frame received on its own. The pymodbus handler
+    decodes one frame per chunk of received data, so of several pipelined requests
+    arriving together only the first would be answered."""
+
+    def __init__(self, owner) -> None:
+        super().__init__(owner)
+        self._received = b""
+
+    def callback_data(self, data: bytes, addr: Optional[tuple] = ()) -> int:
+        self._received += data
+        while len(self._received) >= MBAP.size:
+            end = MBAP.size - 1 + MBAP.unpack_from(self._received)[2]
+            if len(self._received) < end:
+                break
+            super().callback_data(self._received[:end], addr)
+            self._received = self._received[end:]
+        return len(data)
+
+
+class _SimulatorServer(ModbusTcpServer):
+    def callback_new_connection(self) -> ModbusServerRequestHandler:
+        return _FrameHandler(self)
+
+
+class Simulator:
+    """Runs the simulated devices on a Modbus TCP server in a background thread."""
+
+    host: str
+    port: int
+    bus: SimulatedBus
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        baud: Optional[int] = None,
+        host: str = "127.0.0.1",
+        port: Optional[int] = None,
+    ) -> None:
+        self.host = host
+        self.port = _free_port() if port is None else port
+        self.bus = SimulatedBus(latency, baud)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._server: Optional[_SimulatorServer] = None
+
+    async def _listen(self) -> None:
+        # pymodbus servers must be created inside their event loop.
+        self._server = _SimulatorServer(
+            server_context(self.bus), address=(self.host, self.port)
+        )
+        if not await self._server.listen():
+            raise OSError(f"Simulator could not listen on {self.host}:{self.port}")
+
+    def start(self) -> "Simulator":
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._listen(), self._loop).result()
+        return self
+
+    async def _shutdown(self) -> None:
+        if self._server is not None:
+            await self._server.shutdown()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self) -> "Simulator":
+        return self.start()
+
+    def __exit__(self, klass, value, traceback) -> None:
+        self.stop()
@@ -0,0 +1,270 @@
+"""Modbus RTU sniffer: split a captured byte stream into frames and decode them.
+
+Bytes are read from the port in bulk. Back-to-back frames are separated by their
+length and CRC, since USB serial adapters deliver data in chunks whose timing no
+longer shows the 3.5 character gaps between frames at higher baud rates. A silence
+on the line longer than flush_timeout ends whatever is left in the buffer, which
+resynchronizes the splitter after noise or unknown function codes.
+"""
+
+import sys
+import time
+from typing import Iterable
+from typing import Optional
+from typing import TextIO
+
+from mbe.capture import CaptureWriter
+from mbe.pacing import silent_interval
+from mbe.rtu import EXCEPTION_BIT
+from mbe.rtu import MAX_FRAME_LEN
+from mbe.rtu import ExceptionCodes
+from mbe.rtu import Frame
+from mbe.rtu import candidate_lengths
+from mbe.rtu import crc_ok
+from mbe.rtu import decode_frame
+
+# Serial adapters typically deliver received data every 1-16 ms, so silences shorter
+# than this cannot be told apart from adapter latency.
+MIN_FLUSH_TIMEOUT = 0.02
+
+# (frame bytes, timestamp, is_request or None if unknown)
+RawFrame = tuple[bytes, float, Optional[bool]]
+
+
+def flush_timeout(baud: int) -> float:
+    return max(silent_interval(baud), MIN_FLUSH_TIMEOUT)
+
+
+class FrameSplitter:
+    """Split a stream of received chunks into RTU frames."""
+
+    timeout: float
+    buf: bytearray
+    start_time: float
+    last_rx: float
+
+    def __init__(self, timeout: float) -> None:
+        self.timeout = timeout
+        self.buf = bytearray()
+        self.start_time = 0.0
+        self.last_rx = 0.0
+
+    def feed(self, chunk: bytes, timestamp: float) -> list[RawFrame]:
+        frames = []
+        if self.buf and timestamp - self.last_rx > self.timeout:
+            frames.extend(self.flush())
+        if not self.buf:
+            self.start_time = timestamp
+        self.buf += chunk
+        self.last_rx = timestamp
+        frames.extend(self._split())
+        return frames
+
+    def flush(self) -> list[RawFrame]:
+        """End the current frame, e.g. after a silence on the line."""
+        frames = self._split()
+        if self.buf:
+            frames.append((bytes(self.buf), self.start_time, None))
+            self.buf.clear()
+        return frames
+
+    def _match(self, start: int) -> Optional[tuple[int, Optional[bool]]]:
+        """Length and kind of a complete, CRC-valid frame at buf[start], if any."""
+        matches: dict[int, set[bool]] = {}
+        for length, is_request in candidate_lengths(self.buf, start):
+            if start + length <= len(self.buf) and length not in matches:
+                if crc_ok(self.buf[start : start + length]):
+                    matches[length] = set()
+            if length in matches:
+                matches[length].add(is_request)
+        if not matches:
+            return None
+        length = min(matches)
+        kinds = matches[length]
+        return length, kinds.pop() if len(kinds) == 1 else None
+
+    def _incomplete(self, start: int) -> bool:
+        """True if buf[start:] could still grow into a frame."""
+        remaining = len(self.buf) - start
+        if remaining < 3:
+            return True
+        return any(
+            remaining < length for length, _ in candidate_lengths(self.buf, start)
+        )
+
+    def _split(self) -> list[RawFrame]:
+        frames: list[RawFrame] = []
+        while self.buf:
+            if match := self._match(0):
+                length, is_request = match
+                frames.append((bytes(self.buf[:length]), self.start_time, is_request))
+                del self.buf[:length]
+                self.start_time = self.last_rx
+                continue
+            if self._incomplete(0) and len(self.buf) <= MAX_FRAME_LEN:
+                break
+            # No frame starts at buf[0]. Skip to the next offset that starts a
+            # valid frame and emit the skipped bytes as garbage.
+            for skip in range(1, len(self.buf)):
+                if self._match(skip):
+                    frames.append((bytes(self.buf[:skip]), self.start_time, None))
+                    del self.buf[:skip]
+                    self.start_time = self.last_rx
+                    break
+            else:
+                if len(self.buf) > MAX_FRAME_LEN:
+                    frames.append((bytes(self.buf), self.start_time, None))
+                    self.buf.clear()
+                break
+        return frames
+
+
+class Sniffer:
+    """Decodes frames, pairs responses with requests and formats one line per frame."""
+
+    pending: dict[int, Frame]
+
+    def __init__(self) -> None:
+        self.pending = {}
+
+    def decode(self, raw: RawFrame) -> tuple[Frame, Optional[Frame]]:
+        """Decode a raw frame. Returns the frame and, for a response, its request."""
+        data, timestamp, is_request = raw
+        request = self.pending.get(data[0]) if data else None
+        if is_request is None and request is not None and len(data) > 1:
+            if request.function in (data[1], data[1] & ~EXCEPTION_BIT):
+                is_request = False
+        if is_request is None and (len(data), True) in candidate_lengths(data):
+            # Ambiguous, e.g. write single coil requests and responses are
+            # identical. With no request outstanding, this must be one.
+            is_request = True
+        frame = decode_frame(data, timestamp, is_request)
+        if not frame.crc_ok:
+            return frame, None
+        if frame.is_request:
+            self.pending[frame.slave] = frame
+            return frame, None
+        if request is not None and request.function == frame.function & ~EXCEPTION_BIT:
+            del self.pending[frame.slave]
+            return frame, request
+        return frame, None
+
+    def format(self, frame: Frame, request: Optional[Frame]) -> str:
+        t = time.strftime("%H:%M:%S", time.localtime(frame.timestamp))
+        t += f".{int(frame.timestamp * 1000) % 1000:03d}"
+        if not frame.crc_ok:
+            return f"{t}  BAD CRC       {frame.data.hex(' ')}"
+        head = f"{t}  {frame.slave:3d}  0x{frame.function:02X}"
+        if frame.is_exception:
+            code = frame.exception_code
+            s = f"{head}  exc  code {code} {ExceptionCodes.get(code or 0, '')}"
+        elif frame.is_request is None:
+            return f"{head}  ???  {frame.data.hex(' ')}"
+        elif frame.is_request:
+            s = f"{head}  req "
+            if frame.address is not None:
+                s += f" addr 0x{frame.address:04X}"
+            if frame.count is not None:
+                s += f" count {frame.count}"
+            if frame.values is not None:
+                s += f" values {_format_values(frame.values)}"
+            return s
+        else:
+            s = f"{head}  rsp "
+            values = frame.values
+            if request is not None:
+                if request.address is not None:
+                    s += f" addr 0x{request.address:04X}"
+                if values is not None and frame.function in (0x01, 0x02):
+                    values = values[: request.count]
+            if frame.address is not None and request is None:
+                s += f" addr 0x{frame.address:04X}"
+            if frame.count is not None and frame.function in (0x0F, 0x10):
+                s += f" count {frame.count}"
+            if values is not None and frame.function in (0x01, 0x02):
+                s += " bits " + "".join(str(v) for v in values)
+            elif values is not None:
+                s += f" values {_format_values(values)}"
+        if request is not None:
+            s += f"  ({(frame.timestamp - request.timestamp) * 1000:.1f} ms)"
+        return s
+
+
+def _format_values(values: list[int]) -> str:
+    return "[" + " ".join(f"{v:04X}" for v in values) + "]"
+
+
+def sniff_frames(
+    ser,
+    baud: int,
+    out: TextIO = sys.stdout,
+    capture: Optional[CaptureWriter] = None,
+) -> None:
+    """Read ser until interrupted, writing one decoded line per frame to out and
+    optionally recording the frames to capture."""
+    timeout = flush_timeout(baud)
+    ser.timeout = timeout
+    splitter = FrameSplitter(timeout)
+    sniffer = Sniffer()
+    while True:
+        data = ser.read(ser.in_waiting or 1)
+        if data:
+            raw_frames = splitter.feed(data, time.time())
+        else:
+            raw_frames = splitter.flush()
+            if capture is not None:
+                capture.flush()
+        if raw_frames:
+            lines = []
+            for raw in raw_frames:
+                if capture is not None:
+                    capture.append(raw[1], raw[0])
+                lines.append(sniffer.format(*sniffer.decode(raw)))
+            out.write("\n".join(lines) + "\n")
+            out.flush()
+
+
+def sniff_stats(
+    ser,
+    baud: int,
+    capture: Optional[CaptureWriter] = None,
+    refresh: float = 1.0,
+) -> None:
+    """Read ser until interrupted, showing rolling traffic statistics refreshed
+    every refresh seconds instead of the frames, and optionally recording the frames
+    to capture."""
+    from rich.live import Live
+
+    from mbe.traffic import TrafficStats
+
+    timeout = flush_timeout(baud)
+    ser.timeout = timeout
+    splitter = FrameSplitter(timeout)
+    sniffer = Sniffer()
+    stats = TrafficStats(baud)
+    with Live(stats.table(), auto_refresh=False) as live:
+        next_refresh = time.monotonic() + refresh
+        while True:
+            data = ser.read(ser.in_waiting or 1)
+            if data:
+                raw_frames = splitter.feed(data, time.time())
+            else:
+                raw_frames = splitter.flush()
+                if capture is not None:
+                    capture.flush()
+            for raw in raw_frames:
+                if capture is not None:
+                    capture.append(raw[1], raw[0])
+                stats.observe(sniffer.decode(raw)[0])
+            if time.monotonic() >= next_refresh:
+                live.update(stats.table(), refresh=True)
+                next_refresh = time.monotonic() + refresh
+
+
+def replay_frames(
+    frames: Iterable[tuple[float, bytes]], out: TextIO = sys.stdout
+) -> None:
+    """Write one decoded line per recorded (timestamp, frame) to out."""
+    sniffer = Sniffer()
+    for timestamp, data in frames:
+        out.write(sniffer.format(*sniffer.decode((data, timestamp, None))) + "\n")
@@ -1,10 +1,16 @@
-import time
+from typing import TYPE_CHECKING
 
 import rich
 
-from pymodbus.client.base import ModbusBaseSyncClient
-
+from mbe.decode import decode_value
+from mbe.decode import int16
+from mbe.decode import uint16
 from mbe.io import set_device_id
+from mbe.planner import plan_reads
+from mbe.planner import read_planned
+
+if TYPE_CHECKING:
+    from mbe.client_wrapper import SyncClient
 
 TaidacentRegisters = dict(
     Temperature=0x0000,
@@ -19,33 +25,50 @@ TaidacentRegisters = dict(
     HumidityCorrection=0x006C,
 )
 
+# Registers that rarely change, by register class. See mbe.cache.
+TaidecentRegisterClasses = dict(
+    ModelCode="identity",
+    MeasuringPoints="identity",
+    DeviceAddress="address",
+    BaudRate="config",
+    CommunicationMode="config",
+    ProtocolType="config",
+    TempCorrection="config",
+    HumidityCorrection="config",
+)
+
+# Temperature in °C and humidity in %. Temperatures below zero are negative.
+TaidecentEncodings = dict(
+    Temperature=int16(scale=0.01),
+    Humidity=uint16(scale=0.01),
+    TempCorrection=int16(),
+)
+
 TAIDECENT_TEMP_CORRECTION = -178 & 0xFFFF
 TAIDECENT_DEVICE_ID_FACTORY = 1
 TAIDECENT_DEVICE_ID = 2
 
 
 class Taidecent:
-    client: ModbusBaseSyncClient
+    client: "SyncClient"
     device: int
 
-    def __init__(self, client: ModbusBaseSyncClient, device: int = TAIDECENT_DEVICE_ID):
+    def __init__(self, client: "SyncClient", device: int = TAIDECENT_DEVICE_ID):
         self.client = client
         self.device = device
 
     def read_registers(self) -> None:
         print("Taidecent Thermometer")
+        results = read_planned(self.client, self.device, plan_reads(TaidacentRegisters))
         for name, address in TaidacentRegisters.items():
-            time.sleep(0.2)
-            resp = self.client.read_holding_registers(
-                address=address, slave=self.device, count=1
-            )
             s = f"Read 0x{address:02X}   {name:20}: "
-            if isinstance(resp, Exception):
-                s += str(resp)
+            result = results[name]
+            if isinstance(result, Exception):
+                s += str(result)
             else:
-                s += f"{resp.registers[0]:6d}"
+                s += f"{result[0]:6d}"
                 if name == "Temperature":
-                    C = resp.registers[0] / 100
+                    C = float(decode_value(TaidecentEncodings[name], result))
                     F = C * 9 / 5 + 32
                     s += f"  {C}\u00b0C  {F:4.2f}\u00b0F"
             print(s)
@@ -53,13 +76,12 @@ class Taidecent:
     def read_temperature(self, fahrenheit: bool = False, show: bool = True) -> float:
         name = "Temperature"
         address = TaidacentRegisters[name]
-        time.sleep(0.2)
         resp = self.client.read_holding_registers(
             address=address, slave=self.device, count=1
         )
         if isinstance(resp, Exception):
             raise resp
-        C = resp.registers[0] / 100
+        C = float(decode_value(TaidecentEncodings[name], resp.registers))
         F = C * 9 / 5 + 32
         if show:
             print(
@@ -79,7 +101,6 @@ class Taidecent:
         """Set temperature correction register"""
         name = "TempCorrection"
         address = TaidacentRegisters[name]
-        time.sleep(0.2)
         resp = self.client.read_holding_registers(
             address=address, slave=self.device, count=1
         )
@@ -88,14 +109,12 @@ class Taidecent:
         correction &= 0xFFFF
         if correction != resp.registers[0]:
             print(f"Setting {name}")
-            time.sleep(0.2)
             resp = self.client.write_register(
                 address=address, value=correction & 0xFFFF, slave=self.device
             )
             if isinstance(resp, Exception):
                 raise resp
             rich.print(resp)
-            time.sleep(0.2)
             resp = self.client.read_holding_registers(
                 address=address, slave=self.device, count=1
             )
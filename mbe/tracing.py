@@ -0,0 +1,212 @@
+"""Profiling and tracing of mbe commands, for mbe --profile and mbe --trace.
+
+--profile FILE profiles the whole command. If FILE ends in .folded or .collapsed,
+StackSampler samples the stacks of all threads every millisecond and writes them
+as collapsed stacks ("thread;outer;...;inner count" lines), the input of
+flamegraph.pl, speedscope and inferno. Otherwise cProfile profiles the main thread
+and writes its stats, for pstats, snakeviz or gprof2dot.
+
+--trace FILE records spans of the work mbe does: loading the config, connecting
+clients, pacing sleeps, bus transactions and decoding registers. They are written
+as Chrome trace events, which Perfetto (ui.perfetto.dev) and chrome://tracing
+show as a timeline with a row per thread. Spans around an await, which overlap
+when a bus has several transactions in flight, are recorded with async_span() as
+async events, each on its own track, since spans of a thread must nest.
+
+span() returns the same do-nothing context when no trace is being recorded, so
+spans cost next to nothing otherwise. Only the threads of the mbe process itself
+are profiled or traced, not the worker processes of mbe fleet.
+"""
+
+import contextlib
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from types import CodeType
+from types import FrameType
+from typing import Callable
+from typing import ContextManager
+from typing import Iterator
+from typing import Optional
+
+COLLAPSED_SUFFIXES = (".folded", ".collapsed")
+DEFAULT_SAMPLE_INTERVAL = 0.001
+
+
+class Tracer:
+    """Records spans as Chrome trace "complete" events, and async spans as pairs of
+    "b" and "e" events."""
+
+    events: list[dict]
+
+    def __init__(self) -> None:
+        self.events = []
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        self._threads: dict[int, str] = {}
+        self._ids = itertools.count()
+
+    def _thread(self) -> int:
+        tid = threading.get_ident()
+        if tid not in self._threads:
+            self._threads[tid] = threading.current_thread().name
+        return tid
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, **args) -> Iterator[None]:
+        tid = self._thread()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            # list.append is atomic, so threads can record without a lock.
+            self.events.append(
+                dict(
+                    name=name,
+                    cat=category,
+                    ph="X",
+                    ts=(start - self.origin) * 1e6,
+                    dur=(time.perf_counter() - start) * 1e6,
+                    pid=self.pid,
+                    tid=tid,
+                    args=args,
+                )
+            )
+
+    @contextlib.contextmanager
+    def async_span(self, name: str, category: str, **args) -> Iterator[None]:
+        event = dict(
+            name=name,
+            cat=category,
+            id=next(self._ids),
+            pid=self.pid,
+            tid=self._thread(),
+        )
+        self.events.append(
+            dict(event, ph="b", ts=(time.perf_counter() - self.origin) * 1e6, args=args)
+        )
+        try:
+            yield
+        finally:
+            self.events.append(
+                dict(event, ph="e", ts=(time.perf_counter() - self.origin) * 1e6)
+            )
+
+    def write(self, path: Path) -> None:
+        names = [
+            dict(name="thread_name", ph="M", pid=self.pid, tid=tid, args=dict(name=n))
+            for tid, n in self._threads.items()
+        ]
+        with path.open("w") as f:
+            json.dump(dict(traceEvents=names + self.events, displayTimeUnit="ms"), f)
+
+
+_tracer: Optional[Tracer] = None
+_NOT_TRACED = contextlib.nullcontext()
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, category: str, **args) -> ContextManager:
+    """A context recording a span of the trace, if one is being recorded."""
+    if _tracer is None:
+        return _NOT_TRACED
+    return _tracer.span(name, category, **args)
+
+
+def async_span(name: str, category: str, **args) -> ContextManager:
+    """Like span(), for spans around an await, which may overlap other spans of the
+    thread."""
+    if _tracer is None:
+        return _NOT_TRACED
+    return _tracer.async_span(name, category, **args)
+
+
+def start_trace(path: Path) -> Callable[[], None]:
+    """Start recording a trace. Returns the function that stops it and writes it to
+    path."""
+    global _tracer
+    tracer = _tracer = Tracer()
+
+    def stop() -> None:
+        global _tracer
+        _tracer = None
+        tracer.write(path)
+
+    return stop
+
+
+def _frame_name(code: CodeType) -> str:
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+class StackSampler(threading.Thread):
+    """Counts the stacks of all other threads, sampled every interval seconds."""
+
+    stacks: Counter[str]
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL) -> None:
+        super().__init__(name="stack sampler", daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopping = threading.Event()
+
+    def sample(self) -> None:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            frames = []
+            f: Optional[FrameType] = frame
+            while f is not None:
+                frames.append(_frame_name(f.f_code))
+                f = f.f_back
+            frames.append(names.get(ident, str(ident)))
+            self.stacks[";".join(reversed(frames))] += 1
+
+    def run(self) -> None:
+        while not self._stopping.wait(self.interval):
+            self.sample()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self.join()
+
+    def write(self, path: Path) -> None:
+        with path.open("w") as f:
+            for stack, count in self.stacks.items():
+                f.write(f"{stack} {count}\n")
+
+
+def start_profile(path: Path) -> Callable[[], None]:
+    """Start profiling, sampling stacks if path ends in one of COLLAPSED_SUFFIXES
+    and with cProfile otherwise. Returns the function that stops profiling and
+    writes the profile to path."""
+    if path.suffix in COLLAPSED_SUFFIXES:
+        sampler = StackSampler()
+        sampler.start()
+
+        def stop_sampler() -> None:
+            sampler.stop()
+            sampler.write(path)
+
+        return stop_sampler
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    def stop_profiler() -> None:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+    return stop_profiler
@@ -0,0 +1,186 @@
+"""Rolling bus-traffic statistics of sniffed RTU frames, for mbe sniff --stats.
+
+TrafficStats counts the frames of the last `window` seconds in one-second slots,
+reusing the slot of a second that has left the window, so its memory depends only
+on the window and on the slave ids and function codes seen, never on the traffic
+rate. For the window it gives:
+
+    * frames per second per slave id and function code,
+    * request-to-response turnaround percentiles per slave id and function code,
+      from the end of the request to the start of the response,
+    * bus occupancy: the time spent transmitting frames over the window,
+    * the share of frames with a bad CRC,
+    * collisions: bad-CRC or undecodable frames received while a request was
+      waiting for its response, when the slave and another master, or noise, drove
+      the line at the same time, and
+    * unanswered requests: requests followed by another request, or by nothing
+      for unanswered_timeout seconds, before their slave responded.
+
+Frame timestamps are when the adapter delivered their first bytes, so turnarounds
+are only as precise as the adapter's latency.
+"""
+
+import time
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Optional
+
+from rich.table import Table
+
+from mbe.metrics import Histogram
+from mbe.pacing import char_time
+from mbe.rtu import EXCEPTION_BIT
+from mbe.rtu import Frame
+
+DEFAULT_WINDOW = 10
+DEFAULT_UNANSWERED_TIMEOUT = 1.0
+
+# Upper bounds, in seconds, of the turnaround histogram buckets.
+TURNAROUND_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+# (slave, function code without the exception bit)
+TrafficKey = tuple[int, int]
+
+
+@dataclass
+class Slot:
+    """The traffic of one second."""
+
+    second: int = -1
+    frames: dict[TrafficKey, int] = field(default_factory=dict)
+    turnaround: dict[TrafficKey, Histogram] = field(default_factory=dict)
+    total: int = 0
+    airtime: float = 0.0
+    crc_errors: int = 0
+    collisions: int = 0
+    unanswered: int = 0
+
+
+class TrafficStats:
+    """Rolling counters of the frames on one bus over the last window seconds."""
+
+    baud: int
+    window: int
+    slots: list[Slot]
+    # The request waiting for its response.
+    outstanding: Optional[Frame]
+    started: Optional[float]
+
+    def __init__(
+        self,
+        baud: int,
+        window: int = DEFAULT_WINDOW,
+        unanswered_timeout: float = DEFAULT_UNANSWERED_TIMEOUT,
+    ) -> None:
+        self.baud = baud
+        self.window = window
+        self.unanswered_timeout = unanswered_timeout
+        self.slots = [Slot() for _ in range(window)]
+        self.outstanding = None
+        self.started = None
+
+    def airtime(self, frame: Frame) -> float:
+        return len(frame.data) * char_time(self.baud)
+
+    def _slot(self, timestamp: float) -> Slot:
+        second = int(timestamp)
+        slot = self.slots[second % self.window]
+        if slot.second != second:
+            slot = self.slots[second % self.window] = Slot(second)
+        return slot
+
+    def _live(self, now: float) -> list[Slot]:
+        oldest = int(now) - self.window
+        return [s for s in self.slots if oldest < s.second <= int(now)]
+
+    def expire(self, now: float) -> None:
+        """Count the outstanding request as unanswered if it has waited too long."""
+        if (
+            self.outstanding is not None
+            and now - self.outstanding.timestamp > self.unanswered_timeout
+        ):
+            self._slot(now).unanswered += 1
+            self.outstanding = None
+
+    def observe(self, frame: Frame) -> None:
+        """Count a frame decoded by sniffer.Sniffer."""
+        if self.started is None:
+            self.started = frame.timestamp
+        self.expire(frame.timestamp)
+        slot = self._slot(frame.timestamp)
+        slot.total += 1
+        slot.airtime += self.airtime(frame)
+        if not frame.crc_ok or frame.is_request is None:
+            if not frame.crc_ok:
+                slot.crc_errors += 1
+            if self.outstanding is not None:
+                slot.collisions += 1
+            return
+        key = (frame.slave, frame.function & ~EXCEPTION_BIT)
+        slot.frames[key] = slot.frames.get(key, 0) + 1
+        request = self.outstanding
+        if frame.is_request:
+            if request is not None:
+                slot.unanswered += 1
+            self.outstanding = frame
+        elif request is not None and (request.slave, request.function) == key:
+            turnaround = frame.timestamp - request.timestamp - self.airtime(request)
+            if (histogram := slot.turnaround.get(key)) is None:
+                histogram = slot.turnaround[key] = Histogram(TURNAROUND_BUCKETS)
+            histogram.observe(max(0.0, turnaround))
+            self.outstanding = None
+
+    def table(self, now: Optional[float] = None) -> Table:
+        """The traffic of the window up to now, as a table with one row per slave id
+        and function code."""
+        if now is None:
+            now = time.time()
+        self.expire(now)
+        live = self._live(now)
+        span = float(self.window)
+        if self.started is not None:
+            span = max(1.0, min(span, now - self.started))
+        frames: dict[TrafficKey, int] = {}
+        turnaround: dict[TrafficKey, Histogram] = {}
+        for slot in live:
+            for key, count in slot.frames.items():
+                frames[key] = frames.get(key, 0) + count
+            for key, histogram in slot.turnaround.items():
+                if key not in turnaround:
+                    turnaround[key] = Histogram(TURNAROUND_BUCKETS)
+                turnaround[key].add(histogram)
+        total = sum(s.total for s in live)
+        crc_errors = sum(s.crc_errors for s in live)
+        table = Table(
+            "Slave",
+            "Function",
+            "Frames/s",
+            "Turnaround p50 ms",
+            "p99 ms",
+            title=f"Bus traffic, last {span:.0f} s",
+            caption=(
+                f"{total / span:.1f} frames/s, "
+                f"occupancy {100 * sum(s.airtime for s in live) / span:.1f}%, "
+                f"CRC errors {100 * crc_errors / total if total else 0:.1f}%, "
+                f"collisions {sum(s.collisions for s in live)}, "
+                f"unanswered {sum(s.unanswered for s in live)}"
+            ),
+        )
+        for key in sorted(frames):
+            times = turnaround.get(key)
+            table.add_row(
+                str(key[0]),
+                f"0x{key[1]:02X}",
+                f"{frames[key] / span:.2f}",
+                _ms(None if times is None else times.quantile(0.5)),
+                _ms(None if times is None else times.quantile(0.99)),
+            )
+        return table
+
+
+def _ms(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return ""
+    if seconds == float("inf"):
+        return f">{TURNAROUND_BUCKETS[-1] * 1000:.0f}"
+    return f"<={seconds * 1000:.0f}"
@@ -1,10 +1,14 @@
 import time
 from enum import IntEnum
-
-from pymodbus.client.base import ModbusBaseSyncClient
+from typing import TYPE_CHECKING
+from typing import Callable
+from typing import Optional
 
 from mbe.io import set_device_id
 
+if TYPE_CHECKING:
+    from mbe.client_wrapper import SyncClient
+
 WAVESHARE_RELAY_DEVICE_ID_FACTORY = 1
 WAVESHARE_RELAY_DEVICE_ID = 3
 
@@ -18,6 +22,11 @@ class WaveShareRelayControl(IntEnum):
 WAVESHARE_READ_ALL_RELAYS_ADDRESS = 0x0000
 WAVESHARE_READ_WRITE_ALL_RELAYS_COUNT = 0x0008
 WAVESHARE_WRITE_ALL_RELAYS_IDX = 0xFF
+WAVESHARE_ALL_RELAYS_MASK = (1 << WAVESHARE_READ_WRITE_ALL_RELAYS_COUNT) - 1
+
+# Seconds after which RelayController re-reads the relays before a change, in case
+# they were switched by something else.
+RELAY_RESYNC_INTERVAL = 60.0
 
 WaveShareRelayReadRegisters = dict(
     DeviceAddress=0x4000,
@@ -28,19 +37,24 @@ WaveShareRelayWriteRegisters = dict(
     BaudRate=0x2000,
 )
 
+# Registers that rarely change, by register class. See mbe.cache.
+WaveShareRelayRegisterClasses = dict(
+    DeviceAddress="address",
+    SoftwareVersion="identity",
+)
+
 
 class WaveshareRelays:
-    client: ModbusBaseSyncClient
+    client: "SyncClient"
     device: int
 
     def __init__(
-        self, client: ModbusBaseSyncClient, device: int = WAVESHARE_RELAY_DEVICE_ID
+        self, client: "SyncClient", device: int = WAVESHARE_RELAY_DEVICE_ID
     ) -> None:
         self.client = client
         self.device = device
 
     def write_relay(self, relay_idx: int, mode: WaveShareRelayControl | bool) -> None:
-        time.sleep(0.2)
         if isinstance(mode, bool):
             if mode is True:
                 mode = WaveShareRelayControl.Close
@@ -55,9 +69,8 @@ class WaveshareRelays:
     def write_all_relays(self, mode: WaveShareRelayControl | bool) -> None:
         self.write_relay(WAVESHARE_WRITE_ALL_RELAYS_IDX, mode)
 
-    def read_all_relays(self) -> None:
-        print("WaveShare Relays")
-        time.sleep(0.2)
+    def read_all_relays(self, show: bool = True) -> int:
+        """Read the state of all relays as a bitmask, relay 0 in bit 0."""
         resp = self.client.read_coils(
             address=WAVESHARE_READ_ALL_RELAYS_ADDRESS,
             count=WAVESHARE_READ_WRITE_ALL_RELAYS_COUNT,
@@ -65,17 +78,24 @@ class WaveshareRelays:
         )
         if isinstance(resp, Exception):
             raise resp
+        if resp.isError():
+            raise ValueError(f"Reading relays failed: {resp}")
+        bits = resp.bits[:WAVESHARE_READ_WRITE_ALL_RELAYS_COUNT]
         states = 0
-        s1 = "Relay  "
-        s2 = "State  "
-        for bit_idx in range(len(resp.bits)):
-            s1 += f" {bit_idx:1d}"
-            s2 += f" {resp.bits[bit_idx]:1d}"
-            if resp.bits[bit_idx]:
+        for bit_idx, bit in enumerate(bits):
+            if bit:
                 states |= 1 << bit_idx
-        print(f"Relay states: 0x{states:02X}")
-        print(s1)
-        print(s2)
+        if show:
+            print("WaveShare Relays")
+            s1 = "Relay  "
+            s2 = "State  "
+            for bit_idx, bit in enumerate(bits):
+                s1 += f" {bit_idx:1d}"
+                s2 += f" {bit:1d}"
+            print(f"Relay states: 0x{states:02X}")
+            print(s1)
+            print(s2)
+        return states
 
     def set_device_id(self, new_device_id) -> None:
         set_device_id(
@@ -85,3 +105,94 @@ class WaveshareRelays:
             new_device_id,
         )
         self.device = new_device_id
+
+
+class RelayController:
+    """Sets all relays of a board to a desired state in as few transactions as
+    possible.
+
+    The controller keeps a shadow of the relay states and only writes the relays
+    that differ from it: one write_coil() for a single relay or for all relays
+    switching to the same state, otherwise one write_coils() spanning the relays
+    that change. The shadow is re-read from the board when it is older than
+    resync_interval, and after a failed write.
+    """
+
+    relays: WaveshareRelays
+    resync_interval: float
+    clock: Callable[[], float]
+    shadow: Optional[int]
+    synced_at: float
+
+    def __init__(
+        self,
+        relays: WaveshareRelays,
+        resync_interval: float = RELAY_RESYNC_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.relays = relays
+        self.resync_interval = resync_interval
+        self.clock = clock
+        self.shadow = None
+        self.synced_at = 0.0
+
+    def sync(self) -> int:
+        """Re-read the relay states into the shadow."""
+        self.shadow = self.relays.read_all_relays(show=False)
+        self.synced_at = self.clock()
+        return self.shadow
+
+    def state(self) -> int:
+        """The relay states, re-read if the shadow is missing or stale."""
+        if self.shadow is None or self.clock() - self.synced_at >= self.resync_interval:
+            return self.sync()
+        return self.shadow
+
+    def set(self, desired: int) -> int:
+        """Set all relays to the bitmask desired. Returns the relays that changed."""
+        desired &= WAVESHARE_ALL_RELAYS_MASK
+        changed = self.state() ^ desired
+        if not changed:
+            return 0
+        try:
+            self._write(changed, desired)
+        except Exception:
+            self.shadow = None
+            raise
+        self.shadow = desired
+        return changed
+
+    def set_relay(self, relay_idx: int, closed: bool) -> int:
+        """Set one relay, leaving the others as they are."""
+        mask = 1 << relay_idx
+        return self.set(self.state() | mask if closed else self.state() & ~mask)
+
+    def _write(self, changed: int, desired: int) -> None:
+        client = self.relays.client
+        device = self.relays.device
+        if changed & (changed - 1) == 0:
+            relay_idx = changed.bit_length() - 1
+            resp = client.write_coil(
+                address=relay_idx, value=bool(desired & changed), slave=device
+            )
+        elif desired in (0, WAVESHARE_ALL_RELAYS_MASK):
+            mode = (
+                WaveShareRelayControl.Close if desired else WaveShareRelayControl.Open
+            )
+            resp = client.write_coil(
+                address=WAVESHARE_WRITE_ALL_RELAYS_IDX,
+                value=mode.value,  # type: ignore
+                slave=device,
+            )
+        else:
+            first = (changed & -changed).bit_length() - 1
+            last = changed.bit_length() - 1
+            resp = client.write_coils(
+                address=first,
+                values=[bool(desired >> i & 1) for i in range(first, last + 1)],
+                slave=device,
+            )
+        if isinstance(resp, Exception):
+            raise resp
+        if resp.isError():
+            raise ValueError(f"Writing relays failed: {resp}")
@@ -0,0 +1,178 @@
+"""One worker thread per bus.
+
+Each BusWorker runs its own asyncio event loop and Engine for one configured bus,
+so buses are driven independently: a slow serial bus never holds up the event loop
+of another, and each USB adapter or gateway adds its own throughput. Readings from
+all workers go to one sink, which is called under a lock.
+
+When polling serial buses until interrupted, one PortWatcher watches for USB
+adapters being plugged in for all workers, and a worker whose adapter is back
+reconnects at once, through the adapter's new device if it got another one,
+instead of waiting for the client's reconnect backoff.
+"""
+
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+from contextlib import AbstractContextManager
+from typing import Callable
+from typing import Optional
+
+from mbe import discovery
+from mbe import make_client
+from mbe.cli_config import BusConfig
+from mbe.cli_config import MbeConfig
+from mbe.cli_config import Modes
+from mbe.engine import Bus
+from mbe.engine import Engine
+from mbe.engine import Reading
+from mbe.engine import Sink
+from mbe.metrics import Metrics
+from mbe.pollers import make_poller
+
+logger = logging.getLogger(__name__)
+
+
+def locked(sink: Sink, lock: threading.Lock) -> Sink:
+    """sink, called only while holding lock."""
+
+    def locked_sink(reading: Reading) -> None:
+        with lock:
+            sink(reading)
+
+    return locked_sink
+
+
+class BusWorker(threading.Thread):
+    """Polls the devices of one bus from its own thread and event loop."""
+
+    bus: BusConfig
+    error: Optional[BaseException]
+
+    def __init__(
+        self,
+        bus: BusConfig,
+        make_bus: Callable[[BusConfig], Bus],
+        sink: Sink,
+        itr: Optional[int] = None,
+        interval: Optional[float] = None,
+    ) -> None:
+        super().__init__(name=f"bus {bus.name}", daemon=True)
+        self.bus = bus
+        self.make_bus = make_bus
+        self.sink = sink
+        self.itr = itr
+        self.interval = interval
+        self.error = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._bus: Optional[Bus] = None
+        self._stopping = threading.Event()
+
+    async def _run(self) -> None:
+        # pymodbus asyncio clients must be created inside the running loop.
+        bus = self._bus = self.make_bus(self.bus)
+        engine = Engine(self.sink)
+        for device in self.bus.devices:
+            engine.add(bus, make_poller(device, self.interval))
+        self._task = asyncio.current_task()
+        if self._stopping.is_set():
+            return
+        await engine.run(self.itr)
+
+    def ports_changed(self, added: set[str], removed: set[str]) -> None:
+        """Reconnect if the adapter of a serial bus was plugged in. Called from the
+        PortWatcher thread."""
+        loop, bus = self._loop, self._bus
+        if self.bus.mode != Modes.serial or not added:
+            return
+        if loop is None or bus is None or loop.is_closed():
+            return
+        port = discovery.resolve(self.bus.serial, refresh=True)
+        if port is None or port not in added:
+            return
+        logger.info("%s plugged in as %s, reconnecting", self.bus.name, port)
+
+        async def reconnect() -> None:
+            assert bus is not None
+            await bus.reconnect(make_client.make_async(self.bus, port))
+
+        asyncio.run_coroutine_threadsafe(reconnect(), loop)
+
+    def run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._run())
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.exception("Polling %s failed", self.bus.name)
+            self.error = e
+        finally:
+            self._loop.close()
+
+    def stop(self) -> None:
+        """Cancel the polling, from any thread."""
+        self._stopping.set()
+        loop, task = self._loop, self._task
+        if loop is not None and task is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(task.cancel)
+
+
+def run_workers(
+    cfg: MbeConfig,
+    sink: Sink,
+    itr: Optional[int] = None,
+    interval: Optional[float] = None,
+    metrics: Optional[Metrics] = None,
+    lock: Optional[threading.Lock] = None,
+    report: Optional[Callable[[], None]] = None,
+    report_interval: float = 60.0,
+) -> list[BusWorker]:
+    """Poll the devices of every configured bus, one worker thread per bus, until
+    each has polled itr times or, if itr is None, until interrupted.
+
+    sink is called holding lock. report, if given, is called from this thread every
+    report_interval seconds and when the workers have finished. Returns the
+    finished workers.
+    """
+
+    def make_bus(bus: BusConfig) -> Bus:
+        return make_client.make_bus(cfg, metrics, bus)
+
+    sink = locked(sink, threading.Lock() if lock is None else lock)
+    workers = [
+        BusWorker(bus, make_bus, sink, itr, interval) for bus in cfg.bus_configs()
+    ]
+
+    def ports_changed(added: set[str], removed: set[str]) -> None:
+        for worker in workers:
+            worker.ports_changed(added, removed)
+
+    # One watcher for all serial buses, rather than one listing the ports per bus.
+    watcher: AbstractContextManager = contextlib.nullcontext()
+    if itr is None and any(w.bus.mode == Modes.serial for w in workers):
+        watcher = discovery.PortWatcher(ports_changed)
+    for worker in workers:
+        worker.start()
+    try:
+        with watcher:
+            deadline = time.monotonic() + report_interval
+            for worker in workers:
+                # join() with a timeout, so KeyboardInterrupt is delivered.
+                while worker.is_alive():
+                    worker.join(min(0.5, max(0.0, deadline - time.monotonic())))
+                    if time.monotonic() >= deadline:
+                        if report is not None:
+                            report()
+                        deadline += report_interval
+            if report is not None:
+                report()
+    finally:
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.join()
+    return workers
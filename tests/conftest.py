@@ -0,0 +1,13 @@
+from typing import Iterator
+
+import pytest
+
+from mbe.simulator import Simulator
+
+
+@pytest.fixture(scope="session")
+def simulator() -> Iterator[Simulator]:
+    """Simulated Taidecent (2), Waveshare relays (3) and Schneider (12) devices on a
+    Modbus TCP server, as a gateway sees them."""
+    with Simulator() as sim:
+        yield sim
@@ -0,0 +1,110 @@
+from pymodbus.client import ModbusTcpClient
+
+from mbe.cache import CachingClient
+from mbe.cache import RegisterCache
+from mbe.simulator import Simulator
+from mbe.taidecent import TAIDECENT_DEVICE_ID
+from mbe.taidecent import TaidacentRegisters
+from mbe.taidecent import TaidecentRegisterClasses
+
+TTLS = dict(identity=3600.0, config=60.0)
+FC = 0x03
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_cache(clock: Clock, max_entries: int = 1024) -> RegisterCache:
+    cache = RegisterCache(max_entries, clock)
+    cache.classify(2, TaidacentRegisters, TaidecentRegisterClasses, TTLS)
+    return cache
+
+
+def test_only_classified_registers_are_cached() -> None:
+    cache = make_cache(Clock())
+    cache.put(2, FC, 0x00, [2150, 4530])
+    assert cache.get(2, FC, 0x00, 1) is None
+    cache.put(2, FC, 0x64, [0x0C1B, 1])
+    assert cache.get(2, FC, 0x64, 2) == [0x0C1B, 1]
+    # Only one register of a read missing is a miss.
+    assert cache.get(2, FC, 0x63, 2) is None
+
+
+def test_gaps_of_a_block_are_not_cached() -> None:
+    cache = make_cache(Clock())
+    # 0x6A is in no register map; a block read spans it to join 0x69 and 0x6B.
+    cache.put(2, FC, 0x69, [1, 7, 0])
+    assert cache.get(2, FC, 0x6A, 1) is None
+    assert cache.get(2, FC, 0x69, 3) is None
+    assert cache.get(2, FC, 0x69, 1) == [1]
+    assert cache.get(2, FC, 0x6B, 1) == [0]
+
+
+def test_ttl_of_register_class() -> None:
+    clock = Clock()
+    cache = make_cache(clock)
+    cache.put(2, FC, 0x64, [0x0C1B])
+    cache.put(2, FC, 0x67, [2])
+    clock.now = 59.0
+    assert cache.get(2, FC, 0x67, 1) == [2]
+    clock.now = 60.0
+    assert cache.get(2, FC, 0x67, 1) is None
+    assert cache.get(2, FC, 0x64, 1) == [0x0C1B]
+    clock.now = 3600.0
+    assert cache.get(2, FC, 0x64, 1) is None
+
+
+def test_lru_eviction() -> None:
+    cache = make_cache(Clock(), max_entries=2)
+    cache.put(2, FC, 0x64, [1])
+    cache.put(2, FC, 0x65, [2])
+    cache.get(2, FC, 0x64, 1)
+    cache.put(2, FC, 0x67, [3])
+    assert len(cache) == 2
+    assert cache.get(2, FC, 0x65, 1) is None
+    assert cache.get(2, FC, 0x64, 1) == [1]
+
+
+def test_write_invalidates_written_registers() -> None:
+    cache = make_cache(Clock())
+    cache.put(2, FC, 0x67, [2, 0])
+    cache.invalidate_write(2, 0x68, [1])
+    assert cache.get(2, FC, 0x67, 1) == [2]
+    assert cache.get(2, FC, 0x68, 1) is None
+
+
+def test_address_write_invalidates_old_and_new_id() -> None:
+    cache = make_cache(Clock())
+    cache.classify(5, TaidacentRegisters, TaidecentRegisterClasses, TTLS)
+    cache.put(2, FC, 0x64, [1])
+    cache.put(5, FC, 0x64, [1])
+    cache.invalidate_write(2, TaidacentRegisters["DeviceAddress"], [5])
+    assert len(cache) == 0
+
+
+def test_caching_client(simulator: Simulator) -> None:
+    cache = RegisterCache()
+    cache.classify(
+        TAIDECENT_DEVICE_ID, TaidacentRegisters, TaidecentRegisterClasses, TTLS
+    )
+    client = CachingClient(ModbusTcpClient(simulator.host, port=simulator.port), cache)
+    client.connect()
+    try:
+        address = TaidacentRegisters["ModelCode"]
+        for _ in range(3):
+            resp = client.read_holding_registers(
+                address=address, count=1, slave=TAIDECENT_DEVICE_ID
+            )
+            assert resp.registers == [0x0C1B]
+        assert (client.misses, client.hits) == (1, 2)
+        # The live temperature is never served from the cache.
+        for _ in range(2):
+            client.read_holding_registers(address=0, count=1, slave=TAIDECENT_DEVICE_ID)
+        assert (client.misses, client.hits) == (3, 2)
+    finally:
+        client.close()
@@ -0,0 +1,76 @@
+from pathlib import Path
+
+import pytest
+
+from mbe.capture import SEGMENT_FRAMES
+from mbe.capture import CaptureReader
+from mbe.capture import CaptureWriter
+
+FRAMES = [
+    (i * 0.5, bytes([1 + i % 3, 3, i % 256])) for i in range(2 * SEGMENT_FRAMES + 5)
+]
+
+
+def write(path: Path, frames=FRAMES, close: bool = True) -> None:
+    writer = CaptureWriter(path)
+    for timestamp, data in frames:
+        writer.append(timestamp, data)
+    if close:
+        writer.close()
+    else:
+        writer.flush()
+
+
+def test_round_trip(tmp_path: Path) -> None:
+    path = tmp_path / "c.mbecap"
+    write(path)
+    with CaptureReader(path) as reader:
+        assert reader.frame_count == len(FRAMES)
+        assert len(reader.segments) == 3
+        assert (reader.start, reader.end) == (FRAMES[0][0], FRAMES[-1][0])
+        assert [(t, bytes(f)) for t, f in reader.frames()] == FRAMES
+
+
+def test_time_window_and_slave(tmp_path: Path) -> None:
+    path = tmp_path / "c.mbecap"
+    write(path)
+    with CaptureReader(path) as reader:
+        window = [(t, bytes(f)) for t, f in reader.frames(start=600.0, end=610.0)]
+        assert window == [(t, f) for t, f in FRAMES if 600.0 <= t <= 610.0]
+        slave = [(t, bytes(f)) for t, f in reader.frames(slave=2)]
+        assert slave == [(t, f) for t, f in FRAMES if f[0] == 2]
+        assert list(reader.frames(slave=9)) == []
+
+
+def test_unclosed_capture_is_scanned(tmp_path: Path) -> None:
+    path = tmp_path / "c.mbecap"
+    write(path, close=False)
+    # A record cut short by the interruption is ignored.
+    with path.open("ab") as f:
+        f.write(b"\x00\x01\x02")
+    with CaptureReader(path) as reader:
+        assert [(t, bytes(f)) for t, f in reader.frames()] == FRAMES
+
+
+def test_writer_resumes_capture(tmp_path: Path) -> None:
+    path = tmp_path / "c.mbecap"
+    write(path, FRAMES[:10])
+    write(path, FRAMES[10:])
+    with CaptureReader(path) as reader:
+        assert [(t, bytes(f)) for t, f in reader.frames()] == FRAMES
+
+
+def test_not_a_capture(tmp_path: Path) -> None:
+    path = tmp_path / "c.mbecap"
+    path.write_bytes(b"something else")
+    with pytest.raises(ValueError):
+        CaptureReader(path)
+
+
+def test_empty_file_is_an_empty_capture(tmp_path: Path) -> None:
+    path = tmp_path / "c.mbecap"
+    path.touch()
+    with CaptureReader(path) as reader:
+        assert reader.frame_count == 0
+        assert reader.start is None and reader.end is None
+        assert list(reader.frames()) == []
@@ -0,0 +1,21 @@
+import re
+
+from typer.testing import CliRunner
+
+from mbe.bridge import DEFAULT_BRIDGE_PORT
+from mbe.bridge import DEFAULT_FRESH
+from mbe.cli import app
+
+
+def test_bridge_help_shows_bridge_defaults() -> None:
+    result = CliRunner().invoke(app, ["bridge", "--help"], env=dict(COLUMNS="200"))
+    assert result.exit_code == 0
+    defaults = re.findall(r"\[default: \(?([^\])]+)\)?\]", result.output)
+    assert defaults == [str(DEFAULT_BRIDGE_PORT), str(DEFAULT_FRESH)]
+
+
+def test_sniff_rejects_raw_with_record_or_stats() -> None:
+    for extra in (["--stats"], ["--record", "capture.mbecap"]):
+        result = CliRunner().invoke(app, ["sniff", "--raw", *extra])
+        assert result.exit_code == 2
+        assert "--raw cannot be combined" in result.output
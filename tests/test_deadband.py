@@ -0,0 +1,75 @@
+from mbe.cli_config import Deadband
+from mbe.deadband import DeadbandFilter
+from mbe.engine import Reading
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make(clock: Clock, **deadbands: Deadband) -> tuple[DeadbandFilter, list]:
+    passed: list[float | int | str] = []
+    deadband = DeadbandFilter(
+        lambda reading: passed.append(reading.value),
+        {f"dev.{point}": band for point, band in deadbands.items()},
+        heartbeat=60.0,
+        clock=clock,
+    )
+    return deadband, passed
+
+
+def feed(deadband: DeadbandFilter, point: str, *values: float | int | str) -> None:
+    for value in values:
+        deadband(Reading("dev", point, value, 0.0))
+
+
+def test_absolute_deadband() -> None:
+    deadband, passed = make(Clock(), t=Deadband(absolute=0.5))
+    feed(deadband, "t", 20.0, 20.3, 20.5, 20.6, 20.2, 21.2)
+    # Moves are measured from the last value passed, not the last value read.
+    assert passed == [20.0, 20.6, 21.2]
+    assert (deadband.passed, deadband.suppressed) == (3, 3)
+
+
+def test_percent_deadband() -> None:
+    deadband, passed = make(Clock(), v=Deadband(percent=1.0))
+    feed(deadband, "v", 230.0, 232.0, 232.4, 227.5)
+    assert passed == [230.0, 232.4, 227.5]
+
+
+def test_larger_of_absolute_and_percent() -> None:
+    deadband, passed = make(Clock(), i=Deadband(absolute=0.05, percent=2.0))
+    feed(deadband, "i", 1.0, 1.06, 10.0, 10.15, 10.25)
+    assert passed == [1.0, 1.06, 10.0, 10.25]
+
+
+def test_points_without_deadband_pass_any_change() -> None:
+    deadband, passed = make(Clock())
+    feed(deadband, "x", 1.0, 1.0, 1.0001, 5, 5, 6, "a", "a", "b")
+    assert passed == [1.0, 1.0001, 5, 6, "a", "b"]
+
+
+def test_heartbeat() -> None:
+    clock = Clock()
+    deadband, passed = make(clock, t=Deadband(absolute=1.0))
+    feed(deadband, "t", 20.0)
+    clock.now = 59.0
+    feed(deadband, "t", 20.1)
+    clock.now = 60.0
+    feed(deadband, "t", 20.1)
+    clock.now = 100.0
+    feed(deadband, "t", 20.1)
+    assert passed == [20.0, 20.1]
+
+
+def test_points_are_filtered_separately() -> None:
+    deadband, passed = make(Clock(), a=Deadband(absolute=1.0))
+    feed(deadband, "a", 1.0)
+    feed(deadband, "b", 1.0)
+    feed(deadband, "a", 1.5)
+    feed(deadband, "b", 1.5)
+    assert passed == [1.0, 1.0, 1.5]
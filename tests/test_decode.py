@@ -0,0 +1,89 @@
+import struct
+
+import pytest
+
+from mbe.decode import BlockDecoder
+from mbe.decode import Encoding
+from mbe.decode import Kind
+from mbe.decode import WordOrder
+from mbe.decode import decode_batch
+from mbe.decode import decode_snapshots
+from mbe.decode import decode_value
+from mbe.decode import float32
+from mbe.decode import int16
+from mbe.decode import int32
+from mbe.decode import string
+from mbe.decode import uint16
+from mbe.decode import uint32
+from mbe.planner import plan_reads
+
+
+def float_words(value: float) -> list[int]:
+    return list(struct.unpack(">HH", struct.pack(">f", value)))
+
+
+def test_16_bit() -> None:
+    assert decode_value(uint16(), [0xFFFF]) == 0xFFFF
+    assert decode_value(int16(), [0xFFFF]) == -1
+    assert decode_value(int16(), [0x8000]) == -32768
+
+
+def test_scale_gives_nearest_float() -> None:
+    assert decode_value(int16(scale=0.01), [57]) == 0.57
+    assert decode_value(int16(scale=0.01), [-178 & 0xFFFF]) == -1.78
+    assert decode_value(uint16(scale=0.1), [123]) == 12.3
+    assert decode_value(uint16(scale=2.0), [21]) == 42.0
+    values = decode_batch(uint16(scale=0.01), [[v] for v in range(10000)])
+    assert all(value == v / 100 for v, value in enumerate(values.tolist()))
+
+
+def test_32_bit_word_order() -> None:
+    assert decode_value(uint32(), [0x0001, 0x0002]) == 0x00010002
+    assert decode_value(uint32(word_order=WordOrder.little), [0x0001, 0x0002]) == (
+        0x00020001
+    )
+    assert decode_value(int32(), [0xFFFF, 0xFFFE]) == -2
+    assert decode_value(int32(word_order=WordOrder.little), [0xFFFE, 0xFFFF]) == -2
+    assert decode_value(int32(scale=0.001), [0, 1500]) == 1.5
+
+
+def test_float32_word_order() -> None:
+    high, low = float_words(230.5)
+    assert decode_value(float32(), [high, low]) == 230.5
+    assert decode_value(float32(WordOrder.little), [low, high]) == 230.5
+    assert decode_value(float32(), float_words(50.02)) == pytest.approx(50.02)
+
+
+def test_string() -> None:
+    words = list(struct.unpack(">4H", b"PM5110\0\0"))
+    assert decode_value(string(4), words) == "PM5110"
+
+
+def test_encoding_checks_words() -> None:
+    with pytest.raises(ValueError):
+        Encoding(Kind.float32, 1)
+    with pytest.raises(ValueError):
+        Encoding(Kind.string, 0)
+
+
+def test_decode_batch() -> None:
+    values = decode_batch(int16(), [[1], [0xFFFF], [2]])
+    assert values.tolist() == [1, -1, 2]
+
+
+def test_decode_snapshots() -> None:
+    encodings = dict(t=int16(scale=0.01), p=float32())
+    snapshots = [dict(t=[2150], p=float_words(1.5)), dict(t=[2200], p=float_words(2.5))]
+    decoded = decode_snapshots(encodings, snapshots)
+    assert decoded["t"].tolist() == [21.5, 22.0]
+    assert decoded["p"].tolist() == [1.5, 2.5]
+
+
+def test_block_decoder() -> None:
+    block = plan_reads(dict(t=0, p=(2, 2), unused=4))[0]
+    decoder = BlockDecoder(block, dict(t=int16(), p=float32()))
+    rows = [[0xFFFF, 0, *float_words(3.0), 9], [7, 0, *float_words(-1.0), 9]]
+    decoded = decoder.decode(rows)
+    assert decoded["t"].tolist() == [-1, 7]
+    assert decoded["p"].tolist() == [3.0, -1.0]
+    assert "unused" not in decoded
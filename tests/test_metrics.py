@@ -0,0 +1,62 @@
+import pytest
+from pymodbus.pdu.register_read_message import ReadHoldingRegistersRequest
+from pymodbus.pdu.register_read_message import ReadHoldingRegistersResponse
+
+from mbe.metrics import BUSY_HORIZON
+from mbe.metrics import TCP_OVERHEAD
+from mbe.metrics import BusyTime
+from mbe.metrics import Metrics
+
+
+def test_busy_time_is_the_union_of_intervals() -> None:
+    busy = BusyTime()
+    busy.add(0.0, 1.0)
+    busy.add(0.5, 2.0)
+    busy.add(3.0, 4.0)
+    assert busy.total == pytest.approx(3.0)
+    # Spans the gap and both intervals around it.
+    busy.add(1.5, 3.5)
+    assert busy.total == pytest.approx(4.0)
+    assert list(busy.intervals) == [(0.0, 4.0)]
+
+
+def test_busy_time_out_of_order() -> None:
+    busy = BusyTime()
+    # A later transaction completes first.
+    busy.add(1.0, 2.0)
+    busy.add(0.0, 3.0)
+    busy.add(5.0, 6.0)
+    busy.add(4.0, 4.5)
+    assert busy.total == pytest.approx(4.5)
+    assert list(busy.intervals) == [(0.0, 3.0), (4.0, 4.5), (5.0, 6.0)]
+
+
+def test_busy_time_forgets_old_intervals() -> None:
+    busy = BusyTime()
+    busy.add(0.0, 1.0)
+    busy.add(BUSY_HORIZON + 2.0, BUSY_HORIZON + 3.0)
+    assert list(busy.intervals) == [(BUSY_HORIZON + 2.0, BUSY_HORIZON + 3.0)]
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_pipelined_utilization_at_most_one() -> None:
+    clock = Clock()
+    metrics = Metrics(clock=clock)
+    request = ReadHoldingRegistersRequest(0, 1, slave=2)
+    response = ReadHoldingRegistersResponse([1], slave=2)
+    # Four 1 s transactions in flight at a time, back to back for 10 s.
+    for i in range(37):
+        clock.now = 1.0 + i * 0.25
+        metrics.observe("gw", request, response, 1.0, TCP_OVERHEAD)
+    bus = metrics.to_json()["buses"]["gw"]
+    assert bus["utilization"] == pytest.approx(1.0)
+    assert bus["devices"]["2"]["utilization"] == pytest.approx(1.0)
+    assert bus["devices"]["2"]["functions"]["3"]["busy_seconds"] == 37.0
+    assert 'mbe_bus_utilization{bus="gw"} 1' in metrics.prometheus()
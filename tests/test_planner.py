@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+from pymodbus.client import ModbusTcpClient
+from pymodbus.exceptions import ModbusIOException
+from pymodbus.pdu.register_read_message import ReadHoldingRegistersResponse
+
+from mbe.planner import ReadBlock
+from mbe.planner import RegisterSpec
+from mbe.planner import plan_reads
+from mbe.planner import read_planned
+from mbe.planner import read_planned_async
+from mbe.planner import register_specs
+from mbe.simulator import Simulator
+from mbe.taidecent import TAIDECENT_DEVICE_ID
+from mbe.taidecent import TaidacentRegisters
+
+
+def spans(plan: list[ReadBlock]) -> list[tuple[int, int]]:
+    return [(block.address, block.count) for block in plan]
+
+
+def test_register_specs_sorted_by_address() -> None:
+    specs = register_specs(dict(b=10, a=(2, 3), c=0))
+    assert specs == [
+        RegisterSpec("c", 0, 1),
+        RegisterSpec("a", 2, 3),
+        RegisterSpec("b", 10, 1),
+    ]
+
+
+def test_neighbors_merge_across_small_gaps() -> None:
+    plan = plan_reads(dict(a=0, b=1, c=(5, 2), d=30), max_gap=4)
+    assert spans(plan) == [(0, 7), (30, 1)]
+    assert [spec.name for spec in plan[0].registers] == ["a", "b", "c"]
+
+
+def test_gap_larger_than_max_gap_splits() -> None:
+    assert spans(plan_reads(dict(a=0, b=6), max_gap=4)) == [(0, 1), (6, 1)]
+    assert spans(plan_reads(dict(a=0, b=6), max_gap=5)) == [(0, 7)]
+
+
+def test_blocks_no_longer_than_max_count() -> None:
+    plan = plan_reads({str(i): i for i in range(10)}, max_count=4)
+    assert spans(plan) == [(0, 4), (4, 4), (8, 2)]
+
+
+def test_register_longer_than_max_count() -> None:
+    with pytest.raises(ValueError):
+        plan_reads(dict(a=(0, 10)), max_count=4)
+
+
+def test_overlapping_registers_merge() -> None:
+    assert spans(plan_reads(dict(a=(0, 4), b=(2, 1), c=(3, 3)))) == [(0, 6)]
+
+
+def test_blocks_never_cover_poison() -> None:
+    plan = plan_reads(dict(a=0, b=4, c=8), max_gap=8, poison=[(2, 1)])
+    assert spans(plan) == [(0, 1), (4, 5)]
+
+
+def test_poisoned_register_is_read_alone() -> None:
+    plan = plan_reads(dict(a=0, b=2, c=3), poison=[(2, 1)])
+    assert spans(plan) == [(0, 1), (2, 1), (3, 1)]
+
+
+def test_split() -> None:
+    block = plan_reads(dict(a=0, b=(2, 2)))[0]
+    assert block.split([10, 11, 12, 13]) == dict(a=[10], b=[12, 13])
+
+
+def test_read_planned(simulator: Simulator) -> None:
+    client = ModbusTcpClient(simulator.host, port=simulator.port)
+    client.connect()
+    try:
+        plan = plan_reads(TaidacentRegisters)
+        assert spans(plan) == [(0x00, 2), (0x64, 9)]
+        results = read_planned(client, TAIDECENT_DEVICE_ID, plan)
+        assert results["Temperature"] == [2150]
+        assert results["ModelCode"] == [0x0C1B]
+        assert results["DeviceAddress"] == [TAIDECENT_DEVICE_ID]
+    finally:
+        client.close()
+
+
+def test_read_planned_falls_back_to_single_reads(simulator: Simulator) -> None:
+    client = ModbusTcpClient(simulator.host, port=simulator.port)
+    client.connect()
+    try:
+        # 0x6D is past the registers of the simulated device.
+        registers = dict(ModelCode=0x64, Missing=0x6D)
+        results = read_planned(client, TAIDECENT_DEVICE_ID, plan_reads(registers))
+        assert results["ModelCode"] == [0x0C1B]
+        assert isinstance(results["Missing"], Exception)
+    finally:
+        client.close()
+
+
+class BlockFailingClient:
+    """Raises on reads of more than one register, and answers single reads with
+    their address."""
+
+    async def read_holding_registers(self, address: int, slave: int, count: int):
+        if count > 1:
+            raise ModbusIOException("timed out")
+        return ReadHoldingRegistersResponse([address], slave=slave)
+
+
+def test_read_planned_async_falls_back_on_raised_errors() -> None:
+    plan = plan_reads(dict(a=0, b=1, c=9))
+    client = BlockFailingClient()
+    results = asyncio.run(read_planned_async(client, 1, plan))  # type: ignore[arg-type]
+    assert results == dict(a=[0], b=[1], c=[9])
+
+
+class ShortReadClient:
+    """Answers every read with one register fewer than requested."""
+
+    def read_holding_registers(self, address: int, slave: int, count: int):
+        return ReadHoldingRegistersResponse(list(range(count - 1)), slave=slave)
+
+
+def test_short_read_fails_its_registers() -> None:
+    plan = plan_reads(dict(a=0, b=(2, 2)))
+    results = read_planned(ShortReadClient(), 1, plan)  # type: ignore[arg-type]
+    assert isinstance(results["a"], Exception)
+    assert isinstance(results["b"], Exception)
@@ -0,0 +1,71 @@
+import pytest
+
+from mbe.engine import Reading
+from mbe.recorder import Bucket
+from mbe.recorder import Recorder
+from mbe.recorder import RingBuffer
+
+
+def filled(capacity: int, n: int) -> RingBuffer:
+    ring = RingBuffer(capacity)
+    for i in range(n):
+        ring.append(float(i), 10.0 * i)
+    return ring
+
+
+def test_capacity_must_be_positive() -> None:
+    with pytest.raises(ValueError):
+        RingBuffer(0)
+
+
+def test_before_wraparound() -> None:
+    ring = filled(5, 3)
+    assert len(ring) == 3
+    assert list(ring.samples()) == [(0.0, 0.0), (1.0, 10.0), (2.0, 20.0)]
+    assert ring.last() == (2.0, 20.0)
+    assert RingBuffer(5).last() is None
+
+
+def test_wraparound_keeps_the_newest() -> None:
+    ring = filled(5, 12)
+    assert len(ring) == 5
+    assert [t for t, _ in ring.samples()] == [7.0, 8.0, 9.0, 10.0, 11.0]
+    assert ring.last() == (11.0, 110.0)
+
+
+def test_samples_window_across_wraparound() -> None:
+    ring = filled(5, 12)
+    assert [t for t, _ in ring.samples(8.0, 10.0)] == [8.0, 9.0]
+    assert [t for t, _ in ring.samples(8.5)] == [9.0, 10.0, 11.0]
+    assert [t for t, _ in ring.samples(end=7.0)] == []
+
+
+def test_downsample() -> None:
+    ring = filled(100, 10)
+    assert ring.downsample(0.0, 10.0, 4.0) == [
+        Bucket(0.0, 4, 0.0, 30.0, 15.0),
+        Bucket(4.0, 4, 40.0, 70.0, 55.0),
+        Bucket(8.0, 2, 80.0, 90.0, 85.0),
+    ]
+    assert ring.downsample(2.0, 5.0) == [Bucket(2.0, 3, 20.0, 40.0, 30.0)]
+    with pytest.raises(ValueError):
+        ring.downsample(0.0, 10.0, 0.0)
+
+
+def test_downsample_omits_empty_buckets() -> None:
+    ring = RingBuffer(10)
+    ring.append(0.0, 1.0)
+    ring.append(9.0, 3.0)
+    buckets = ring.downsample(0.0, 10.0, 2.0)
+    assert [(b.start, b.count) for b in buckets] == [(0.0, 1), (8.0, 1)]
+
+
+def test_recorder() -> None:
+    recorder = Recorder(capacity=2)
+    for i in range(3):
+        recorder.record(Reading("taidecent", "Temperature", 20.0 + i, float(i)))
+    recorder.record(Reading("schneider", "Name", "PM5110", 0.0))
+    assert recorder.points() == [("taidecent", "Temperature")]
+    buckets = recorder.downsample("taidecent", "Temperature", 0.0, 3.0)
+    assert buckets == [Bucket(0.0, 2, 21.0, 22.0, 21.5)]
+    assert recorder.downsample("taidecent", "Humidity", 0.0, 3.0) == []
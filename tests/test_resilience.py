@@ -0,0 +1,135 @@
+import random
+
+import pytest
+from pymodbus.exceptions import ModbusIOException
+from pymodbus.pdu import ExceptionResponse
+
+from mbe.cli_config import ResilienceConfig
+from mbe.resilience import CLOSED
+from mbe.resilience import HALF_OPEN
+from mbe.resilience import OPEN
+from mbe.resilience import CircuitOpen
+from mbe.resilience import Resilience
+from mbe.resilience import no_response
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+CONFIG = ResilienceConfig(
+    timeout=1.0,
+    min_timeout=0.1,
+    max_timeout=3.0,
+    retries=2,
+    failures=3,
+    cooldown=10.0,
+    max_cooldown=40.0,
+)
+
+
+def make(clock: Clock) -> Resilience:
+    return Resilience(CONFIG, "test", clock, random.Random(1))
+
+
+def test_timeout_follows_response_times() -> None:
+    resilience = make(Clock())
+    assert resilience.timeout(1) == 1.0
+    resilience.answered(1, 0.2)
+    # srtt 0.2, rttvar 0.1
+    assert resilience.timeout(1) == pytest.approx(0.6)
+    for _ in range(50):
+        resilience.answered(1, 0.01)
+    assert resilience.timeout(1) == 0.1
+    # Unsampled answers leave the estimate alone.
+    resilience.answered(1, 2.0, sample=False)
+    assert resilience.timeout(1) == 0.1
+
+
+def test_timeout_doubles_without_response() -> None:
+    resilience = make(Clock())
+    resilience.failed(1)
+    assert resilience.timeout(1) == 2.0
+    resilience.failed(1)
+    assert resilience.timeout(1) == 3.0
+
+
+def test_circuit_breaker() -> None:
+    clock = Clock()
+    resilience = make(clock)
+    for _ in range(3):
+        resilience.admit(1)
+        resilience.failed(1)
+    assert resilience.slaves[1].state == OPEN
+    with pytest.raises(CircuitOpen):
+        resilience.admit(1)
+    # Other slaves are not affected.
+    resilience.admit(2)
+
+    # After the cooldown one probe goes through; its failure doubles the cooldown.
+    clock.now = 10.0
+    resilience.admit(1)
+    assert resilience.slaves[1].state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        resilience.admit(1)
+    resilience.failed(1)
+    assert resilience.slaves[1].state == OPEN
+    clock.now = 29.0
+    with pytest.raises(CircuitOpen):
+        resilience.admit(1)
+
+    # An answered probe closes the breaker.
+    clock.now = 30.0
+    resilience.admit(1)
+    resilience.answered(1, 0.05)
+    assert resilience.slaves[1].state == CLOSED
+    assert resilience.slaves[1].cooldown == 10.0
+    resilience.admit(1)
+
+
+def test_cooldown_limited_to_max_cooldown() -> None:
+    clock = Clock()
+    resilience = make(clock)
+    for _ in range(3):
+        resilience.failed(1)
+    for _ in range(5):
+        clock.now = resilience.slaves[1].retry_at
+        resilience.admit(1)
+        resilience.failed(1)
+    assert resilience.slaves[1].cooldown == 40.0
+
+
+def test_skipped_probe_lets_the_next_through() -> None:
+    clock = Clock()
+    resilience = make(clock)
+    for _ in range(3):
+        resilience.failed(1)
+    clock.now = 10.0
+    resilience.admit(1)
+    resilience.skipped(1)
+    resilience.admit(1)
+    assert resilience.slaves[1].state == HALF_OPEN
+
+
+def test_retry_delay() -> None:
+    resilience = make(Clock())
+    for attempt in range(2):
+        delay = resilience.retry_delay(1, attempt)
+        assert delay is not None and 0 <= delay <= CONFIG.backoff * 2**attempt
+    assert resilience.retry_delay(1, 2) is None
+    for _ in range(3):
+        resilience.failed(1)
+    assert resilience.retry_delay(1, 0) is None
+
+
+def test_no_response() -> None:
+    assert no_response(ModbusIOException("timeout"))
+    assert no_response(TimeoutError())
+    assert no_response(ExceptionResponse(3, 0x0B))
+    assert no_response(ExceptionResponse(3, 0))
+    assert not no_response(ExceptionResponse(3, 0x02))
+    assert not no_response(None)
@@ -0,0 +1,103 @@
+from mbe.rtu import FrameBuffer
+from mbe.rtu import candidate_lengths
+from mbe.rtu import crc16
+from mbe.rtu import crc_ok
+from mbe.rtu import decode_frame
+
+
+def with_crc(data: bytes) -> bytes:
+    crc = crc16(data)
+    return data + bytes([crc & 0xFF, crc >> 8])
+
+
+READ_REQUEST = bytes.fromhex("01030000000AC5CD")
+
+
+def test_crc16() -> None:
+    assert crc16(READ_REQUEST[:-2]) == 0xCDC5
+    assert crc_ok(READ_REQUEST)
+    assert not crc_ok(READ_REQUEST[:-1] + b"\x00")
+    assert not crc_ok(b"\x01\x03")
+
+
+def test_candidate_lengths() -> None:
+    assert candidate_lengths(b"\x01") == []
+    # A read is an 8 byte request, or a response with a byte count.
+    assert candidate_lengths(b"\x01\x03") == [(8, True)]
+    assert candidate_lengths(b"\x01\x03\x04") == [(8, True), (9, False)]
+    assert candidate_lengths(b"\x01\x83\x02") == [(5, False)]
+    assert candidate_lengths(b"\x01\x06") == [(8, True), (8, False)]
+    assert candidate_lengths(b"\x01\x10\x00\x00\x00\x02\x04") == [
+        (13, True),
+        (8, False),
+    ]
+    assert candidate_lengths(b"\x00\x00\x01\x03", start=2) == [(8, True)]
+
+
+def test_decode_read_request_and_response() -> None:
+    request = decode_frame(READ_REQUEST, 1.0)
+    assert request.is_request
+    assert (request.slave, request.function) == (1, 3)
+    assert (request.address, request.count) == (0, 10)
+    response = decode_frame(with_crc(b"\x01\x03\x04\x00\x2a\x12\x34"), 2.0)
+    assert response.is_request is False
+    assert response.values == [42, 0x1234]
+
+
+def test_decode_exception() -> None:
+    frame = decode_frame(with_crc(b"\x01\x83\x02"), 0.0)
+    assert frame.is_exception and frame.exception_code == 2
+
+
+def test_decode_bad_crc() -> None:
+    frame = decode_frame(READ_REQUEST[:-1] + b"\x00", 0.0)
+    assert not frame.crc_ok and frame.address is None
+
+
+def test_frame_buffer_encode() -> None:
+    frames = FrameBuffer()
+    assert bytes(frames.encode(1, 3, b"\x00\x00\x00\x0a")) == READ_REQUEST
+
+
+def receive(frames: FrameBuffer, data: bytes) -> None:
+    space = frames.space()
+    space[: len(data)] = data
+    frames.received(len(data))
+
+
+def test_frame_buffer_response_in_pieces() -> None:
+    frames = FrameBuffer()
+    frames.encode(1, 3, b"\x00\x00\x00\x02")
+    response = with_crc(b"\x01\x03\x04\x00\x01\x00\x02")
+    receive(frames, response[:4])
+    assert frames.response() is None
+    receive(frames, response[4:])
+    frame = frames.response()
+    assert frame is not None and bytes(frame) == response
+
+
+def test_frame_buffer_skips_noise_and_other_slaves() -> None:
+    frames = FrameBuffer()
+    frames.encode(2, 3, b"\x00\x00\x00\x01")
+    other = with_crc(b"\x01\x03\x02\x00\x07")
+    response = with_crc(b"\x02\x03\x02\x00\x2a")
+    receive(frames, b"\xff\x00" + other + response)
+    frame = frames.response()
+    assert frame is not None and bytes(frame) == response
+
+
+def test_frame_buffer_exception_response() -> None:
+    frames = FrameBuffer()
+    frames.encode(2, 3, b"\x00\x00\x00\x01")
+    response = with_crc(b"\x02\x83\x02")
+    receive(frames, response)
+    frame = frames.response()
+    assert frame is not None and bytes(frame) == response
+
+
+def test_frame_buffer_encode_empties_receive_buffer() -> None:
+    frames = FrameBuffer()
+    frames.encode(2, 3, b"\x00\x00\x00\x01")
+    receive(frames, b"\x02\x03")
+    frames.encode(2, 3, b"\x00\x00\x00\x01")
+    assert frames.length == 0
@@ -0,0 +1,36 @@
+from mbe import scanner
+from mbe.scanner import AdaptiveTimeout
+from mbe.scanner import TcpTransport
+from mbe.simulator import Simulator
+
+
+def test_scan_tcp_finds_only_devices(simulator: Simulator) -> None:
+    found = scanner.scan_tcp(simulator.host, simulator.port, range(1, 21))
+    assert [r.slave for r in found] == [2, 3, 12]
+    assert found[0].device == "taidecent"
+    assert found[1].device == "waveshare_relays"
+    assert "schneider" in found[2].fingerprints
+
+
+def test_gateway_exception_is_no_device(simulator: Simulator) -> None:
+    transport = TcpTransport(simulator.host, simulator.port)
+    try:
+        pdu = transport.transact(5, scanner.read_request(0, 1), 1.0)
+        assert pdu is not None and pdu[0] == 0x83 and pdu[1] == 0x0B
+        timeout = AdaptiveTimeout()
+        assert scanner.scan_transport(transport, [5], timeout) == []
+        # The gateway answering for the slave says nothing of its response time.
+        assert timeout.slowest is None
+    finally:
+        transport.close()
+
+
+def test_adaptive_timeout() -> None:
+    timeout = AdaptiveTimeout(floor=0.01, initial=0.1)
+    assert timeout.timeout == 0.1
+    timeout.observe(0.001)
+    assert timeout.timeout == 0.01
+    timeout.observe(0.02)
+    assert timeout.timeout == 0.06
+    timeout.observe(5.0)
+    assert timeout.timeout == scanner.MAX_TIMEOUT
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+import pytest
+
+from mbe.scheduler import BusScheduler
+from mbe.scheduler import DeadlineExceeded
+from mbe.scheduler import Priority
+from mbe.scheduler import scheduled
+from mbe.scheduler import scheduling
+
+
+async def grant_order(
+    scheduler: BusScheduler, requests: list[tuple[str, Priority, float | None]]
+) -> list[str]:
+    """Queue requests behind a held slot, release it and return the order in which
+    they got the bus."""
+    order: list[str] = []
+
+    async def transaction(name: str, priority: Priority, deadline: float | None):
+        async with scheduler.slot(priority, deadline):
+            order.append(name)
+
+    await scheduler.acquire()
+    tasks = [asyncio.create_task(transaction(*r)) for r in requests]
+    await asyncio.sleep(0)
+    assert len(scheduler) == len(requests)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_priority_then_deadline_then_arrival() -> None:
+    far = time.monotonic() + 60
+    near = time.monotonic() + 30
+    order = asyncio.run(
+        grant_order(
+            BusScheduler(),
+            [
+                ("telemetry 1", Priority.TELEMETRY, None),
+                ("background", Priority.BACKGROUND, None),
+                ("telemetry 2", Priority.TELEMETRY, None),
+                ("telemetry far", Priority.TELEMETRY, far),
+                ("telemetry near", Priority.TELEMETRY, near),
+                ("control", Priority.CONTROL, None),
+            ],
+        )
+    )
+    assert order == [
+        "control",
+        "telemetry near",
+        "telemetry far",
+        "telemetry 1",
+        "telemetry 2",
+        "background",
+    ]
+
+
+def test_deadline_passed_before_queueing() -> None:
+    async def main() -> None:
+        with pytest.raises(DeadlineExceeded):
+            await BusScheduler().acquire(deadline=time.monotonic() - 1)
+
+    asyncio.run(main())
+
+
+def test_deadline_passed_while_waiting() -> None:
+    async def main() -> None:
+        scheduler = BusScheduler()
+        await scheduler.acquire()
+        waiter = asyncio.create_task(scheduler.acquire(deadline=time.monotonic()))
+        await asyncio.sleep(0.01)
+        scheduler.release()
+        with pytest.raises(DeadlineExceeded):
+            await waiter
+        assert scheduler.active == 0
+
+    asyncio.run(main())
+
+
+def test_capacity() -> None:
+    async def main() -> None:
+        scheduler = BusScheduler(capacity=2)
+        await scheduler.acquire()
+        await scheduler.acquire()
+        assert scheduler.busy
+        waiter = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        scheduler.release()
+        await waiter
+        assert scheduler.active == 2
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_is_skipped() -> None:
+    async def main() -> None:
+        scheduler = BusScheduler()
+        await scheduler.acquire()
+        cancelled = asyncio.create_task(scheduler.acquire(Priority.CONTROL))
+        waiter = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        scheduler.release()
+        await waiter
+        assert scheduler.active == 1
+
+    asyncio.run(main())
+
+
+def test_scheduling() -> None:
+    assert scheduling(0x03) == (Priority.TELEMETRY, None)
+    assert scheduling(0x05) == (Priority.CONTROL, None)
+    with scheduled(Priority.INTERACTIVE, 5.0):
+        priority, deadline = scheduling(0x03)
+        assert priority == Priority.INTERACTIVE
+        assert deadline is not None and deadline > time.monotonic()
+    assert scheduling(0x03) == (Priority.TELEMETRY, None)